@@ -1,8 +1,19 @@
-import tkinter as tk
-from tkinter import filedialog, messagebox, font, PhotoImage
-import json
+import time
+STARTUP_STARTED = time.perf_counter()  # --measure-startup counts from here
 import os
+import queue
+import sys
+
+BATCH_COMMANDS = ("check", "convert", "stats")  # Command line tools that run without Tk, see arcbatch.py
+if len(sys.argv) > 1 and sys.argv[1] in BATCH_COMMANDS:
+    import subprocess
+    # arcbatch.py runs as a script of its own: workers its process pool spawns re-import the main
+    # script, and that must not be this one.
+    sys.exit(subprocess.call([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "arcbatch.py")]
+                             + sys.argv[1:]))
+
 from appdirs import user_config_dir # Import user_config_dir
+import arcinstance
 
 # ---------------------------------------------------
 # INSTALL APPDIRS OR ELSE THIS PROGRAM WILL NOT WORK
@@ -12,35 +23,168 @@ from appdirs import user_config_dir # Import user_config_dir
 APP_NAME = "ArkEditor"
 APP_AUTHOR = "Ark360" 
 
-# Construct the config file path using user_config_dir
+# Construct the config file path using user_config_dir. The directories are made by whatever
+# writes into them first, so startup only reads.
 config_dir = user_config_dir(APP_NAME, APP_AUTHOR)
-os.makedirs(config_dir, exist_ok=True) # Ensure the directory exists
 CONFIG_FILE = os.path.join(config_dir, "config.json")
+JOURNAL_DIR = os.path.join(config_dir, "journal")  # Crash recovery journals, see arcjournal.py
+UNDO_DIR = os.path.join(config_dir, "undo")  # Undo histories of saved files, see arcundo.py
+FONT_CACHE_FILE = os.path.join(config_dir, "fonts.json")  # Installed font families, see arcfonts.py
+LATENCY_LOG_FILE = os.path.join(config_dir, "latency.log")  # JSON lines, rolled over by arcperf
+PROFILE_DIR = os.path.join(config_dir, "profiles")  # cProfile captures from Preferences > Profile
+SPILL_DIR = os.path.join(config_dir, "spill")  # Text of tabs pushed out of memory, see arcspill.py
+INDEX_FILE = os.path.join(config_dir, "index.sqlite3")  # Search All Notes, see arcindex.py
+
+# Command line: ArcNote-0.2.py [--new-instance] [--measure-startup] [file ...]
+# Unless --new-instance is given, files are handed to an editor that is already running and this
+# launch exits before tkinter is even imported.
+COMMAND_LINE_OPTIONS = ("--new-instance", "--measure-startup")
+for argument in sys.argv[1:]:
+    if argument.startswith("--") and argument not in COMMAND_LINE_OPTIONS:
+        sys.exit(f"Unknown option {argument}, the options are {', '.join(COMMAND_LINE_OPTIONS)}")
+MEASURE_STARTUP = "--measure-startup" in sys.argv
+FILE_ARGUMENTS = [os.path.abspath(argument) for argument in sys.argv[1:] if argument not in COMMAND_LINE_OPTIONS]
+forwarded_files = queue.Queue()  # File lists from later launches, opened by poll_forwarded_files
+instance_server = None
+if arcinstance.supported() and "--new-instance" not in sys.argv and not MEASURE_STARTUP:
+    try:
+        instance_server = arcinstance.claim(arcinstance.socket_path(config_dir), FILE_ARGUMENTS, forwarded_files.put)
+    except OSError as e:
+        print("Single instance mode is off:", e)
+    else:
+        if instance_server is None:
+            sys.exit(0)  # The running editor opens the files
+
+import tkinter as tk
+from tkinter import filedialog, messagebox, font, PhotoImage, ttk, simpledialog
+import json
+import re
+import subprocess
+import threading
+from arcdoc import Document, DirtyRanges, WordCount, LongLineScanner, TeeReader, decode_chunks, decode_appended, transcode_text, write_snapshot, first_unencodable, atomic_write, read_document, APPENDABLE_ENCODINGS, FALLBACK_ENCODING, ARC_TRAILING_NEWLINE
+import arcjournal
+from arcmapped import MappedFile
+import arcpack
+import arcsearch
+import arcundo
+import arcperf
+import arcspill
+import arcwatch
+from arcemoji import load_catalogue
+from arcfonts import cached_families
+STARTUP_MARKS = [("imports", time.perf_counter())]  # (step, time it finished), printed by --measure-startup
+
+# Streaming file loader settings
+LOAD_CHUNK_BYTES = 256 * 1024  # Bytes read per chunk by the loader thread
+LOAD_QUEUE_CHUNKS = 4  # Chunks in flight between the loader thread and the UI, keeps memory near one copy of the file
+LOAD_POLL_MS = 15  # How often the UI checks for new chunks when the loader is behind
+SAVE_POLL_MS = 50  # How often the UI checks on a background save
+JOURNAL_FLUSH_MS = 1000  # Edits are written to the crash recovery journal in batches this often
+CONFIG_SAVE_DELAY_MS = 1000  # Config changes are written once things have been quiet this long
+LARGE_INDEX_POLL_MS = 200  # How often the status bar follows the large file indexer
+LARGE_SEARCH_POLL_MS = 30  # How often the UI picks up the result of Search Large File from its thread
+FIND_POLL_MS = 30  # How often the UI picks up matches from the search thread
+FIND_DELAY_MS = 200  # The search restarts once typing in the Find box pauses this long
+REPLACE_ALL_WHOLE_TEXT = 1000  # Replace All with more matches than this rewrites the text in one go
+EMOJI_CELL_SIZE = 40  # Pixels per emoji in the picker grid
+RECENT_EMOJI_COUNT = 10
+LATENCY_OVERLAY_MS = 1000  # How often the latency overlay is refreshed
+LATENCY_EXPORT_MS = 60 * 1000  # How often latency percentiles are appended to the log
+STARTUP_BUDGET_MS = 500  # --measure-startup fails if the first paint takes longer than this
+FORWARDED_POLL_MS = 100  # How often the UI picks up files sent by later launches
+INDEX_POLL_MS = 100  # How often the UI follows the indexer process
+SEARCH_POLL_MS = 30  # How often the UI picks up results of Search All Notes from its thread
+SPILL_POLL_MS = 100  # How often the UI picks up tabs the spill thread has written out
+FILE_CHANGE_POLL_MS = 200  # How often the UI picks up files changed by other programs
+STATS_REFRESH_MS = 16  # The cursor position and counts in the status bar are redrawn at most once a frame
+LONG_LINE_WINDOW = 2000  # Characters of a long line shown at a time, see set_long_lines
+LONG_LINE_MARGIN = 200  # The window moves on once the cursor gets this close to its edge
+# Save As file types, plain .arc first so it stays the default. Compressed files are told apart by
+# their header when opened, whatever they are called.
+SAVE_TYPES = [("Arc Files", "*.arc", "utf-8"),
+              ("Compressed Arc Files", "*.arc", "utf-8+zlib"),
+              ("Compressed Arc Files, smallest (slow to save)", "*.arc", "utf-8+lzma")]
+
+DEFAULT_CONFIG = {"save_hotkey": "<Control-s>", "exit_hotkey": "<Control-q>", "emoji_hotkey": "<Control-i>",
+                  "font": "Arial", "font_size": 12, "dark_mode": False,
+                  "background_config_writes": True,  # Write config.json on a worker thread
+                  "large_file_threshold_mb": 256,  # Files this big open read-only in large file mode
+                  "recent_emojis": [],
+                  "undo_memory_mb": 64,  # Oldest undo steps are dropped once the history holds this much
+                  "persist_undo": True,  # Keep the undo history of saved files for the next time they are opened
+                  "perf_instrumentation": False,  # Time keystrokes, open, save, theme and font changes
+                  "perf_overlay": False,  # Show the latency percentiles in the status bar
+                  "tab_memory_mb": 256,  # Inactive tabs beyond this much text go to the spill cache, least recently used first
+                  "search_folder": "",  # Folder of notes covered by Search All Notes
+                  "long_line_chars": 10000}  # Lines this long are shown LONG_LINE_WINDOW characters at a time
+
 
 # Load and save config functions
 def load_config():
+    config = dict(DEFAULT_CONFIG)
     try:
         with open(CONFIG_FILE, "r") as file:
-            config = json.load(file)
-            if "dark_mode" not in config:
-                config["dark_mode"] = False
-            return config
+            loaded = json.load(file)
     except FileNotFoundError:
-        # Default configuration if file doesn't exist
-        return {"save_hotkey": "<Control-s>", "exit_hotkey": "<Control-q>", "emoji_hotkey": "<Control-i>",
-                "font": "Arial", "font_size": 12, "dark_mode": False}
+        return config  # Default configuration if file doesn't exist
     except Exception as e:
         messagebox.showerror("Error loading config", f"Could not load configuration: {e}\nUsing default settings.")
-        return {"save_hotkey": "<Control-s>", "exit_hotkey": "<Control-q>", "emoji_hotkey": "<Control-i>",
-                "font": "Arial", "font_size": 12, "dark_mode": False}
+        return config
+    # Take only settings of the right type, anything else falls back to the default
+    for key, value in loaded.items():
+        if key not in DEFAULT_CONFIG or isinstance(value, type(DEFAULT_CONFIG[key])):
+            config[key] = value
+    config["font_size"] = max(config["font_size"], 6)
+    return config
 
 
 def save_config():
+    """Marks the config as changed. It is written once changes stop coming for CONFIG_SAVE_DELAY_MS,
+    so holding Ctrl+= writes config.json once instead of once per step."""
+    global config_dirty, config_save_timer
+    config_dirty = True
+    if config_save_timer is not None:
+        root.after_cancel(config_save_timer)
+    config_save_timer = root.after(CONFIG_SAVE_DELAY_MS, flush_config)
+
+
+def flush_config(wait=False):
+    """Writes config.json now if it changed, via a temp file and rename so it is never left half written."""
+    global config_dirty, config_save_timer, config_writer
+    started = time.perf_counter()
+    if config_save_timer is not None:
+        root.after_cancel(config_save_timer)
+        config_save_timer = None
+    if config_dirty:
+        config_dirty = False
+        text = json.dumps(config, indent=4)  # Added indent for readability
+        if config["background_config_writes"] and not wait:
+            if config_writer is not None:
+                config_writer.join()  # Keep writes in order, the previous one is long done by now
+            config_writer = threading.Thread(target=write_config, args=(text,), daemon=True)
+            config_writer.start()
+        else:
+            write_config(text)
+    if wait and config_writer is not None:
+        config_writer.join()
+    report_config_error()
+    arcperf.recorder.record("save_config", time.perf_counter() - started)
+
+
+def write_config(text):
+    global config_error
     try:
-        with open(CONFIG_FILE, "w") as file:
-            json.dump(config, file, indent=4) # Added indent for readability
+        os.makedirs(config_dir, exist_ok=True)
+        atomic_write(CONFIG_FILE, [text], "utf-8")
     except Exception as e:
-        messagebox.showerror("Error saving config", f"Could not save configuration: {e}")
+        config_error = e
+
+
+def report_config_error():
+    global config_error
+    if config_error is not None:
+        error, config_error = config_error, None
+        messagebox.showerror("Error saving config", f"Could not save configuration: {error}")
 
 
 def toggle_dark_mode():
@@ -50,43 +194,80 @@ def toggle_dark_mode():
 
 
 def apply_theme():
+    time_until_idle("apply_theme")
     if config.get("dark_mode", False):
         root.configure(bg="#2E2E2E")
         text_area.configure(bg="#1E1E1E", fg="#FFFFFF", insertbackground="white")
+        status_bar.configure(bg="#2E2E2E")
+        status_label.configure(bg="#2E2E2E", fg="#FFFFFF")
+        undo_label.configure(bg="#2E2E2E", fg="#FFFFFF")
+        stats_label.configure(bg="#2E2E2E", fg="#FFFFFF")
+        latency_label.configure(bg="#2E2E2E", fg="#FFFFFF")
     else:
         root.configure(bg="lightgray")
         text_area.configure(bg="white", fg="black", insertbackground="black")
+        status_bar.configure(bg="lightgray")
+        status_label.configure(bg="lightgray", fg="black")
+        undo_label.configure(bg="lightgray", fg="black")
+        stats_label.configure(bg="lightgray", fg="black")
+        latency_label.configure(bg="lightgray", fg="black")
 
 
 def on_close():
-    if text_area.edit_modified():
-        if messagebox.askyesno("Unsaved Work", "You have unsaved changes. Do you want to save before exiting?"):
-            if not save_file():  # If save_file returns false, the user canceled the save and should not exit.
-                return
-    save_config()
+    cancel_opening()
+    current_tab["modified"] = text_area.edit_modified()
+    for tab in list(tabs):
+        if tab["modified"]:
+            switch_to_tab(tab)  # Show the text being asked about
+            if messagebox.askyesno("Unsaved Work", f"{tab_name(tab)} has unsaved changes. Do you want to save before exiting?"):
+                if not save_file():  # If save_file returns false, the user canceled the save and should not exit.
+                    return
+    close_large_view()
+    if not wait_for_saves():  # A background save failed, keep the window open so nothing is lost
+        return
+    for tab in tabs:  # Clean exit, nothing to recover next time
+        if tab["document"].journal:
+            tab["document"].journal.discard()
+    arcjournal.wait_idle()
+    spill_cache.close()
+    if file_watcher is not None:
+        file_watcher.close()
+    if search_state["process"] is not None:  # Indexed notes are committed in batches, the rest is done next time
+        search_state["process"].terminate()
+    if latency_log is not None:
+        arcperf.export(latency_log)
+    if instance_server is not None:
+        instance_server.close()
+    flush_config(wait=True)
     root.destroy()
 
 def show_about():
-    about_window = tk.Toplevel(root)
-    about_window.title("About Arc Editor")
-    about_window.geometry("300x200")
+    """Shows the About window, which is built the first time and hidden when closed."""
+    global about_window
+    if about_window is None:
+        about_window = tk.Toplevel(root)
+        about_window.title("About Arc Editor")
+        about_window.geometry("300x200")
+        about_window.protocol("WM_DELETE_WINDOW", about_window.withdraw)
 
-    try:
-        # Note: PhotoImage requires a file path; ensure 'icon.png' is accessible
-        # Consider packaging this with your application or placing it in the config_dir
-        icon_image = PhotoImage(file="icon.png")
-        icon_label = tk.Label(about_window, image=icon_image)
-        icon_label.image = icon_image  # Keep reference
-        icon_label.pack()
-    except Exception as e:
-        print("Error loading image:", e)
-        icon_label = tk.Label(about_window, text="📄", font=("Arial", 50))
-        icon_label.pack()
+        try:
+            # Note: PhotoImage requires a file path; ensure 'icon.png' is accessible
+            # Consider packaging this with your application or placing it in the config_dir
+            icon_image = PhotoImage(file="icon.png")
+            icon_label = tk.Label(about_window, image=icon_image)
+            icon_label.image = icon_image  # Keep reference
+            icon_label.pack()
+        except Exception as e:
+            print("Error loading image:", e)
+            icon_label = tk.Label(about_window, text="📄", font=("Arial", 50))
+            icon_label.pack()
 
-    message_label = tk.Label(about_window,
-                             text="Arc Editor\nA simple text editor that uses .arc files\nCreated in Python using Tkinter",
-                             justify="center")
-    message_label.pack()
+        message_label = tk.Label(about_window,
+                                 text="Arc Editor\nA simple text editor that uses .arc files\nCreated in Python using Tkinter",
+                                 justify="center")
+        message_label.pack()
+    about_window.deiconify()
+    about_window.lift()
 
 
 def apply_hotkeys():
@@ -105,140 +286,2282 @@ def apply_hotkeys():
 
 def increase_font_size(event=None):
     config["font_size"] += 1
-    text_area.configure(font=(config["font"], config["font_size"]))
+    apply_font()
     save_config()
 
 
 def decrease_font_size(event=None):
     if config["font_size"] > 6:
         config["font_size"] -= 1
-        text_area.configure(font=(config["font"], config["font_size"]))
+        apply_font()
         save_config()
 
 
+def apply_font():
+    time_until_idle("font_change")
+    text_area.configure(font=(config["font"], config["font_size"]))
+
+
 def open_file():
-    global current_file
     file_path = filedialog.askopenfilename(filetypes=[("Arc Files", "*.arc")])
     if file_path:
-        try:
-            with open(file_path, "r", encoding="utf-8") as file:
-                text_area.delete(1.0, tk.END)
-                text_area.insert(tk.END, file.read())
-            current_file = file_path
-            root.title(f"{file_path} - Arc Editor")
-            text_area.edit_modified(False) # File is just loaded, so no modifications yet
-        except UnicodeDecodeError:  # Try cp1252 as a fallback
+        load_file(file_path)
+
+
+def load_file(file_path, line=None):
+    """Streams file_path into text_area from a worker thread without blocking the main loop. The file
+    gets a tab of its own unless the current tab is an empty Untitled one. If line is given the cursor
+    goes there once the file is in."""
+    global load_state
+    cancel_loading()
+    try:
+        file_size = os.path.getsize(file_path)
+        packed = arcpack.packed_info(file_path)  # (encoding, text size) of a compressed .arc
+    except Exception as e:
+        messagebox.showerror("Error", f"An error occurred while opening: {e}")
+        root.after_idle(open_next_pending)  # The other files handed over with this one still open
+        return
+    for tab in tabs:
+        if file_path in (tab["document"].path, tab["large_path"]):  # Already open
+            if switch_to_tab(tab) and line is not None:
+                show_line(line)
+            root.after_idle(open_next_pending)
+            return
+    if not tab_is_blank(current_tab):
+        new_tab()
+    text_area.delete(1.0, tk.END)
+    text_area.edit_modified(False)
+    set_long_lines([])
+    if document.journal:
+        document.journal.discard()
+    set_document(Document())  # No path yet, not saveable until the whole file is in. Journaled once loaded.
+    update_undo_status()
+    text_size = packed[1] if packed else file_size
+    if text_size >= config["large_file_threshold_mb"] * 1024 * 1024 and open_large_view(file_path, packed):
+        current_tab["large_path"] = file_path
+        update_tab_label()
+        if line is not None:
+            scroll_large_view_to(line)
+        root.after_idle(open_next_pending)
+        return
+    root.title(f"{file_path} (loading) - Arc Editor")
+
+    load_state = {"path": file_path, "size": file_size, "encoding": "utf-8", "user_edited": False,
+                  "typed": DirtyRanges(), "loader_editing": False,
+                  "first_chunk": True, "queue": queue.Queue(maxsize=LOAD_QUEUE_CHUNKS),
+                  "cancel": threading.Event(), "started": time.perf_counter(), "line": line}
+    document.listeners.append(record_typed_text)
+    threading.Thread(target=read_file_chunks, args=(file_path, load_state["queue"], load_state["cancel"]),
+                     daemon=True).start()
+    load_progress.configure(maximum=max(file_size, 1), value=0)
+    load_progress.pack(side="right", padx=4)
+    cancel_load_button.pack(side="right")
+    status_var.set("Loading...")
+    update_tab_label()
+    root.after(LOAD_POLL_MS, pump_loader)
+
+
+def read_file_chunks(file_path, chunk_queue, cancel_event):
+    """Runs on the loader thread. Decodes the file in one pass and hands the text to the UI in chunks."""
+    def put(item):
+        # Blocks while the UI is behind so only a few chunks are ever held in memory
+        while not cancel_event.is_set():
+            try:
+                chunk_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        stamp = arcwatch.file_stamp(file_path)  # Before reading, so a change made during the load is noticed
+        scanner = LongLineScanner(config["long_line_chars"])
+        file_sample = arcwatch.FileSample()  # Of the bytes read, so an append made later can be told from a rewrite
+        with open(file_path, "rb") as raw_file:
+            file = TeeReader(raw_file, file_sample.update)
+            for kind, value in decode_chunks(file, LOAD_CHUNK_BYTES):
+                if cancel_event.is_set():
+                    return
+                if kind == "text":
+                    if not put(("data", value, file.tell(), scanner.feed(value))):
+                        return
+                elif kind == "encoding":
+                    encoding = value
+                elif not put((kind, value)):  # "transcode", the UI fixes up what it already has
+                    return
+        history = None
+        if config["persist_undo"]:
             try:
-                with open(file_path, "r", encoding="cp1252") as file:
-                    text_area.delete(1.0, tk.END)
-                    text_area.insert(tk.END, file.read())
-                current_file = file_path
-                root.title(f"{file_path} - Arc Editor")
-                text_area.edit_modified(False)
-                messagebox.showwarning("Encoding Warning", "The file was opened using cp1252 encoding. Some characters might not display correctly. It is recommended to save the file as UTF-8.")
-            except UnicodeDecodeError as e:
-                messagebox.showerror("Encoding Error", f"The file could not be opened.  Tried UTF-8 and cp1252. Unknown encoding.")
+                history = arcundo.load_history(UNDO_DIR, file_path, config["undo_memory_mb"] * 1024 * 1024)
             except Exception as e:
-                messagebox.showerror("Error", f"An error occurred while opening: {e}")
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred while opening: {e}")
+                print("Error loading undo history:", e)
+        put(("done", encoding, history, stamp, scanner.lines, file_sample))
+    except UnicodeDecodeError:
+        put(("encoding_error", None))
+    except Exception as e:
+        put(("error", e))
 
 
-def save_file():
-    global current_file
-    if current_file:
+def record_typed_text(offset, deleted_text, inserted_text):
+    """Document listener while a file loads. Keeps track of the text the user typed in the meantime,
+    everything else came from the file."""
+    state = load_state
+    if state is None or state["loader_editing"]:
+        return
+    if deleted_text:
+        state["typed"].delete(offset, len(deleted_text))
+    if inserted_text:
+        state["typed"].insert(offset, len(inserted_text))
+
+
+def pump_loader():
+    """Moves chunks from the loader thread into text_area, one chunk per event loop turn."""
+    state = load_state
+    if state is None:
+        return
+    if text_area.edit_modified():
+        state["user_edited"] = True  # The user typed into the part that is already loaded
+    try:
+        kind, *payload = state["queue"].get_nowait()
+    except queue.Empty:
+        root.after(LOAD_POLL_MS, pump_loader)
+        return
+
+    if kind == "data":
+        chunk, position, long_spans = payload
+        if long_spans:  # Parts of lines past long_line_chars go in hidden, Tk would lay them out on every chunk
+            if not long_lines_on:
+                enter_long_line_mode()
+            pieces = []
+            shown = 0
+            for start, end in long_spans:
+                pieces += [chunk[shown:start], (), chunk[start:end], ("long_elide",)]
+                shown = end
+            pieces.append(chunk[shown:])
+        else:
+            pieces = [chunk]
+        state["loader_editing"] = True
+        text_area.insert(tk.END, *pieces)
+        state["loader_editing"] = False
+        text_area.edit_modified(False)
+        if state["first_chunk"]:  # The first screen is usable right away
+            state["first_chunk"] = False
+            text_area.mark_set(tk.INSERT, "1.0")
+            text_area.see("1.0")
+        load_progress.configure(value=position)
+        status_var.set(f"Loading... {position * 100 // max(state['size'], 1)}%")
+        root.after(1, pump_loader)  # Let keystrokes and redraws in before the next chunk
+    elif kind == "transcode":
+        # The text loaded so far was valid UTF-8. Re-reading those bytes as the fallback encoding gives
+        # the same result as decoding them from disk again, so do that in memory instead. Only the text
+        # that came from the file, what the user typed meanwhile stays as it is.
+        state["encoding"] = payload[0]
+        pieces = []
+        loaded_start = 0
         try:
-            with open(current_file, "w", encoding="utf-8") as file:
-                file.write(text_area.get(1.0, tk.END))
-            text_area.edit_modified(False)  # Reset the modified flag *immediately* after the save
+            for start, end in state["typed"].ranges + [(len(document), len(document))]:
+                pieces.append(transcode_text(document.get_text(loaded_start, start), payload[0]))
+                pieces.append(document.get_text(start, end))
+                loaded_start = end
+        except UnicodeDecodeError:
+            cancel_loading()
+            messagebox.showerror("Encoding Error", f"The file could not be opened.  Tried UTF-8 and cp1252. Unknown encoding.")
+            return
+        state["loader_editing"] = True
+        text_area.delete(1.0, tk.END)
+        text_area.insert(tk.END, "".join(pieces))
+        state["loader_editing"] = False
+        text_area.edit_modified(False)
+        root.after(1, pump_loader)
+    elif kind == "done":
+        state["encoding"] = payload[0]
+        arcperf.recorder.record("open_file", time.perf_counter() - state["started"])
+        finish_loading()
+        document.listeners.remove(record_typed_text)
+        document.path = state["path"]
+        document.encoding = state["encoding"]
+        document.dirty.clear()
+        start_journal(document, document.snapshot() if state["user_edited"] else None)  # Typed-in text isn't in the file
+        start_history(document, None if state["user_edited"] else payload[1])  # Edits during the load weren't recorded
+        watch_tab(current_tab, None if state["user_edited"] else document.snapshot(), "", payload[2], payload[4])
+        set_long_lines(payload[3])
+        root.title(f"{document.path} - Arc Editor")
+        text_area.edit_modified(state["user_edited"])
+        current_tab["modified"] = state["user_edited"]
+        update_tab_label()
+        if state["line"] is not None:
+            show_line(state["line"])
+        if payload[3]:
+            status_var.set(f"{len(payload[3]):,} lines over {config['long_line_chars']:,} characters are shown "
+                           f"{LONG_LINE_WINDOW:,} characters at a time, around the cursor")
+        if state["encoding"] == FALLBACK_ENCODING:
+            messagebox.showwarning("Encoding Warning", "The file was opened using cp1252 encoding. Some characters might not display correctly. Save keeps cp1252, use Save As to store the file as UTF-8.")
+        open_next_pending()
+    elif kind == "encoding_error":
+        cancel_loading()
+        messagebox.showerror("Encoding Error", f"The file could not be opened.  Tried UTF-8 and cp1252. Unknown encoding.")
+        open_next_pending()
+    else:
+        cancel_loading()
+        messagebox.showerror("Error", f"An error occurred while opening: {payload[0]}")
+        open_next_pending()
+
+
+def finish_loading():
+    global load_state
+    load_state = None
+    load_progress.pack_forget()
+    cancel_load_button.pack_forget()
+    status_var.set("")
+
+
+def cancel_loading():
+    """Stops a running load and throws away the partly loaded text."""
+    if load_state is None:
+        return
+    load_state["cancel"].set()
+    finish_loading()
+    text_area.delete(1.0, tk.END)
+    text_area.edit_modified(False)
+    set_long_lines([])
+    set_document(Document())
+    start_journal(document)
+    start_history(document)
+    root.title("Untitled - Arc Editor")
+    update_tab_label()
+
+
+def cancel_opening():
+    """Escape and the Cancel button: stops the running load and drops the files waiting to be opened."""
+    pending_opens.clear()
+    cancel_loading()
+
+
+def save_file():
+    if load_state is not None:
+        messagebox.showinfo("Loading", "Please wait until the file has finished loading.")
+        return False
+    if large_view is not None:
+        messagebox.showinfo("Large File", "Files opened in large file mode are read-only.")
+        return False
+    if document.path:
+        doc = document
+        if current_tab["sync"] is not None or (current_tab["stamp"] is not None
+                                               and arcwatch.file_stamp(doc.path) != current_tab["stamp"]):
+            # Take in what another program wrote instead of overwriting it, then save
+            sync_with_disk(current_tab, then=lambda: queue_save(doc, doc.path, doc.encoding))
             return True
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred while saving: {e}")
-            return False
+        queue_save(doc, doc.path, doc.encoding)  # Round-trip the detected encoding
+        return True
     else:
         return save_file_as()
 
 def save_file_as():
-    global current_file
-    file_path = filedialog.asksaveasfilename(defaultextension=".arc", filetypes=[("Arc Files", "*.arc")])
+    if load_state is not None:
+        messagebox.showinfo("Loading", "Please wait until the file has finished loading.")
+        return False
+    if large_view is not None:
+        messagebox.showinfo("Large File", "Files opened in large file mode are read-only.")
+        return False
+    save_type = tk.StringVar(value=SAVE_TYPES[0][0])
+    file_path = filedialog.asksaveasfilename(defaultextension=".arc", typevariable=save_type,
+                                             filetypes=[(name, pattern) for name, pattern, _ in SAVE_TYPES])
     if file_path:
+        encoding = next((encoding for name, _, encoding in SAVE_TYPES if name == save_type.get()), "utf-8")
+        queue_save(document, file_path, encoding, revert=(document.path, document.encoding))
+        document.path = file_path
+        document.encoding = encoding
+        root.title(f"{file_path} - Arc Editor")
+        update_tab_label()
+        return True
+    return False
+
+
+def queue_save(doc, file_path, encoding, revert=None):
+    """Snapshots doc and hands it to the save thread. A save queued for a path that is already
+    waiting replaces the older one, so only the newest text is written."""
+    global save_running
+    if doc.history:
+        doc.history.mark_saved()
+    job = {"document": doc, "path": file_path, "encoding": encoding, "snapshot": doc.snapshot(),
+           "revert": revert, "journal_mark": doc.journal.mark() if doc.journal else None,
+           "undo": doc.history.export() if doc.history and config["persist_undo"] else None}
+    text_area.edit_modified(False)  # Reset the modified flag *immediately*, edits made during the save set it again
+    doc.dirty.clear()
+    with save_lock:
+        if file_path in save_pending and revert is None:
+            job["revert"] = save_pending[file_path]["revert"]
+        save_pending[file_path] = job
+        if not save_running:
+            save_running = True
+            save_idle.clear()
+            threading.Thread(target=run_saves, daemon=True).start()
+            root.after(SAVE_POLL_MS, poll_saves)
+
+
+def run_saves():
+    """Runs on the save thread until no saves are waiting."""
+    global save_running
+    while True:
+        with save_lock:
+            if not save_pending:
+                save_running = False
+                save_idle.set()
+                return
+            job = save_pending.pop(next(iter(save_pending)))
+        total = max(len(job["snapshot"]), 1)
+        started = time.perf_counter()
         try:
-            with open(file_path, "w", encoding="utf-8") as file:
-                file.write(text_area.get(1.0, tk.END))
-            current_file = file_path
-            root.title(f"{file_path} - Arc Editor")
-            text_area.edit_modified(False)  # Reset the modified flag *immediately* after the save
-            return True
+            unencodable = first_unencodable(job["snapshot"], job["encoding"])
+            if unencodable is not None:  # Found before the old file is touched
+                save_events.put(("unencodable", job, unencodable))
+                continue
+            write_snapshot(job["path"], job["snapshot"], job["encoding"],
+                           lambda written: save_events.put(("progress", job, min(written * 100 // total, 100))))
+            job["stamp"] = arcwatch.file_stamp(job["path"])  # Tells the file watcher this write was ours
+            job["file_sample"] = arcwatch.sample_file(job["path"])
+            if job["stamp"] is None or job["file_sample"] is None or job["file_sample"].size != job["stamp"][1]:
+                job["file_sample"] = None  # Someone else wrote to it in between
+            save_events.put(("saved", job, time.perf_counter() - started))
         except Exception as e:
-            messagebox.showerror("Error", f"An error occurred while saving: {e}")
-            return False
-    return False
+            save_events.put(("failed", job, e))
+            continue
+        if job["undo"] is not None:
+            try:
+                arcundo.save_history(UNDO_DIR, job["path"], job["undo"])
+            except Exception as e:
+                print("Error saving undo history:", e)
+        if config["search_folder"]:
+            queue_index_update(job["path"])
+
+
+def queue_index_update(path):
+    """Hands a saved file to the index thread, so a save never waits on SQLite."""
+    global index_thread
+    with index_lock:
+        if index_thread is None:
+            index_thread = threading.Thread(target=run_index_updates, daemon=True)
+            index_thread.start()
+    index_updates.put(path)
+
+
+def run_index_updates():
+    """Runs on the index thread. Puts saved notes in the Search All Notes index, each file once however
+    often it was saved while the thread was busy."""
+    import arcindex  # Pulls in sqlite3, kept out of startup
+    while True:
+        paths = {index_updates.get()}
+        try:
+            while True:
+                paths.add(index_updates.get_nowait())
+        except queue.Empty:
+            pass
+        folder = config["search_folder"]
+        for path in paths:
+            try:
+                if folder and arcindex.is_note(path, folder):
+                    arcindex.update_file(INDEX_FILE, folder, path)
+            except Exception as e:
+                print("Error updating search index:", e)
+
+
+def poll_saves():
+    """Shows save progress and results on the UI thread."""
+    running = save_running  # Read first, so events posted just before the thread stops are still shown
+    ok = handle_save_events()
+    if running:
+        root.after(SAVE_POLL_MS, poll_saves)
+    return ok
+
+
+def handle_save_events():
+    ok = True
+    while True:
+        try:
+            kind, job, detail = save_events.get_nowait()
+        except queue.Empty:
+            return ok
+        name = os.path.basename(job["path"])
+        if kind == "progress":
+            status_var.set(f"Saving {name}... {detail}%")
+        elif kind == "saved":
+            status_var.set(f"Saved {name} in {detail:.2f}s")
+            arcperf.recorder.record("save_file", detail)
+            if job["document"].journal:  # The saved file is the journal's new base
+                job["document"].journal.saved(job["journal_mark"], job["path"], job["encoding"])
+            tab = tab_of(job["document"])
+            if tab is not None and job["document"].path == job["path"]:
+                watch_tab(tab, job["snapshot"], ARC_TRAILING_NEWLINE, job["stamp"], job["file_sample"])
+        elif kind == "unencodable":
+            position, character = detail
+            line, column = job["snapshot"].line_col(position)
+            tab = tab_of(job["document"])
+            if tab is not None and tab is not current_tab:
+                switch_to_tab(tab)  # Show the text being asked about, which also reads it back if it was spilled
+            if tab is current_tab and messagebox.askyesno("Save", f"{name} is in {job['encoding']}, which has no \"{character}\" "
+                                           f"(U+{ord(character):04X}, line {line + 1}, column {column + 1}).\n\n"
+                                           "Save it as UTF-8 instead?"):
+                doc = job["document"]
+                if doc.path == job["path"]:
+                    doc.encoding = "utf-8"
+                queue_save(doc, job["path"], "utf-8", revert=job["revert"])
+                continue
+            ok = False
+            save_failed(job)
+            status_var.set(f"{name} was not saved")
+        else:
+            ok = False
+            save_failed(job)
+            status_var.set(f"Saving {name} failed")
+            messagebox.showerror("Error", f"An error occurred while saving: {detail}")
+
+
+def save_failed(job):
+    """Marks the document of a save that didn't happen as unsaved again."""
+    doc = job["document"]
+    if job["revert"] and doc.path == job["path"]:
+        doc.path, doc.encoding = job["revert"]  # Save As never happened, go back to the old file
+        if doc is document:
+            root.title(f"{doc.path or 'Untitled'} - Arc Editor")
+    tab = tab_of(doc)
+    if doc is document:
+        text_area.edit_modified(True)
+    elif tab is not None:
+        tab["modified"] = True
+    if tab is not None:
+        update_tab_label(tab)
+    if doc.history:
+        doc.history.mark_unsaved()
+
+
+def wait_for_saves():
+    """Blocks until every queued save is on disk, including the ones waiting for a file changed by
+    another program to be read. Returns False if one of them failed."""
+    while True:
+        while any(tab["sync"] is not None for tab in tabs):
+            finish_disk_sync(*disk_syncs.get())
+        save_idle.wait()
+        ok = handle_save_events()
+        if save_idle.is_set():  # Nothing queued again, e.g. as UTF-8 after asking
+            return ok
+
+
+def open_large_view(file_path, packed=False):
+    """Shows a file too big for tk.Text as a read-only window over a memory-mapped copy, or over the
+    chunks of a compressed one. Returns False if the file can't be shown this way, so the normal
+    loader takes it."""
+    global large_view
+    try:
+        mapped = arcpack.PackedFile(file_path) if packed else MappedFile(file_path)
+    except Exception as e:
+        print("Error mapping file:", e)
+        return False
+    if not mapped.supported:
+        mapped.close()
+        return False
+    large_view = {"file": mapped, "top": 0, "cancel": threading.Event(), "search": None, "finding": None}
+    threading.Thread(target=mapped.build_index, args=(large_view["cancel"],), daemon=True).start()
+    text_area.configure(wrap="none")  # One text line per file line keeps the window math simple
+    large_scrollbar.pack(side="right", fill="y", before=text_area)
+    edit_menu.entryconfigure("Search Large File...", state="normal")
+    root.title(f"{file_path} (read-only) - Arc Editor")
+    render_large_view()
+    root.after(LARGE_INDEX_POLL_MS, poll_large_index)
+    return True
+
+
+def close_large_view():
+    global large_view
+    if large_view is None:
+        return
+    large_view["cancel"].set()
+    if large_view["finding"] is not None:
+        large_view["finding"].set()
+    large_view["file"].close()
+    large_view = None
+    set_view_text("")
+    text_area.configure(state="normal", wrap="word")
+    large_scrollbar.pack_forget()
+    edit_menu.entryconfigure("Search Large File...", state="disabled")
+    status_var.set("")
+
+
+def set_view_text(text):
+    """Replaces what text_area shows without touching the document model."""
+    global mirror_edits
+    mirror_edits = False
+    try:
+        text_area.configure(state="normal")
+        text_area.delete(1.0, tk.END)
+        text_area.insert(tk.END, text)
+        if large_view is not None:
+            text_area.configure(state="disabled")
+    finally:
+        mirror_edits = True
+    text_area.edit_modified(False)
+
+
+def visible_line_count():
+    line_height = font.Font(font=text_area.cget("font")).metrics("linespace")
+    return max(text_area.winfo_height() // max(line_height, 1), 1) + 1
+
+
+def render_large_view():
+    """Decodes just the lines on screen and shows them."""
+    mapped = large_view["file"]
+    lines = visible_line_count()
+    text, _ = mapped.read_lines(large_view["top"], lines)
+    set_view_text(text)
+    total = max(mapped.estimated_line_count(), 1)
+    large_scrollbar.set(large_view["top"] / total, min((large_view["top"] + lines) / total, 1.0))
+    more = "" if mapped.complete else "+ (indexing)"
+    status_var.set(f"Large file mode, read-only. Line {large_view['top'] + 1:,} of {mapped.line_count:,}{more}")
+
+
+def scroll_large_view_to(line):
+    mapped = large_view["file"]
+    large_view["top"] = max(0, min(line, mapped.line_count - 1))
+    render_large_view()
+
+
+def large_view_scroll(*args):
+    """Scrollbar command in large file mode."""
+    if large_view is None:
+        return
+    if args[0] == "moveto":
+        scroll_large_view_to(int(float(args[1]) * large_view["file"].estimated_line_count()))
+    elif args[0] == "scroll":
+        step = visible_line_count() - 1 if args[2] == "pages" else 1
+        scroll_large_view_to(large_view["top"] + int(args[1]) * step)
+
+
+def large_view_key(event):
+    """Scrolling keys and the mouse wheel move the window instead of the (read-only) text."""
+    if large_view is None:
+        return None
+    page = visible_line_count() - 1
+    top = large_view["top"]
+    moves = {"Up": top - 1, "Down": top + 1, "Prior": top - page, "Next": top + page}
+    if event.keysym in moves:
+        scroll_large_view_to(moves[event.keysym])
+    elif event.num == 4 or getattr(event, "delta", 0) > 0:
+        scroll_large_view_to(top - 3)
+    elif event.num == 5 or getattr(event, "delta", 0) < 0:
+        scroll_large_view_to(top + 3)
+    return "break"
+
+
+def poll_large_index():
+    if large_view is None:
+        return
+    if not large_view["file"].complete:
+        root.after(LARGE_INDEX_POLL_MS, poll_large_index)
+    render_large_view()
+
+
+def go_to_line():
+    line = simpledialog.askinteger("Go to Line", "Line number:", parent=root, minvalue=1)
+    if line is not None:
+        show_line(line - 1)
+
+
+def show_line(line):
+    """Puts the cursor at the start of a 0-based line and scrolls it into view."""
+    if large_view is not None:
+        scroll_large_view_to(line)
+    else:
+        text_area.mark_set(tk.INSERT, f"{line + 1}.0")
+        text_area.see(tk.INSERT)
+
+
+def search_large_file():
+    """Finds text in the mapped file, continuing after the last match."""
+    if large_view is None:
+        return
+    previous = large_view["search"]
+    needle = simpledialog.askstring("Search Large File", "Find:", parent=root,
+                                    initialvalue=previous[0] if previous else "")
+    if not needle:
+        return
+    if large_view is None:
+        return  # Closed while the dialog was up
+    if large_view["finding"] is not None:
+        large_view["finding"].set()  # A new search replaces one still running
+    mapped = large_view["file"]
+    start = previous[1] if previous and previous[0] == needle else mapped.line_offset(large_view["top"])
+    cancel_event = threading.Event()
+    found = queue.Queue()
+    large_view["finding"] = cancel_event
+    status_var.set(f"Searching for \"{needle}\"...")
+    threading.Thread(target=find_in_large_file, args=(mapped, needle, start, cancel_event, found),
+                     daemon=True).start()
+    root.after(LARGE_SEARCH_POLL_MS, poll_large_search, cancel_event, found)
+
+
+def find_in_large_file(mapped, needle, start, cancel_event, found):
+    """Runs on a worker thread so scanning gigabytes doesn't freeze the UI. Puts
+    (needle, offset, line, column) on found, offset -1 if there is no match and line None if the
+    match is past the indexed part, or (needle, None, error message) if the file can't be read."""
+    try:
+        offset = mapped.find(needle, start, cancel_event)
+        if offset == -1 and start:
+            offset = mapped.find(needle, 0, cancel_event)  # Wrap around
+        line = column = None
+        if offset != -1 and not cancel_event.is_set():
+            line = mapped.line_of(offset)
+            if line is not None:
+                column = mapped.decoded_length(mapped.line_offset(line), offset)
+    except Exception as e:
+        found.put((needle, None, str(e)))
+        return
+    found.put((needle, offset, line, column))
+
+
+def poll_large_search(cancel_event, found):
+    if large_view is None or large_view["finding"] is not cancel_event:
+        return  # Closed, or replaced by a newer search
+    try:
+        result = found.get_nowait()
+    except queue.Empty:
+        root.after(LARGE_SEARCH_POLL_MS, poll_large_search, cancel_event, found)
+        return
+    large_view["finding"] = None
+    render_large_view()  # Puts the status bar back
+    needle, offset = result[:2]
+    if offset is None:
+        messagebox.showerror("Search Large File", f"Could not search the file: {result[2]}")
+        return
+    if offset == -1:
+        large_view["search"] = None
+        messagebox.showinfo("Search Large File", f"\"{needle}\" was not found.")
+        return
+    line, column = result[2:]
+    if line is None:
+        messagebox.showinfo("Search Large File", "The match is past the part of the file indexed so far, try again in a moment.")
+        return
+    large_view["search"] = (needle, offset + 1)
+    scroll_large_view_to(line)
+    text_area.tag_remove("large_match", 1.0, tk.END)
+    text_area.tag_add("large_match", f"1.{column}", f"1.{column + len(needle)}")
+
 
 def open_emoji_window():
-    """Opens a window for emoji selection."""
+    """Opens a window for emoji selection. It is built once and only hidden when closed."""
+    if emoji_picker is None:
+        build_emoji_window()
+    window = emoji_picker["window"]
+    window.deiconify()
+    window.lift()
+    emoji_picker["search_entry"].focus_set()
+
+
+def build_emoji_window():
+    global emoji_picker
     emoji_window = tk.Toplevel(root)
     emoji_window.title("Emoji Picker")
     emoji_window.geometry("400x300")  # Set initial window size
+    emoji_window.protocol("WM_DELETE_WINDOW", emoji_window.withdraw)
+    emoji_window.bind("<Escape>", lambda event: emoji_window.withdraw())
+
+    search_var = tk.StringVar()
+    search_entry = tk.Entry(emoji_window, textvariable=search_var)
+    search_entry.pack(fill="x", padx=4, pady=2)
+    recent_frame = tk.Frame(emoji_window)
+    recent_frame.pack(fill="x", padx=4)
+    recent_buttons = [tk.Button(recent_frame, font=("Arial", 14), relief="flat") for _ in range(RECENT_EMOJI_COUNT)]
+    name_label = tk.Label(emoji_window, anchor="w")
+    name_label.pack(side="bottom", fill="x", padx=4)
+
+    # Only the cells on screen exist, as canvas text items that are reused while scrolling
+    grid = tk.Frame(emoji_window)
+    grid.pack(fill=tk.BOTH, expand=True)
+    emoji_scrollbar = tk.Scrollbar(grid, command=scroll_emoji_grid)
+    emoji_scrollbar.pack(side="right", fill="y")
+    emoji_canvas = tk.Canvas(grid, highlightthickness=0)
+    emoji_canvas.pack(side="left", fill=tk.BOTH, expand=True)
+
+    catalogue = load_catalogue()
+    emoji_picker = {"window": emoji_window, "catalogue": catalogue, "results": list(range(len(catalogue))),
+                    "top_row": 0, "columns": 1, "rows": 0, "cells": [], "canvas": emoji_canvas,
+                    "scrollbar": emoji_scrollbar, "search_entry": search_entry, "recent_buttons": recent_buttons,
+                    "name_label": name_label}
+
+    search_var.trace_add("write", lambda *args: filter_emojis(search_var.get()))
+    search_entry.bind("<Return>", lambda event: pick_emoji_number(0))
+    emoji_canvas.bind("<Configure>", lambda event: layout_emoji_grid())
+    emoji_canvas.bind("<Button-1>", lambda event: pick_emoji_number(emoji_cell_at(event.x, event.y)))
+    emoji_canvas.bind("<Motion>", lambda event: show_emoji_name(emoji_cell_at(event.x, event.y)))
+    emoji_canvas.bind("<MouseWheel>", lambda event: scroll_emoji_grid("scroll", -1 if event.delta > 0 else 1, "units"))
+    emoji_canvas.bind("<Button-4>", lambda event: scroll_emoji_grid("scroll", -1, "units"))
+    emoji_canvas.bind("<Button-5>", lambda event: scroll_emoji_grid("scroll", 1, "units"))
+    update_recent_emojis()
+
+
+def layout_emoji_grid():
+    """Makes sure there is one canvas item per visible cell, then draws."""
+    canvas = emoji_picker["canvas"]
+    columns = max(canvas.winfo_width() // EMOJI_CELL_SIZE, 1)
+    rows = canvas.winfo_height() // EMOJI_CELL_SIZE + 1
+    cells = emoji_picker["cells"]
+    if columns != emoji_picker["columns"] or rows != emoji_picker["rows"]:
+        for item in cells:
+            canvas.delete(item)
+        cells.clear()
+        for cell in range(columns * rows):
+            x = (cell % columns) * EMOJI_CELL_SIZE + EMOJI_CELL_SIZE // 2
+            y = (cell // columns) * EMOJI_CELL_SIZE + EMOJI_CELL_SIZE // 2
+            cells.append(canvas.create_text(x, y, font=("Arial", 20)))
+        emoji_picker["columns"], emoji_picker["rows"] = columns, rows
+    draw_emoji_grid()
+
+
+def draw_emoji_grid():
+    picker = emoji_picker
+    emojis = picker["catalogue"].emojis
+    results = picker["results"]
+    first = picker["top_row"] * picker["columns"]
+    for cell, item in enumerate(picker["cells"]):
+        number = first + cell
+        picker["canvas"].itemconfigure(item, text=emojis[results[number]] if number < len(results) else "")
+    total_rows = max(-(-len(results) // picker["columns"]), 1)
+    picker["scrollbar"].set(picker["top_row"] / total_rows, min((picker["top_row"] + picker["rows"]) / total_rows, 1.0))
+
+
+def scroll_emoji_grid(*args):
+    picker = emoji_picker
+    total_rows = -(-len(picker["results"]) // picker["columns"])
+    if args[0] == "moveto":
+        top_row = int(float(args[1]) * total_rows)
+    else:
+        step = picker["rows"] - 1 if args[2] == "pages" else 1
+        top_row = picker["top_row"] + int(args[1]) * step
+    picker["top_row"] = max(0, min(top_row, total_rows - picker["rows"] + 1))
+    draw_emoji_grid()
+
+
+def filter_emojis(query):
+    emoji_picker["results"] = emoji_picker["catalogue"].search(query)
+    emoji_picker["top_row"] = 0
+    draw_emoji_grid()
+
+
+def emoji_cell_at(x, y):
+    """Position in the current results of the cell under x, y, or None."""
+    column = x // EMOJI_CELL_SIZE
+    if column >= emoji_picker["columns"]:
+        return None
+    return (emoji_picker["top_row"] + y // EMOJI_CELL_SIZE) * emoji_picker["columns"] + column
+
+
+def show_emoji_name(number):
+    results = emoji_picker["results"]
+    name = emoji_picker["catalogue"].names[results[number]] if number is not None and number < len(results) else ""
+    emoji_picker["name_label"].configure(text=name.title())
+
 
-    # Use a Canvas for better layout control (optional but recommended)
-    emoji_canvas = tk.Canvas(emoji_window)
-    emoji_canvas.pack(fill=tk.BOTH, expand=True)
+def pick_emoji_number(number):
+    results = emoji_picker["results"]
+    if number is not None and number < len(results):
+        pick_emoji(emoji_picker["catalogue"].emojis[results[number]])
 
-    emojis = ["😀", "😂", "😍", "👍", "❤️", "😊", "😎", "🤩", "🤔", "😴", "🥳", "🤯", "😇", "😈", "💩"] #More Emojis
 
-    button_size = 40  # Set button size
-    columns = 5 #Number of columns
+def pick_emoji(emoji):
+    insert_emoji(emoji)
+    recent = [emoji] + [other for other in config["recent_emojis"] if other != emoji]
+    config["recent_emojis"] = recent[:RECENT_EMOJI_COUNT]
+    update_recent_emojis()
+    save_config()
+
+
+def update_recent_emojis():
+    for button, emoji in zip(emoji_picker["recent_buttons"], config["recent_emojis"]):
+        button.configure(text=emoji, command=lambda e=emoji: pick_emoji(e))
+        button.pack(side="left")
+
+
+def start_journal(doc, snapshot=None):
+    doc.journal = arcjournal.EditJournal.start(JOURNAL_DIR, doc.path, doc.encoding, snapshot)
+    doc.listeners.append(doc.journal.record)
+
+
+def start_history(doc, history=None):
+    """Gives doc an undo history, a fresh one unless a saved one is passed in."""
+    doc.history = history or arcundo.UndoHistory(config["undo_memory_mb"] * 1024 * 1024)
+    doc.listeners.append(doc.history.record)
+    doc.listeners.append(schedule_undo_step)
+    update_undo_status()
+
+
+def schedule_undo_step(offset, deleted_text, inserted_text):
+    """Document listener. Everything one command does, a keystroke, a paste or a Replace All, becomes
+    one undo step, closed once Tk is idle again."""
+    global undo_step_pending
+    if not undo_step_pending:
+        undo_step_pending = True
+        root.after_idle(close_undo_step)
+
+
+def close_undo_step():
+    global undo_step_pending
+    undo_step_pending = False
+    if document.history:
+        document.history.close_step()
+        update_undo_status()
+
+
+def schedule_stats():
+    global stats_timer
+    if stats_timer is None:
+        stats_timer = root.after(STATS_REFRESH_MS, refresh_stats)
+
+
+def refresh_stats():
+    """Shows the cursor position and the line, word and character counts. Lines and characters come
+    from the document's piece tree and words from its WordCount, so nothing here reads the text."""
+    global stats_timer
+    stats_timer = None
+    if large_view is not None:  # Has a status line of its own
+        stats_var.set("")
+        return
+    if document.word_count is None:  # Counted in full once, then kept up to date by the edits
+        document.word_count = WordCount(document)
+    line, column = text_area.index(tk.INSERT).split(".")  # Not text_offset, which reads the line up to the cursor
+    stats_var.set(f"Ln {int(line):,}, Col {int(column) + 1:,}   {document.line_count:,} lines, "
+                  f"{document.word_count.words:,} words, {len(document):,} chars")
+
+
+def set_long_lines(lines):
+    """Shows the given lines (0-based) LONG_LINE_WINDOW characters at a time, with the rest of each
+    elided, and wraps text_area by character while there are any. Tk lays a wrapped line out in full
+    whenever it changes, which takes seconds for a line of megabytes; elided text is skipped. Only the
+    display changes, the document and what is saved keep every character."""
+    global long_lines_on
+    text_area.tag_remove("long_elide", "1.0", tk.END)
+    root.tk.call(text_real, "mark", "unset", "long_cursor")
+    long_lines_on = False
+    if large_view is None:
+        text_area.configure(wrap="word")
+    if lines:
+        enter_long_line_mode()
+    for line in lines:
+        window_long_line(line + 1, 0)
+
+
+def find_long_lines(doc):
+    """Long lines of a document that didn't come through the loader, a recovered one."""
+    scanner = LongLineScanner(config["long_line_chars"])
+    for chunk in doc.iter_chunks():
+        scanner.feed(chunk)
+    return scanner.lines
+
+
+def enter_long_line_mode():
+    global long_lines_on
+    long_lines_on = True
+    text_area.configure(wrap="char")  # Word wrap would look for spaces across the whole window
+
+
+def window_long_line(line, column):
+    """Elides all of a Tk line but the LONG_LINE_WINDOW characters around column."""
+    length = int(text_area.index(f"{line}.end").split(".")[1])
+    start = max(0, min(column - LONG_LINE_WINDOW // 2, length - LONG_LINE_WINDOW))
+    end = start + LONG_LINE_WINDOW
+    text_area.tag_remove("long_elide", f"{line}.0", f"{line}.end")
+    if start > 0:
+        text_area.tag_add("long_elide", f"{line}.0", f"{line}.{start}")
+    if end < length:
+        text_area.tag_add("long_elide", f"{line}.{end}", f"{line}.end")
+
+
+def shown_columns(line, length):
+    """The columns of a Tk line that aren't elided, as (start, end)."""
+    start, end = 0, length
+    elided = text_area.tag_nextrange("long_elide", f"{line}.0", f"{line}.end")
+    if elided and str(elided[0]) == f"{line}.0":
+        end_line, start = map(int, str(elided[1]).split("."))
+        if end_line != line:  # Runs on into the next line, which an edit joined to this one
+            return length, length
+        elided = text_area.tag_nextrange("long_elide", elided[1], f"{line}.end")
+    if elided:
+        end = int(str(elided[0]).split(".")[1])
+    return start, end
+
+
+def follow_long_lines():
+    """Moves the window of a long line along with the cursor, and puts the line the cursor left back to
+    its first window. Also notices long lines typed or pasted in. A few Tk calls, whatever the length
+    of the line."""
+    global long_line_timer
+    long_line_timer = None
+    if large_view is not None or load_state is not None:
+        return
+    line, column = map(int, text_area.index(tk.INSERT).split("."))
+    length = int(text_area.index(f"{line}.end").split(".")[1])
+    if "long_cursor" in root.tk.splitlist(root.tk.call(text_real, "mark", "names")):
+        previous = int(text_area.index("long_cursor").split(".")[0])
+        if previous != line:
+            root.tk.call(text_real, "mark", "unset", "long_cursor")  # Not through the proxy, it would call us again
+            if int(text_area.index(f"{previous}.end").split(".")[1]) >= config["long_line_chars"]:
+                window_long_line(previous, 0)
+            else:  # Cut down below the threshold, show all of it
+                text_area.tag_remove("long_elide", f"{previous}.0", f"{previous}.end")
+    if length < config["long_line_chars"]:
+        return
+    if not long_lines_on:
+        enter_long_line_mode()
+    start, end = shown_columns(line, length)
+    if (start > 0 and column < start + LONG_LINE_MARGIN) or (end < length and column > end - LONG_LINE_MARGIN):
+        window_long_line(line, column)
+        text_area.see(tk.INSERT)
+    root.tk.call(text_real, "mark", "set", "long_cursor", f"{line}.0")
+
+
+def long_line_numbers():
+    """The lines (0-based) shown a window at a time, for switching back to the tab later."""
+    return sorted({int(str(index).split(".")[0]) - 1 for index in text_area.tag_ranges("long_elide")[::2]})
+
+
+def update_undo_status():
+    history = document.history
+    if history is None:
+        undo_var.set("")
+    else:
+        undo_var.set(f"Undo {history.memory / (1024 * 1024):.1f} MB" + (" (oldest dropped)" if history.evicted else ""))
+
+
+def undo_edit(event=None):
+    if document.history and load_state is None:
+        apply_history_edits(document.history.undo())
+    return "break"  # Keep Tk's own undo out of it
+
+
+def redo_edit(event=None):
+    if document.history and load_state is None:
+        apply_history_edits(document.history.redo())
+    return "break"
+
+
+def apply_history_edits(edits):
+    """Applies the edits of an undo or redo to text_area, which passes them on to the document."""
+    if not edits:
+        return
+    history = document.history
+    history.paused = True
+    try:
+        for offset, length, text in edits:
+            if length:
+                text_area.delete(offset_index(offset), offset_index(offset + length))
+            if text:
+                text_area.insert(offset_index(offset), text)
+    finally:
+        history.paused = False
+    text_area.mark_set(tk.INSERT, offset_index(offset + len(text)))
+    text_area.see(tk.INSERT)
+    text_area.edit_modified(not history.at_saved())
+    update_undo_status()
+
+
+def flush_journal():
+    """Writes the edits of the last JOURNAL_FLUSH_MS to the journal, and compacts it once it gets long."""
+    journal = document.journal
+    if journal:
+        journal.flush()
+        if journal.wants_compaction(len(document)):
+            journal.compact(document.snapshot())
+        if journal.error:
+            status_var.set(f"Autosave journal error: {journal.error}")
+            journal.error = None
+    root.after(JOURNAL_FLUSH_MS, flush_journal)
+
+
+def offer_recovery():
+    """Offers to restore the edits of editors that did not close cleanly, each into a tab of its own."""
+    for manifest in arcjournal.find_sessions(JOURNAL_DIR):
+        name = manifest["path"] or "an untitled note"
+        if not messagebox.askyesno("Recover Unsaved Work", f"Arc Editor did not close properly. Recover the unsaved changes to {name}?"):
+            arcjournal.discard_session(JOURNAL_DIR, manifest)
+            continue
+        try:
+            recovered = arcjournal.recover(JOURNAL_DIR, manifest)
+        except Exception as e:
+            recovered = None
+            print("Error recovering journal:", e)
+        if recovered is None:
+            messagebox.showerror("Recovery Failed", f"The changes to {name} could not be recovered. The file was changed since.")
+            arcjournal.discard_session(JOURNAL_DIR, manifest)
+            continue
+        doc, journal = recovered
+        doc.journal = journal
+        doc.listeners.append(journal.record)
+        start_history(doc)
+        if tab_is_blank(current_tab):  # The empty note started with the editor is replaced
+            if document.journal:
+                document.journal.discard()
+            show_document(doc)
+        else:
+            switch_to_tab(add_tab(doc))
+        text_area.edit_modified(True)
+        current_tab["modified"] = True
+        update_tab_label()
+        if doc.path:  # The journal checked the file is as it was, but not what it held then
+            watch_tab(current_tab, None, "", arcwatch.file_stamp(doc.path))
+
+
+def show_document(doc):
+    """Puts doc into text_area and makes it the current document, without replaying its text into the model."""
+    global document, mirror_edits
+    mirror_edits = False
+    try:
+        text_area.delete(1.0, tk.END)
+        for chunk in doc.iter_chunks():
+            text_area.insert(tk.END, chunk)
+    finally:
+        mirror_edits = True
+    set_document(doc)
+    update_undo_status()
+    text_area.mark_set(tk.INSERT, "1.0")
+    root.title(f"{doc.path or 'Untitled'} - Arc Editor")
 
-    for i, emoji in enumerate(emojis):
-        row = i // columns
-        col = i % columns
-        x_pos = col * button_size + 5 # adds padding
-        y_pos = row * button_size + 5
 
-        emoji_button = tk.Button(emoji_canvas, text=emoji, font=("Arial", 20), command=lambda e=emoji: insert_emoji(e)) # Increased font size
-        emoji_button.place(x=x_pos, y=y_pos, width=button_size - 10, height=button_size - 10) #Uses place to allow for better control of the grid
+def set_document(doc):
+    """Makes doc the document behind text_area and the current tab."""
+    global document
+    document = doc
+    if current_tab is not None:
+        current_tab["document"] = doc
+
+
+def add_tab(doc):
+    """Adds a tab for doc at the end of the tab bar, without switching to it."""
+    global next_tab_id
+    next_tab_id += 1
+    frame = tk.Frame(tab_bar, height=0)  # The tabs share text_area, their pages stay empty
+    tab = {"id": next_tab_id, "document": doc, "frame": frame, "modified": False, "cursor": "1.0", "view": 0.0,
+           "spilled": False, "spilling": None, "large_path": None, "last_used": 0,
+           "base": None, "base_tail": "", "base_is_text": False, "stamp": None, "file_sample": None, "disk_changed": False, "disk_appends": [], "sync": None,
+           "long_lines": find_long_lines(doc)}
+    tabs.append(tab)
+    tab_bar.add(frame, text=tab_label(tab))
+    return tab
+
+
+def tab_of(doc):
+    for tab in tabs:
+        if tab["document"] is doc:
+            return tab
+    return None
+
+
+def tab_name(tab):
+    path = tab["large_path"] or tab["document"].path
+    if tab is current_tab and load_state is not None:
+        path = load_state["path"]
+    return os.path.basename(path) if path else "Untitled"
+
+
+def tab_label(tab):
+    if tab["large_path"]:
+        return tab_name(tab) + " (read-only)"
+    return tab_name(tab) + (" *" if tab["modified"] else "")
+
+
+def update_tab_label(tab=None):
+    tab = tab or current_tab
+    tab_bar.tab(tab["frame"], text=tab_label(tab))
+
+
+def tab_is_blank(tab):
+    """True for an Untitled tab nobody has typed into, which opening a file reuses."""
+    modified = text_area.edit_modified() if tab is current_tab else tab["modified"]
+    return not modified and tab["large_path"] is None and tab["document"].path is None and not len(tab["document"])
+
+
+def on_text_modified(event=None):
+    current_tab["modified"] = text_area.edit_modified()
+    update_tab_label()
+
+
+def switch_to_tab(tab):
+    """Shows tab's document in text_area. Returns False if the switch can't happen right now."""
+    global current_tab, tab_clock
+    if tab is current_tab:
+        return True
+    if load_state is not None:
+        status_var.set("Wait for the file to finish loading, or press Escape to cancel it")
+        tab_bar.select(current_tab["frame"])
+        return False
+    started = time.perf_counter()
+    doc = tab["document"]
+    tab["spilling"] = None  # Still in memory, a spill being written is thrown away once it is done
+    if tab["spilled"]:
+        try:
+            doc.restore(spill_cache.load(tab["id"]))
+        except Exception as e:
+            messagebox.showerror("Error", f"The text of {tab_name(tab)} could not be read back from the spill cache: {e}")
+            if current_tab is not None:
+                tab_bar.select(current_tab["frame"])
+            return False
+        tab["spilled"] = False
+        if tab["base_is_text"]:
+            tab["base"] = doc.snapshot()
+            tab["base_is_text"] = False
+    if current_tab is not None:
+        leave_tab(current_tab)
+    current_tab = tab
+    tab_bar.select(tab["frame"])
+    show_document(doc)
+    set_long_lines([] if tab["large_path"] is not None else tab["long_lines"])
+    if tab["large_path"] is not None:
+        if open_large_view(tab["large_path"]):
+            scroll_large_view_to(int(tab["view"]))
+        else:
+            tab["large_path"] = None  # The file can't be mapped any more, leave the tab empty
+    else:
+        text_area.mark_set(tk.INSERT, tab["cursor"])
+        text_area.yview_moveto(tab["view"])
+    text_area.edit_modified(tab["modified"])
+    update_tab_label()
+    if tab["disk_changed"]:
+        sync_with_disk(tab, tab["disk_appends"])
+    tab_clock += 1
+    tab["last_used"] = tab_clock
+    if find_state["window"] is not None and find_state["window"].state() != "withdrawn":
+        restart_find()
+    evict_inactive_tabs()
+    arcperf.recorder.record("switch_tab", time.perf_counter() - started)
+    return True
+
+
+def leave_tab(tab):
+    """Remembers where the user was in the tab being switched away from."""
+    doc = tab["document"]
+    tab["modified"] = text_area.edit_modified()
+    if large_view is not None:
+        tab["view"] = large_view["top"]
+        close_large_view()
+    else:
+        tab["cursor"] = text_area.index(tk.INSERT)
+        tab["view"] = text_area.yview()[0]
+        tab["long_lines"] = long_line_numbers()
+    if doc.history:
+        doc.history.close_step()
+    if doc.journal:  # Nothing is written for an inactive tab until it is shown again
+        doc.journal.flush()
+
+
+def evict_inactive_tabs():
+    """Moves the text of the least recently used inactive tabs to the spill cache until the rest fit in
+    tab_memory_mb. Their journals and undo histories stay as they are."""
+    budget = config["tab_memory_mb"] * 1024 * 1024
+    loaded = [tab for tab in tabs if tab is not current_tab and not tab["spilled"] and tab["spilling"] is None]
+    sizes = {tab["id"]: tab["document"].memory_estimate() for tab in loaded}
+    total = sum(sizes.values())
+    for tab in sorted(loaded, key=lambda tab: tab["last_used"]):
+        if total <= budget:
+            break
+        if len(tab["document"]):  # Compressed on the spill thread, the text is dropped in finish_spill
+            tab["spilling"] = tab["document"].snapshot()
+            queue_spill(tab["id"], tab["spilling"])
+        else:
+            unload_tab(tab)
+        total -= sizes[tab["id"]]
+
+
+def unload_tab(tab):
+    if not tab["modified"] and tab["base"] is not None:
+        tab["base"] = None  # The same text, it would keep the unloaded buffers alive
+        tab["base_is_text"] = True
+    tab["document"].unload()
+
+
+def queue_spill(key, snapshot):
+    if spill_state["thread"] is None:
+        spill_state["thread"] = threading.Thread(target=run_spills, args=(spill_state["jobs"], spill_state["done"]),
+                                                 daemon=True)
+        spill_state["thread"].start()
+    spill_state["jobs"].put((key, snapshot))
+    spill_state["pending"] += 1
+    if spill_state["pending"] == 1:
+        root.after(SPILL_POLL_MS, poll_spills)
+
+
+def run_spills(jobs, done):
+    """Runs on the spill thread, so compressing a big tab doesn't hold up the tab switch."""
+    while True:
+        key, snapshot = jobs.get()
+        try:
+            spill_cache.spill(key, snapshot)
+            error = None
+        except Exception as e:
+            error = e
+        done.put((key, snapshot, error))
+
+
+def poll_spills():
+    while True:
+        try:
+            key, snapshot, error = spill_state["done"].get_nowait()
+        except queue.Empty:
+            break
+        spill_state["pending"] -= 1
+        finish_spill(key, snapshot, error)
+    if spill_state["pending"]:
+        root.after(SPILL_POLL_MS, poll_spills)
+
+
+def finish_spill(key, snapshot, error):
+    """Drops the text of a tab now that the spill cache has it, unless the tab was shown, closed or
+    changed in the meantime."""
+    tab = next((tab for tab in tabs if tab["id"] == key), None)
+    if tab is None or tab["spilling"] is not snapshot:
+        if tab is None or tab["spilling"] is None:  # Else a newer spill of the tab takes the file over
+            spill_cache.discard(key)
+        return
+    tab["spilling"] = None
+    if error is not None or not tab["document"].unchanged_since(snapshot):
+        if error is not None:
+            print("Error spilling tab:", error)
+        spill_cache.discard(key)
+        return
+    tab["spilled"] = True
+    unload_tab(tab)
+
+
+def on_tab_changed(event=None):
+    """Follows clicks on the tab bar."""
+    if current_tab is None:  # close_tab is between tabs, it picks the next one itself
+        return
+    selected = tab_bar.select()
+    for tab in tabs:
+        if str(tab["frame"]) == selected:
+            switch_to_tab(tab)
+            return
+
+
+def new_tab(event=None):
+    if load_state is not None:
+        status_var.set("Wait for the file to finish loading, or press Escape to cancel it")
+        return "break"
+    doc = Document()
+    start_journal(doc)
+    start_history(doc)
+    switch_to_tab(add_tab(doc))
+    return "break"
+
+
+def close_tab(event=None):
+    """Closes the current tab, asking to save it first. Closing the last tab leaves an empty one."""
+    global current_tab
+    tab = current_tab
+    cancel_opening()
+    if text_area.edit_modified():
+        if messagebox.askyesno("Unsaved Work", f"{tab_name(tab)} has unsaved changes. Do you want to save before closing it?"):
+            if not save_file():
+                return "break"
+    if not wait_for_saves():  # Keep the tab if its text didn't make it to disk
+        return "break"
+    close_large_view()
+    doc = tab["document"]
+    if doc.journal:
+        doc.journal.discard()
+        doc.journal = None
+    if file_watcher is not None:
+        file_watcher.unwatch(tab["id"])
+    current_tab = None
+    tabs.remove(tab)
+    tab_bar.forget(tab["frame"])
+    tab["frame"].destroy()
+    if tabs:
+        switch_to_tab(max(tabs, key=lambda tab: tab["last_used"]))
+    else:
+        new_tab()
+    return "break"
+
+
+def cycle_tabs(step):
+    if len(tabs) > 1:
+        switch_to_tab(tabs[(tabs.index(current_tab) + step) % len(tabs)])
+    return "break"
+
+
+def watch_tab(tab, base, tail, stamp, file_sample=None):
+    """Remembers what tab's file held when it was last read or written, base (a snapshot, or None if
+    that isn't known) plus tail, and starts watching it for changes by other programs. file_sample is
+    the arcwatch.FileSample of those bytes, if known."""
+    global file_watcher
+    if tab["document"].encoding not in APPENDABLE_ENCODINGS:
+        file_sample = None  # Appends can't be decoded on their own
+    tab["base"], tab["base_tail"], tab["base_is_text"] = base, tail, False
+    tab["stamp"], tab["file_sample"] = stamp, file_sample
+    if file_watcher is None:
+        file_watcher = arcwatch.FileWatcher(lambda key, path, new_stamp, appended:
+                                            file_changes.put((key, new_stamp, appended)))
+    file_watcher.watch(tab["id"], tab["document"].path, stamp, file_sample)
+
+
+def poll_file_changes():
+    """Picks up files changed by other programs. The current tab takes the change in right away, the
+    others when they are next shown. Waits while a save runs, its own write is known by its stamp
+    only once it has finished."""
+    if save_idle.is_set():
+        handle_save_events()
+        try:
+            while True:
+                finish_disk_sync(*disk_syncs.get_nowait())
+        except queue.Empty:
+            pass
+        changed = {}  # tab id -> (newest stamp, appends in order, or None if not all of them were)
+        try:
+            while True:
+                key, stamp, appended = file_changes.get_nowait()
+                appends = changed[key][1] if key in changed else []
+                changed[key] = (stamp, None if appends is None or appended is None else appends + [appended + (stamp,)])
+        except queue.Empty:
+            pass
+        for tab in tabs:
+            if tab["id"] in changed and changed[tab["id"]][0] != tab["stamp"]:  # A log written to many times a second is synced once
+                appends = changed[tab["id"]][1]
+                if tab["disk_changed"]:  # Still waiting for the tab to be shown
+                    appends = None if tab["disk_appends"] is None or appends is None else tab["disk_appends"] + appends
+                if tab is current_tab and load_state is None and large_view is None:
+                    sync_with_disk(tab, appends)
+                else:
+                    tab["disk_changed"], tab["disk_appends"] = True, appends
+    root.after(FILE_CHANGE_POLL_MS, poll_file_changes)
+
+
+def sync_with_disk(tab, appends=None, then=None):
+    """Brings the current tab up to date with its file after another program changed it. Only the
+    changed text is replaced, as one undo step, so the cursor, the view and the undo history stay.
+    Unsaved edits are kept if they don't touch the changed text, otherwise the user chooses.
+    appends are the (old sample, new bytes, new sample, stamp) the watcher read if the file was only
+    added to since, in order. Anything else is read and diffed on a thread, see read_disk_changes,
+    and then is called once the result is in the tab."""
+    tab["disk_changed"], tab["disk_appends"] = False, []
+    doc = tab["document"]
+    name = tab_name(tab)
+    if tab["sync"] is not None:  # Already reading the file, read it again once that is done
+        tab["disk_changed"], tab["disk_appends"] = True, None
+        if then:
+            tab["sync"]["then"].append(then)
+        return
+    if (appends and not text_area.edit_modified() and appends[0][0] is tab["file_sample"]
+            and all(earlier[2] is later[0] for earlier, later in zip(appends, appends[1:]))):
+        text = decode_appended(b"".join(appended[1] for appended in appends), doc.encoding)
+        if text is not None:  # Only added to, like a log, and the watcher has the new bytes already
+            at_end = text_area.yview()[1] >= 1.0
+            doc.history.separator()
+            text_area.insert(offset_index(len(doc)), tab["base_tail"] + text)
+            doc.history.close_step()
+            doc.history.mark_saved()
+            if at_end:
+                text_area.yview_moveto(1.0)
+            tab["base"], tab["base_tail"] = doc.snapshot(), ""
+            tab["file_sample"], tab["stamp"] = appends[-1][2], appends[-1][3]
+            if doc.journal:
+                doc.journal.saved(doc.journal.mark(), doc.path, doc.encoding)
+            text_area.edit_modified(False)
+            status_var.set(f"Reloaded {name}, another program added to it")
+            update_undo_status()
+            if then:
+                then()
+            return
+    stamp = arcwatch.file_stamp(doc.path)
+    if stamp == tab["stamp"] or stamp is None:
+        if stamp is None and tab["stamp"] is not None:
+            tab["stamp"] = None
+            status_var.set(f"{name} was deleted or moved by another program, saving writes it again")
+            text_area.edit_modified(True)
+        if then:
+            then()
+        return
+    modified = text_area.edit_modified()
+    tab["sync"] = {"stamp": stamp, "old_stamp": tab["stamp"], "mine": doc.snapshot(), "modified": modified,
+                   "then": [then] if then else []}
+    tab["stamp"] = stamp
+    status_var.set(f"Reading the changes another program made to {name}...")
+    threading.Thread(target=read_disk_changes,
+                     args=(tab["id"], doc.path, tab["base"], tab["base_tail"], tab["sync"]["mine"], modified),
+                     daemon=True).start()
+
+
+def read_disk_changes(key, path, base_snapshot, base_tail, mine_snapshot, modified):
+    """Runs on a thread of its own. Reads a tab's file after another program changed it and works
+    out the edits that bring the tab up to date: merged into the unsaved edits of a modified tab,
+    and the ones that reload it from disk. Hands them to finish_disk_sync through disk_syncs."""
+    try:
+        sample = arcwatch.FileSample()
+        theirs_doc = read_document(path, on_read=sample.update)
+        theirs = theirs_doc.get_text()
+        base = None if base_snapshot is None else base_snapshot.get_text() + base_tail
+        result = {"theirs": theirs_doc, "sample": sample, "same": theirs == base, "merge": None, "reload": None}
+        if not result["same"]:
+            mine = mine_snapshot.get_text()
+            if modified and base is not None:
+                result["merge"] = arcwatch.merge(base, mine + base_tail, theirs)  # Saves add the tail
+            if result["merge"] is None:
+                result["reload"] = arcwatch.diff_texts(mine, theirs)[::-1]
+    except Exception as e:
+        result = {"error": e}
+    disk_syncs.put((key, result))
+
+
+def finish_disk_sync(key, result):
+    """Applies what read_disk_changes worked out, unless the tab was edited, saved or hidden while
+    it ran, in which case the file is read again."""
+    tab = next((tab for tab in tabs if tab["id"] == key), None)
+    if tab is None:
+        return  # Closed meanwhile
+    sync, tab["sync"] = tab["sync"], None
+    doc = tab["document"]
+    name = tab_name(tab)
+    callbacks = sync["then"]
+    then = (lambda: [callback() for callback in callbacks]) if callbacks else None
+    showing = tab is current_tab and load_state is None and large_view is None
+    if (not showing or tab["stamp"] != sync["stamp"] or not doc.unchanged_since(sync["mine"])
+            or text_area.edit_modified() != sync["modified"]):
+        # The edits no longer fit
+        if tab["stamp"] == sync["stamp"]:
+            tab["stamp"] = sync["old_stamp"]
+        if showing:
+            sync_with_disk(tab, then=then)
+        else:
+            tab["disk_changed"], tab["disk_appends"] = True, None
+            if callbacks:
+                status_var.set(f"{name} was changed by another program, not saved")
+        return
+    if "error" in result:
+        status_var.set(f"{name} was changed by another program but could not be read: {result['error']}")
+        if then:
+            then()
+        return
+    theirs_doc = result["theirs"]
+    # Every way on from here leaves theirs as the base
+    tab["file_sample"] = result["sample"] if theirs_doc.encoding in APPENDABLE_ENCODINGS else None
+    file_watcher.acknowledge(tab["id"], sync["stamp"], tab["file_sample"])
+    if result["same"]:
+        status_var.set("")  # Touched, not changed
+        if then:
+            then()
+        return
+    modified = sync["modified"]
+    edits = result["merge"]
+    tail = tab["base_tail"] if edits is not None else ""
+    if edits is None:
+        if modified and not messagebox.askyesno("File Changed", f"{name} was changed by another program, and so was the same part of it here. "
+                                                                "Reload it from disk? Undo brings your version back."):
+            tab["base"], tab["base_tail"] = theirs_doc.snapshot(), ""  # Saving overwrites their version from now on
+            status_var.set(f"Kept your version of {name}, saving will replace the one on disk")
+            if then:
+                then()
+            return
+        edits = result["reload"]
+        modified = False
+
+    at_end = text_area.yview()[1] >= 1.0  # Showing the end of a log, keep following it
+    top = text_offset("@0,0")
+    history = doc.history
+    history.separator()
+    if edits and tail:
+        text_area.insert(offset_index(len(doc)), tail)
+    for offset, length, text in edits:  # Last first, the offsets of the ones still to come stay valid
+        if length:
+            text_area.delete(offset_index(offset), offset_index(offset + length))
+        if text:
+            text_area.insert(offset_index(offset), text)
+        if offset + length <= top:
+            top += len(text) - length
+        elif offset < top:
+            top = offset
+    history.close_step()
+    if at_end:
+        text_area.yview_moveto(1.0)
+    else:
+        text_area.yview(offset_index(top))
+    doc.encoding = theirs_doc.encoding
+    if modified:
+        history.mark_unsaved()
+        tab["base"], tab["base_tail"] = theirs_doc.snapshot(), ""
+        if doc.journal:  # The journal's base file is gone, start it from the merged text
+            doc.journal.compact(doc.snapshot())
+        status_var.set(f"Merged the changes another program made to {name}")
+    else:
+        history.mark_saved()
+        tab["base"], tab["base_tail"] = doc.snapshot(), ""
+        if doc.journal:
+            doc.journal.saved(doc.journal.mark(), doc.path, doc.encoding)
+        text_area.edit_modified(False)
+        status_var.set(f"Reloaded {name}, it was changed by another program")
+    update_undo_status()
+    if then:
+        then()
+
+
+def fill_tabs_menu():
+    """Lists every tab in the Tabs menu, for when there are more than the tab bar can show."""
+    tabs_menu.delete(TABS_MENU_FIXED_ENTRIES, tk.END)
+    tab_choice.set(current_tab["id"])
+    for tab in tabs:
+        tabs_menu.add_radiobutton(label=tab_label(tab), variable=tab_choice, value=tab["id"],
+                                  command=lambda tab=tab: switch_to_tab(tab))
+
+
+def install_text_proxy():
+    """Routes every text_area edit, including undo and redo, through text_command so the document
+    model stays in sync with the widget."""
+    global text_real
+    widget = str(text_area)
+    text_real = widget + "_widget"
+    root.tk.call("rename", widget, text_real)
+    root.tk.createcommand(widget, lambda *args: text_command(text_real, *args))
+
+
+def text_offset(index):
+    """Document offset of a Tk index, clamped to the end of the text."""
+    position = str(root.tk.call(text_real, "index", index))
+    if root.tk.getboolean(root.tk.call(text_real, "compare", position, ">", "end-1c")):
+        position = str(root.tk.call(text_real, "index", "end-1c"))
+    line, column = map(int, position.split("."))
+    line_start = document.line_start(line - 1)
+    if column == 0 or TK_ASTRAL_COLUMNS == 1 or not document.count_astral(line_start, document.line_start(line)):
+        return line_start + column
+    # Tk counts characters outside the BMP as two columns, so measure the line prefix instead
+    return line_start + len(str(root.tk.call(text_real, "get", f"{line}.0", position)))
+
+
+def offset_index(offset):
+    """Tk index of a document offset, the inverse of text_offset."""
+    line, column = document.line_col(offset)
+    if TK_ASTRAL_COLUMNS > 1:
+        column += document.count_astral(offset - column, offset) * (TK_ASTRAL_COLUMNS - 1)
+    return f"{line + 1}.{column}"
+
+
+def text_command(real, *args):
+    global long_line_timer
+    operation = str(args[0]) if args else ""
+    if operation in ("insert", "delete", "replace") or (operation == "mark" and len(args) > 1 and str(args[1]) == "set"):
+        # Edits and cursor moves, which are "mark set insert"
+        schedule_stats()
+        if long_line_timer is None:
+            long_line_timer = root.after(STATS_REFRESH_MS, follow_long_lines)
+    if not mirror_edits:
+        return root.tk.call((real,) + args)
+    if operation == "insert" and len(args) >= 3:
+        offset = text_offset(args[1])
+        result = root.tk.call((real,) + args)
+        document.insert(offset, "".join(str(chars) for chars in args[2::2]))
+        return result
+    if operation == "delete" and len(args) >= 2:
+        indices = list(args[1:])
+        if len(indices) % 2:  # A lone last index deletes one character
+            indices.append(f"{indices[-1]}+1c")
+        ranges = sorted((text_offset(indices[i]), text_offset(indices[i + 1])) for i in range(0, len(indices), 2))
+        result = root.tk.call((real,) + args)
+        merged = []  # Tk merges overlapping ranges the same way
+        for start, end in ranges:
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            elif end > start:
+                merged.append((start, end))
+        for start, end in reversed(merged):
+            document.delete(start, end - start)
+        return result
+    if operation == "replace" and len(args) >= 4:
+        start = text_offset(args[1])
+        end = text_offset(args[2])
+        result = root.tk.call((real,) + args)
+        document.delete(start, end - start)
+        document.insert(start, "".join(str(chars) for chars in args[3::2]))
+        return result
+    return root.tk.call((real,) + args)
+
+
+def open_find():
+    """Shows the Find/Replace window, creating it the first time."""
+    if find_state["window"] is None:
+        build_find_window()
+    window = find_state["window"]
+    window.deiconify()
+    window.lift()
+    if text_area.tag_ranges(tk.SEL):
+        selection = text_area.get(tk.SEL_FIRST, tk.SEL_LAST)
+        if "\n" not in selection:
+            find_state["find_var"].set(selection)
+    find_state["find_entry"].focus_set()
+    find_state["find_entry"].select_range(0, tk.END)
+    if find_state["document"] is not document:
+        restart_find()
+
+
+def build_find_window():
+    window = tk.Toplevel(root)
+    window.title("Find / Replace")
+    window.resizable(False, False)
+    window.protocol("WM_DELETE_WINDOW", close_find)
+    find_var = tk.StringVar()
+    replace_var = tk.StringVar()
+    regex_var = tk.BooleanVar(value=False)
+    case_var = tk.BooleanVar(value=True)
+
+    tk.Label(window, text="Find:").grid(row=0, column=0, sticky="w", padx=4, pady=2)
+    find_entry = tk.Entry(window, textvariable=find_var, width=32)
+    find_entry.grid(row=0, column=1, columnspan=2, padx=4, pady=2)
+    tk.Label(window, text="Replace:").grid(row=1, column=0, sticky="w", padx=4, pady=2)
+    tk.Entry(window, textvariable=replace_var, width=32).grid(row=1, column=1, columnspan=2, padx=4, pady=2)
+    tk.Checkbutton(window, text="Regex", variable=regex_var, command=restart_find).grid(row=2, column=1, sticky="w")
+    tk.Checkbutton(window, text="Match case", variable=case_var, command=restart_find).grid(row=2, column=2, sticky="w")
+    buttons = tk.Frame(window)
+    buttons.grid(row=3, column=0, columnspan=3, pady=4)
+    tk.Button(buttons, text="Previous", command=lambda: find_next(backwards=True)).pack(side="left", padx=2)
+    tk.Button(buttons, text="Next", command=find_next).pack(side="left", padx=2)
+    tk.Button(buttons, text="Replace", command=replace_current).pack(side="left", padx=2)
+    tk.Button(buttons, text="Replace All", command=replace_all).pack(side="left", padx=2)
+    count_label = tk.Label(window, anchor="w")
+    count_label.grid(row=4, column=0, columnspan=3, sticky="we", padx=4)
+
+    find_entry.bind("<Return>", lambda event: find_next())
+    window.bind("<Escape>", lambda event: close_find())
+    find_var.trace_add("write", lambda *args: schedule_find_restart())
+    find_state.update(window=window, find_var=find_var, replace_var=replace_var, regex_var=regex_var,
+                      case_var=case_var, find_entry=find_entry, count_label=count_label)
+
+
+def close_find():
+    """Hides the window (it is reused next time) and stops highlighting."""
+    stop_find_scan()
+    find_state["window"].withdraw()
+    find_state["pattern"] = None
+    find_state["index"].clear()
+    text_area.tag_remove("find_match", 1.0, tk.END)
+    text_area.tag_remove("find_current", 1.0, tk.END)
+
+
+def schedule_find_restart():
+    if find_state["restart_timer"] is not None:
+        root.after_cancel(find_state["restart_timer"])
+    find_state["restart_timer"] = root.after(FIND_DELAY_MS, restart_find)
+
+
+def stop_find_scan():
+    if find_state["scan"] is not None:
+        find_state["scan"]["cancel"].set()
+        find_state["scan"] = None
+
+
+def restart_find():
+    """Searches the whole document again on the search thread, for a new pattern or a new document."""
+    find_state["restart_timer"] = None
+    stop_find_scan()
+    find_state["index"].clear()
+    find_state["current"] = None
+    previous = find_state["document"]
+    if previous is not None and find_on_edit in previous.listeners:
+        previous.listeners.remove(find_on_edit)
+    find_state["document"] = document
+    document.listeners.append(find_on_edit)
+    find_state["pattern"] = None
+    text = find_state["find_var"].get() if find_state["window"] is not None else ""
+    if text:
+        try:
+            find_state["pattern"] = arcsearch.compile_pattern(text, find_state["regex_var"].get(),
+                                                              find_state["case_var"].get())
+        except re.error as e:
+            find_state["count_label"].configure(text=f"Bad regular expression: {e}")
+            refresh_find_highlights()
+            return
+        scan = {"cancel": threading.Event(), "queue": queue.Queue(), "edits": [], "done": False}
+        find_state["scan"] = scan
+        threading.Thread(target=run_find_scan, args=(document.snapshot(), find_state["pattern"], scan),
+                         daemon=True).start()
+        find_state["count_label"].configure(text="Searching...")
+        root.after(FIND_POLL_MS, poll_find)
+    else:
+        find_state["count_label"].configure(text="")
+    refresh_find_highlights()
+
+
+def run_find_scan(snapshot, pattern, scan):
+    """Runs on the search thread, over a snapshot so the user can keep typing."""
+    found = 0
+    for batch in arcsearch.scan(snapshot, pattern):
+        if scan["cancel"].is_set():
+            return
+        if batch:
+            scan["queue"].put(batch)
+            found += len(batch)
+            if found >= arcsearch.MAX_MATCHES:
+                break
+    scan["queue"].put(None)
+
+
+def poll_find():
+    scan = find_state["scan"]
+    if scan is None:
+        return
+    index = find_state["index"]
+    while True:
+        try:
+            batch = scan["queue"].get_nowait()
+        except queue.Empty:
+            break
+        if batch is None:
+            scan["done"] = True
+            break
+        # Offsets are from the snapshot, move them past whatever was typed since
+        index.add(arcsearch.map_through_edits(batch, scan["edits"]))
+        if find_state["current"] is None and len(index):
+            find_next(select=False)  # Show the first match as soon as there is one
+    if scan["done"]:
+        find_state["scan"] = None
+        if find_state["replace_all_pending"]:
+            find_state["replace_all_pending"] = False
+            replace_all()
+    else:
+        root.after(FIND_POLL_MS, poll_find)
+    update_find_count()
+    refresh_find_highlights()
+
+
+def update_find_count():
+    if find_state["window"] is None or find_state["pattern"] is None:
+        return
+    count = len(find_state["index"])
+    more = "+" if find_state["index"].full else ""
+    searching = ", searching..." if find_state["scan"] is not None else ""
+    find_state["count_label"].configure(text=f"{count:,}{more} matches{searching}")
+
+
+def find_on_edit(offset, deleted_text, inserted_text):
+    """Document listener. Keeps the match index in step with edits by searching only around them."""
+    if find_state["pattern"] is None or find_state["suspended"]:
+        return
+    if find_state["scan"] is not None:
+        find_state["scan"]["edits"].append((offset, len(deleted_text), len(inserted_text)))
+    index = find_state["index"]
+    start, end = index.edit(offset, len(deleted_text), len(inserted_text))
+    index.rescan(document, find_state["pattern"], start, end)
+    current = find_state["current"]
+    if current and current[1] > offset:
+        find_state["current"] = None
+    schedule_find_refresh()
+
+
+def schedule_find_refresh(*args):
+    if find_state["pattern"] is not None and not find_state["refresh_pending"]:
+        find_state["refresh_pending"] = True
+        root.after_idle(refresh_find_highlights)
+
+
+def refresh_find_highlights():
+    """Highlights just the matches on screen, so the cost doesn't grow with the number of matches."""
+    find_state["refresh_pending"] = False
+    text_area.tag_remove("find_match", 1.0, tk.END)
+    text_area.tag_remove("find_current", 1.0, tk.END)
+    if find_state["pattern"] is None or find_state["document"] is not document or large_view is not None:
+        return
+    first = text_offset("@0,0 linestart")
+    last = text_offset(f"@{text_area.winfo_width()},{text_area.winfo_height()} lineend")
+    for start, end in find_state["index"].in_range(first, last):
+        text_area.tag_add("find_match", offset_index(start), offset_index(end))
+    current = find_state["current"]
+    if current:
+        text_area.tag_add("find_current", offset_index(current[0]), offset_index(current[1]))
+
+
+def find_next(backwards=False, select=True):
+    if find_state["window"] is None:
+        open_find()
+        return
+    if find_state["document"] is not document:
+        restart_find()
+        return
+    cursor = text_offset(tk.INSERT)
+    current = find_state["current"]
+    if current and not backwards and current[0] == cursor:
+        cursor += 1
+    match = find_state["index"].next_after(cursor, backwards)
+    find_state["current"] = match
+    if match is None:
+        update_find_count()
+        return
+    start, end = offset_index(match[0]), offset_index(match[1])
+    text_area.see(start)
+    if select:
+        text_area.tag_remove(tk.SEL, 1.0, tk.END)
+        text_area.tag_add(tk.SEL, start, end)
+        text_area.mark_set(tk.INSERT, start)
+    refresh_find_highlights()
+
+
+def replace_current():
+    current = find_state["current"]
+    if current is None or find_state["pattern"] is None:
+        find_next()
+        return
+    start, end = current
+    replacement = arcsearch.expand_replacement(document, find_state["pattern"], start, end,
+                                               find_state["replace_var"].get(), find_state["regex_var"].get())
+    if replacement is not None:
+        text_area.replace(offset_index(start), offset_index(end), replacement)
+        text_area.mark_set(tk.INSERT, offset_index(start + len(replacement)))
+    find_state["current"] = None
+    find_next()
+
+
+def replace_all():
+    """Replaces every match as a single edit, so one undo takes it all back."""
+    pattern = find_state["pattern"]
+    if pattern is None or find_state["document"] is not document:
+        return
+    if find_state["scan"] is not None:  # Wait for the search thread to see the whole document
+        find_state["replace_all_pending"] = True
+        find_state["count_label"].configure(text="Replacing once the search finishes...")
+        return
+    replacement = find_state["replace_var"].get()
+    regex = find_state["regex_var"].get()
+    index = find_state["index"]
+    matches = index.matches()
+    if index.full:  # The index stopped early, find the rest now
+        matches = [match for batch in arcsearch.scan(document, pattern) for match in batch]
+    if not matches:
+        return
+    started = time.perf_counter()
+    find_state["suspended"] = True  # One full search afterwards beats updating the index per match
+    if document.history:
+        document.history.separator()  # Not merged into the typing before it
+    try:
+        if len(matches) > REPLACE_ALL_WHOLE_TEXT:
+            # Build the new text from the model and swap it in with one widget call
+            parts = []
+            position = 0
+            for start, end in matches:
+                new = arcsearch.expand_replacement(document, pattern, start, end, replacement, regex)
+                parts.append(document.get_text(position, start))
+                parts.append(document.get_text(start, end) if new is None else new)
+                position = end
+            parts.append(document.get_text(position))
+            view = text_area.yview()[0]
+            text_area.replace(1.0, "end-1c", "".join(parts))
+            text_area.yview_moveto(view)
+        else:
+            for start, end in reversed(matches):  # Back to front, earlier offsets stay valid
+                new = arcsearch.expand_replacement(document, pattern, start, end, replacement, regex)
+                if new is not None:
+                    text_area.replace(offset_index(start), offset_index(end), new)
+    finally:
+        find_state["suspended"] = False
+    status_var.set(f"Replaced {len(matches):,} matches in {time.perf_counter() - started:.2f}s")
+    restart_find()
+
+
+def first_paint():
+    """Runs on the first Expose of text_area. The redraw it triggers is an idle task queued before
+    finish_startup, so finish_startup runs once the text is on screen."""
+    text_area.unbind("<Expose>")
+    root.after_idle(finish_startup)
+
+
+def finish_startup():
+    """Work that can wait until the window has been drawn."""
+    global startup_status
+    STARTUP_MARKS.append(("first paint", time.perf_counter()))
+    if MEASURE_STARTUP:
+        print("Startup, ms since the script started:")
+        for step, finished in STARTUP_MARKS:
+            print(f"  {step:<14}{(finished - STARTUP_STARTED) * 1000:8.1f}")
+        total = (STARTUP_MARKS[-1][1] - STARTUP_STARTED) * 1000
+        startup_status = 0 if total <= STARTUP_BUDGET_MS else 1
+        print(f"First paint after {total:.1f} ms, budget {STARTUP_BUDGET_MS} ms: {'over budget' if startup_status else 'ok'}")
+        document.journal.discard()
+        arcjournal.wait_idle()
+        root.destroy()
+        return
+    spill_cache.remove_stale()
+    offer_recovery()
+    if FILE_ARGUMENTS:
+        open_paths(FILE_ARGUMENTS)
+
+
+def poll_forwarded_files():
+    """Brings the window up for every later launch and opens the files it was given."""
+    try:
+        while True:
+            files = forwarded_files.get_nowait()
+            root.deiconify()
+            root.lift()
+            root.focus_force()
+            if files:
+                open_paths(files)
+    except queue.Empty:
+        pass
+    root.after(FORWARDED_POLL_MS, poll_forwarded_files)
+
+
+def open_paths(paths):
+    """Opens files given on a command line in tabs of their own, one after another."""
+    pending_opens.extend(paths)
+    if load_state is None:
+        open_next_pending()
+
+
+def open_next_pending():
+    if pending_opens and load_state is None:
+        load_file(pending_opens.pop(0))
+
+
+def open_workspace_search(event=None):
+    """Shows the Search All Notes window, creating it the first time, and brings the index up to date."""
+    if search_state["window"] is None:
+        build_workspace_search_window()
+    window = search_state["window"]
+    window.deiconify()
+    window.lift()
+    search_state["entry"].focus_set()
+    search_state["entry"].select_range(0, tk.END)
+    if config["search_folder"]:
+        update_search_index()
+    else:
+        choose_search_folder()
+    return "break"
+
+
+def build_workspace_search_window():
+    import arcindex  # Pulls in sqlite3, kept out of startup
+    window = tk.Toplevel(root)
+    window.title("Search All Notes")
+    window.protocol("WM_DELETE_WINDOW", window.withdraw)
+    query_var = tk.StringVar()
+
+    top = tk.Frame(window)
+    top.pack(fill="x", padx=4, pady=4)
+    entry = tk.Entry(top, textvariable=query_var)
+    entry.pack(side="left", fill="x", expand=True)
+    tk.Button(top, text="Folder...", command=choose_search_folder).pack(side="left", padx=(4, 0))
+    status_label = tk.Label(window, anchor="w")
+    status_label.pack(side="bottom", fill="x", padx=4)
+    scrollbar = tk.Scrollbar(window)
+    scrollbar.pack(side="right", fill="y")
+    results = tk.Listbox(window, width=90, height=16, activestyle="dotbox", yscrollcommand=scrollbar.set)
+    results.pack(fill="both", expand=True, padx=(4, 0))
+    scrollbar.configure(command=results.yview)
+
+    query_var.trace_add("write", lambda *args: schedule_workspace_search())
+    entry.bind("<Return>", lambda event: open_search_hit())
+    entry.bind("<Down>", lambda event: (results.focus_set(), results.selection_set(0)))
+    results.bind("<Return>", lambda event: open_search_hit())
+    results.bind("<Double-Button-1>", lambda event: open_search_hit())
+    window.bind("<Escape>", lambda event: window.withdraw())
+    search_state.update(window=window, query_var=query_var, entry=entry, results=results,
+                        status_label=status_label, db=arcindex.connect(INDEX_FILE))
+
+
+def choose_search_folder():
+    folder = filedialog.askdirectory(parent=search_state["window"], title="Folder of notes to search",
+                                     initialdir=config["search_folder"] or None)
+    if folder:
+        config["search_folder"] = os.path.abspath(folder)
+        save_config()
+        update_search_index()
+
+
+def update_search_index():
+    """Indexes the notes that changed since last time. That is done by python arcindex.py update, a
+    process of its own which spreads the work over a process pool, so the editor never forks itself."""
+    if search_state["process"] is not None:
+        return
+    import arcindex
+    try:
+        process = subprocess.Popen([sys.executable, os.path.abspath(arcindex.__file__), "update", INDEX_FILE,
+                                    config["search_folder"]],
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    except OSError as e:
+        search_state["status_label"].configure(text=f"Indexing failed: {e}")
+        return
+    search_state["process"] = process
+    threading.Thread(target=read_index_output, args=(process, search_state["events"]), daemon=True).start()
+    search_state["status_label"].configure(text="Looking for changed notes...")
+    root.after(INDEX_POLL_MS, poll_search_index)
+
+
+def read_index_output(process, events):
+    """Runs on a helper thread, passes the lines the indexer prints on to poll_search_index."""
+    for line in process.stdout:
+        events.put(line.split())
+    events.put(["exit", process.wait()])
+
+
+def poll_search_index():
+    output = search_state["output"]
+    try:
+        while True:
+            line = search_state["events"].get_nowait()
+            if line[:1] == ["progress"]:
+                search_state["status_label"].configure(text=f"Indexing notes... {line[1]}/{line[2]}")
+            elif line[:1] == ["done"]:
+                (notes,) = search_state["db"].execute("SELECT COUNT(*) FROM files").fetchone()
+                search_state["status_label"].configure(text=f"{notes} notes, {line[1]} indexed in {float(line[3]):.1f}s")
+            elif line[:1] == ["exit"]:
+                search_state["process"] = None
+                search_state["output"] = []
+                if line[1] != 0:
+                    message = " ".join(output[-1]) if output else f"exit status {line[1]}"
+                    search_state["status_label"].configure(text=f"Indexing failed: {message}")
+                run_workspace_search()  # Catch up with notes indexed since the last query
+                return
+            else:
+                output.append(line)  # A traceback, the last line is shown if the indexer fails
+    except queue.Empty:
+        pass
+    root.after(INDEX_POLL_MS, poll_search_index)
+
+
+def schedule_workspace_search():
+    if search_state["timer"] is not None:
+        root.after_cancel(search_state["timer"])
+    search_state["timer"] = root.after(FIND_DELAY_MS, run_workspace_search)
+
+
+def run_workspace_search():
+    """Hands the query to the search thread. Snippets read from the notes, which can take a while for
+    big ones, so the UI only shows the hits once they are in."""
+    search_state["timer"] = None
+    search_state["query_number"] += 1
+    if search_state["thread"] is None:
+        search_state["thread"] = threading.Thread(target=run_search_queries, args=(search_state["queries"],
+                                                                                   search_state["found"]),
+                                                  daemon=True)
+        search_state["thread"].start()
+    search_state["queries"].put((search_state["query_number"], search_state["query_var"].get()))
+    if not search_state["polling"]:
+        search_state["polling"] = True
+        root.after(SEARCH_POLL_MS, poll_workspace_search)
+
+
+def run_search_queries(queries, found):
+    """Runs on the search thread, with a database connection of its own. Only the newest of the
+    queries waiting is run, the others are out of date already."""
+    import arcindex
+    db = None
+    while True:
+        number, query = queries.get()
+        try:
+            while True:
+                number, query = queries.get_nowait()
+        except queue.Empty:
+            pass
+        started = time.perf_counter()
+        try:
+            if db is None:
+                db = arcindex.connect(INDEX_FILE)
+            hits = arcindex.search(db, query)
+        except Exception as e:  # The indexer holds the database longer than the busy timeout
+            print("Error searching notes:", e)
+            hits = []
+        found.put((number, hits, time.perf_counter() - started))
+
+
+def poll_workspace_search():
+    """Shows the hits of the newest query once the search thread has them."""
+    newest = None
+    try:
+        while True:
+            newest = search_state["found"].get_nowait()
+    except queue.Empty:
+        pass
+    if newest is None or newest[0] != search_state["query_number"]:
+        root.after(SEARCH_POLL_MS, poll_workspace_search)  # Still running, or a newer query is
+        return
+    search_state["polling"] = False
+    number, hits, elapsed = newest
+    arcperf.recorder.record("search_notes", elapsed)
+    search_state["hits"] = hits
+    results = search_state["results"]
+    results.delete(0, tk.END)
+    folder = config["search_folder"]
+    for _, path, line, text in hits:
+        results.insert(tk.END, f"{os.path.relpath(path, folder)}:{line + 1}  {text}")
+
+
+def open_search_hit():
+    results = search_state["results"]
+    selection = results.curselection()
+    number = selection[0] if selection else 0
+    if number < len(search_state["hits"]):
+        _, path, line, _ = search_state["hits"][number]
+        load_file(path, line)
+    return "break"
 
 
 def insert_emoji(emoji):
+    if large_view is not None or str(text_area.cget("state")) == "disabled":
+        return  # Read-only. Tk would drop the insert, but the document would still get the emoji
     text_area.insert(tk.INSERT, emoji) #inserts emoji at the current cursor position
 
 
 def open_preferences():
-    global save_hotkey_entry, exit_hotkey_entry, emoji_hotkey_entry, font_var
+    """Shows the Preferences window, building it the first time. Closing it only hides it."""
+    if preferences_window is None:
+        build_preferences_window()
+    for entry, key in ((save_hotkey_entry, "save_hotkey"), (exit_hotkey_entry, "exit_hotkey"),
+                       (emoji_hotkey_entry, "emoji_hotkey")):
+        entry.delete(0, tk.END)
+        entry.insert(0, config[key])
+    font_var.set(config["font"])
+    font_search_var.set("")  # Shows every font and selects the current one
+    preferences_window.deiconify()
+    preferences_window.lift()
+
+
+def build_preferences_window():
+    global preferences_window, save_hotkey_entry, exit_hotkey_entry, emoji_hotkey_entry, font_var, font_search_var
+    global font_list, font_families
 
     preferences_window = tk.Toplevel(root)
     preferences_window.title("Preferences")
-    preferences_window.geometry("400x250")
+    preferences_window.geometry("400x420")
+    preferences_window.protocol("WM_DELETE_WINDOW", preferences_window.withdraw)
 
     tk.Label(preferences_window, text="Save Hotkey:").pack()
     save_hotkey_entry = tk.Entry(preferences_window)
-    save_hotkey_entry.insert(0, config["save_hotkey"])
     save_hotkey_entry.pack()
 
     tk.Label(preferences_window, text="Exit Hotkey:").pack()
     exit_hotkey_entry = tk.Entry(preferences_window)
-    exit_hotkey_entry.insert(0, config["exit_hotkey"])
     exit_hotkey_entry.pack()
 
     tk.Label(preferences_window, text="Emoji Picker Hotkey:").pack()
     emoji_hotkey_entry = tk.Entry(preferences_window)
-    emoji_hotkey_entry.insert(0, config["emoji_hotkey"])
     emoji_hotkey_entry.pack()
 
+    tk.Button(preferences_window, text="Apply", command=update_hotkeys).pack(pady=10)
+
+    # Font chooser: type to narrow the list, click a font to use it
     tk.Label(preferences_window, text="Font:").pack()
     font_var = tk.StringVar(value=config["font"])
-    font_dropdown = tk.OptionMenu(preferences_window, font_var, *font.families(), command=lambda _: change_font())
-    font_dropdown.pack()
+    font_search_var = tk.StringVar()
+    tk.Entry(preferences_window, textvariable=font_search_var).pack(fill="x", padx=10)
+    list_frame = tk.Frame(preferences_window)
+    list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+    font_scrollbar = tk.Scrollbar(list_frame)
+    font_scrollbar.pack(side="right", fill="y")
+    # A Listbox only draws the rows on screen, so thousands of fonts cost no more than a few
+    font_list = tk.Listbox(list_frame, exportselection=False, yscrollcommand=font_scrollbar.set)
+    font_list.pack(side="left", fill=tk.BOTH, expand=True)
+    font_scrollbar.configure(command=font_list.yview)
+    font_list.bind("<<ListboxSelect>>", lambda event: pick_font())
+    font_families = cached_families(FONT_CACHE_FILE, lambda: font.families(root))
+    font_search_var.trace_add("write", lambda *args: filter_fonts())
+
+
+def filter_fonts():
+    query = font_search_var.get().lower()
+    matches = [family for family in font_families if query in family.lower()] if query else font_families
+    font_list.delete(0, tk.END)
+    if matches:
+        font_list.insert(tk.END, *matches)
+    if config["font"] in matches:
+        index = matches.index(config["font"])
+        font_list.selection_set(index)
+        font_list.see(index)
 
-    tk.Button(preferences_window, text="Apply", command=update_hotkeys).pack(pady=10)
+
+def pick_font():
+    selection = font_list.curselection()
+    if selection:
+        font_var.set(font_list.get(selection[0]))
+        change_font()
 
 
 def change_font():
     config["font"] = font_var.get()
-    text_area.configure(font=(config["font"], config["font_size"]))
+    apply_font()
     save_config()
 
 
+def time_until_idle(name):
+    """Records the time from now until Tk has run the handlers and redrawn. Redrawing is itself an
+    idle task queued by the handlers, so the sample is taken one idle pass later."""
+    if arcperf.recorder.enabled:
+        started = time.perf_counter()
+        root.after_idle(lambda: root.after_idle(lambda: arcperf.recorder.record(name, time.perf_counter() - started)))
+
+
+def toggle_latency_recording():
+    config["perf_instrumentation"] = latency_recording_var.get()
+    if not config["perf_instrumentation"]:
+        config["perf_overlay"] = False  # Nothing new to show
+        latency_overlay_var.set(False)
+    apply_latency_settings()
+    save_config()
+
+
+def toggle_latency_overlay():
+    config["perf_overlay"] = latency_overlay_var.get()
+    if config["perf_overlay"]:
+        config["perf_instrumentation"] = True
+        latency_recording_var.set(True)
+    apply_latency_settings()
+    save_config()
+
+
+def apply_latency_settings():
+    global latency_log
+    arcperf.recorder.enabled = config["perf_instrumentation"]
+    if arcperf.recorder.enabled and latency_log is None:
+        latency_log = arcperf.open_log(LATENCY_LOG_FILE)
+    if config["perf_overlay"]:
+        latency_label.pack(side="right", padx=4)
+        if latency_overlay_timer is None:
+            update_latency_overlay()
+    else:
+        latency_label.pack_forget()
+
+
+def update_latency_overlay():
+    global latency_overlay_timer
+    latency_overlay_timer = None
+    if not config["perf_overlay"]:
+        return
+    summary = arcperf.recorder.summary()
+    if summary:
+        latency_var.set("  ".join(f"{name} {values['p50_ms']:.1f}/{values['p95_ms']:.1f}/{values['p99_ms']:.1f}"
+                                  for name, values in summary.items()) + " ms (p50/p95/p99)")
+    else:
+        latency_var.set("No latency samples yet")
+    latency_overlay_timer = root.after(LATENCY_OVERLAY_MS, update_latency_overlay)
+
+
+def export_latency():
+    """Appends the latency percentiles to the log in config_dir while recording is on."""
+    if latency_log is not None and arcperf.recorder.enabled:
+        try:
+            arcperf.export(latency_log)
+        except Exception as e:
+            print("Error writing latency log:", e)
+    root.after(LATENCY_EXPORT_MS, export_latency)
+
+
+def toggle_profiling():
+    """Starts a cProfile capture, or stops the running one and saves it to PROFILE_DIR."""
+    global profiler
+    if profiling_var.get():
+        import cProfile  # Rarely used, kept out of startup
+        profiler = cProfile.Profile()
+        profiler.enable()
+        status_var.set("Profiling, untick Preferences > Profile to save the capture")
+    elif profiler is not None:
+        profiler.disable()
+        profile_path = os.path.join(PROFILE_DIR, time.strftime("arcnote-%Y%m%d-%H%M%S.prof"))
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(profile_path)
+            status_var.set(f"Profile saved to {profile_path}")
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not save the profile: {e}")
+        profiler = None
+
+
 def update_hotkeys():
     config["save_hotkey"] = save_hotkey_entry.get()
     config["exit_hotkey"] = exit_hotkey_entry.get()
@@ -253,7 +2576,51 @@ root.geometry("600x400")
 root.protocol("WM_DELETE_WINDOW", on_close)
 
 config = load_config()
-current_file = None
+STARTUP_MARKS.append(("config", time.perf_counter()))
+config_dirty = False
+config_save_timer = None  # Pending debounced flush_config
+config_writer = None  # Thread writing config.json in the background
+config_error = None  # Set by a failed background write, reported on the next flush
+document = Document()  # The text being edited, text_area is a view over it
+load_state = None  # Set while load_file is streaming a file into text_area
+mirror_edits = True  # False while show_document fills text_area from a document that already has the text
+large_view = None  # Set while a file is shown in large file mode, see open_large_view
+emoji_picker = None  # The emoji picker window and its state, built on first use
+undo_step_pending = False  # close_undo_step is waiting for Tk to go idle
+about_window = None  # Built on first use, like the emoji picker and Preferences
+preferences_window = None
+latency_log = None  # Logger for the latency percentiles, opened when recording is first turned on
+latency_overlay_timer = None
+stats_timer = None  # refresh_stats is waiting for the next frame
+long_line_timer = None  # follow_long_lines is waiting for the next frame
+long_lines_on = False  # text_area wraps by character because of long lines, see set_long_lines
+profiler = None  # Running cProfile capture
+startup_status = 0  # Exit status of --measure-startup
+tabs = []  # One dict per open document, in tab bar order, see add_tab
+current_tab = None
+next_tab_id = 0
+tab_clock = 0  # Counts tab switches, a tab's last_used is the value when it was last shown
+pending_opens = []  # Files from the command line or other launches still to be opened, see open_paths
+spill_cache = arcspill.SpillCache(SPILL_DIR)
+file_watcher = None  # Started when the first file is opened, see watch_tab
+file_changes = queue.Queue()  # (tab id, stamp, appended) from the watcher thread, see poll_file_changes
+disk_syncs = queue.Queue()  # (tab id, result) from read_disk_changes, see finish_disk_sync
+spill_state = {"thread": None, "jobs": queue.Queue(), "done": queue.Queue(), "pending": 0}  # See evict_inactive_tabs
+find_state = {"window": None, "document": None, "pattern": None, "index": arcsearch.MatchIndex(), "scan": None,
+              "current": None, "restart_timer": None, "refresh_pending": False, "suspended": False,
+              "replace_all_pending": False}  # Find/Replace, see open_find
+search_state = {"window": None, "db": None, "process": None, "events": queue.Queue(), "output": [],
+                "timer": None, "hits": [], "thread": None, "queries": queue.Queue(), "found": queue.Queue(),
+                "query_number": 0, "polling": False}  # Search All Notes, see open_workspace_search
+save_lock = threading.Lock()
+save_pending = {}  # path -> newest save job waiting for the save thread
+save_running = False
+save_idle = threading.Event()
+save_idle.set()
+save_events = queue.Queue()  # Progress and results from the save thread, shown by poll_saves
+index_lock = threading.Lock()
+index_thread = None  # Started by the first save into the notes folder, see queue_index_update
+index_updates = queue.Queue()  # Paths of saved files for the index thread
 # The 'is_saved' flag is effectively managed by text_area.edit_modified()
 # and the save_file/save_file_as functions. It can be removed or used for other purposes
 # but is not strictly necessary for the core save logic as currently implemented.
@@ -268,9 +2635,37 @@ file_menu.add_separator()
 file_menu.add_command(label="Exit", command=on_close)
 menu_bar.add_cascade(label="File", menu=file_menu)
 
+edit_menu = tk.Menu(menu_bar, tearoff=0)
+edit_menu.add_command(label="Undo", command=undo_edit, accelerator="Ctrl+Z")
+edit_menu.add_command(label="Redo", command=redo_edit, accelerator="Ctrl+Y")
+edit_menu.add_separator()
+edit_menu.add_command(label="Find / Replace...", command=open_find)
+edit_menu.add_command(label="Find Next", command=find_next)
+edit_menu.add_command(label="Search All Notes...", command=open_workspace_search, accelerator="Ctrl+Shift+F")
+edit_menu.add_command(label="Go to Line...", command=go_to_line)
+edit_menu.add_command(label="Search Large File...", command=search_large_file, state="disabled")
+menu_bar.add_cascade(label="Edit", menu=edit_menu)
+
+tabs_menu = tk.Menu(menu_bar, tearoff=0, postcommand=fill_tabs_menu)
+tabs_menu.add_command(label="New Tab", command=new_tab, accelerator="Ctrl+N")
+tabs_menu.add_command(label="Close Tab", command=close_tab, accelerator="Ctrl+W")
+tabs_menu.add_command(label="Next Tab", command=lambda: cycle_tabs(1), accelerator="Ctrl+Tab")
+tabs_menu.add_command(label="Previous Tab", command=lambda: cycle_tabs(-1), accelerator="Ctrl+Shift+Tab")
+tabs_menu.add_separator()
+TABS_MENU_FIXED_ENTRIES = 5  # fill_tabs_menu lists the open tabs after these
+tab_choice = tk.IntVar()
+menu_bar.add_cascade(label="Tabs", menu=tabs_menu)
+
 preferences_menu = tk.Menu(menu_bar, tearoff=0)
 preferences_menu.add_command(label="Preferences", command=open_preferences)
 preferences_menu.add_command(label="Toggle Dark Mode", command=toggle_dark_mode)
+preferences_menu.add_separator()
+latency_recording_var = tk.BooleanVar(value=config["perf_instrumentation"])
+latency_overlay_var = tk.BooleanVar(value=config["perf_overlay"])
+profiling_var = tk.BooleanVar(value=False)
+preferences_menu.add_checkbutton(label="Record Latency", variable=latency_recording_var, command=toggle_latency_recording)
+preferences_menu.add_checkbutton(label="Show Latency Overlay", variable=latency_overlay_var, command=toggle_latency_overlay)
+preferences_menu.add_checkbutton(label="Profile", variable=profiling_var, command=toggle_profiling)
 menu_bar.add_cascade(label="Preferences", menu=preferences_menu)
 
 about_menu = tk.Menu(menu_bar, tearoff=0)
@@ -279,8 +2674,74 @@ menu_bar.add_cascade(label="About", menu=about_menu)
 
 root.config(menu=menu_bar)
 
-text_area = tk.Text(root, wrap="word", undo=True, font=(config["font"], config["font_size"]))
+status_bar = tk.Frame(root)
+status_bar.pack(side="bottom", fill="x")  # Packed before text_area so it is never squeezed out
+status_var = tk.StringVar()
+status_label = tk.Label(status_bar, textvariable=status_var, anchor="w")
+status_label.pack(side="left", fill="x", expand=True)
+undo_var = tk.StringVar()
+undo_label = tk.Label(status_bar, textvariable=undo_var, anchor="e")
+undo_label.pack(side="right", padx=4)
+stats_var = tk.StringVar()
+stats_label = tk.Label(status_bar, textvariable=stats_var, anchor="e")
+stats_label.pack(side="right", padx=4)
+latency_var = tk.StringVar()
+latency_label = tk.Label(status_bar, textvariable=latency_var, anchor="e")  # Packed while the overlay is on
+load_progress = ttk.Progressbar(status_bar, length=150, mode="determinate")
+cancel_load_button = tk.Button(status_bar, text="Cancel", command=cancel_opening)
+root.bind("<Escape>", lambda event: cancel_opening())
+
+tab_bar = ttk.Notebook(root, takefocus=False)
+tab_bar.pack(side="top", fill="x")
+tab_bar.bind("<<NotebookTabChanged>>", on_tab_changed)
+
+text_area = tk.Text(root, wrap="word", undo=False, font=(config["font"], config["font_size"]))  # Undo is ours, see arcundo.py
+large_scrollbar = tk.Scrollbar(root, command=large_view_scroll)  # Only shown in large file mode
 text_area.pack(expand=True, fill="both")
+text_area.tag_configure("large_match", background="yellow", foreground="black")
+text_area.tag_configure("find_match", background="yellow", foreground="black")
+text_area.tag_configure("find_current", background="orange", foreground="black")
+text_area.tag_configure("long_elide", elide=True)
+text_area.tag_raise(tk.SEL)
+text_area.configure(yscrollcommand=schedule_find_refresh)  # Highlights follow the visible region
+for sequence in ("<Up>", "<Down>", "<Prior>", "<Next>", "<MouseWheel>", "<Button-4>", "<Button-5>"):
+    text_area.bind(sequence, large_view_key)
+text_area.bind("<Configure>", lambda event: render_large_view() if large_view is not None else None)
+root.bind("<Control-g>", lambda event: go_to_line())
+text_area.bind("<Control-f>", lambda event: (open_find(), "break")[1])  # Not also Tk's cursor forward
+root.bind("<Control-F>", open_workspace_search)
+root.bind("<F3>", lambda event: find_next())
+text_area.bind("<<Undo>>", undo_edit)
+text_area.bind("<<Redo>>", redo_edit)
+text_area.bind("<Control-z>", undo_edit)
+text_area.bind("<Control-y>", redo_edit)
+text_area.bind("<KeyPress>", lambda event: time_until_idle("keystroke"), add="+")
+text_area.bind("<<Modified>>", on_text_modified)
+# Bound on text_area as well, so Text's own Ctrl+N and Ctrl+Tab bindings don't run first
+for sequence, command in (("<Control-n>", new_tab), ("<Control-w>", close_tab),
+                          ("<Control-Tab>", lambda event: cycle_tabs(1)),
+                          ("<Control-Shift-Tab>", lambda event: cycle_tabs(-1)),
+                          ("<Control-ISO_Left_Tab>", lambda event: cycle_tabs(-1))):  # Shift+Tab on X11
+    try:
+        root.bind(sequence, command)
+        text_area.bind(sequence, command)
+    except tk.TclError:  # ISO_Left_Tab is X11 only
+        pass
+install_text_proxy()
+TK_ASTRAL_COLUMNS = int(root.tk.call("string", "length", "\U0001F600"))  # 2 where Tk stores UTF-16
 apply_hotkeys()
+apply_latency_settings()
 apply_theme()
+start_journal(document)
+start_history(document)
+switch_to_tab(add_tab(document))
+root.after(JOURNAL_FLUSH_MS, flush_journal)
+root.after(LATENCY_EXPORT_MS, export_latency)
+root.after(FILE_CHANGE_POLL_MS, poll_file_changes)
+if instance_server is not None:
+    root.after(FORWARDED_POLL_MS, poll_forwarded_files)
+text_area.bind("<Expose>", lambda event: first_paint())  # Recovery is offered once the window is up
+STARTUP_MARKS.append(("window built", time.perf_counter()))
 root.mainloop()
+if MEASURE_STARTUP:
+    sys.exit(startup_status)
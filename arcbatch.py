@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from arcdoc import atomic_write, read_document, ARC_TRAILING_NEWLINE
+from arcpack import pack_chunks, PACKED_ENCODINGS
+
+# Command line tools for folders of .arc notes, without Tk:
+#
+#   python ArcNote-0.2.py check NOTES...    reports notes that aren't plain UTF-8 .arc files, exit status 1 if any
+#   python ArcNote-0.2.py convert NOTES...  rewrites those notes as UTF-8, atomically, the way the editor saves
+#   python ArcNote-0.2.py stats NOTES...    encodings, lines and sizes
+#
+# NOTES are files or folders, folders are searched for .arc files. Notes are read with the editor's own
+# decoding (arcdoc.read_document) and spread over a process pool, one note per task.
+
+NOTE_EXTENSIONS = (".arc",)
+PARALLEL_MIN_FILES = 20  # Fewer notes than this are done without starting a pool
+SCAN_CHUNK_BYTES = 1024 * 1024
+
+
+def find_notes(paths):
+    """Files named on the command line, plus the .arc files under the folders named."""
+    notes = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, names in os.walk(path):
+                subdirectories[:] = sorted(name for name in subdirectories if not name.startswith("."))
+                notes.extend(os.path.join(directory, name) for name in sorted(names)
+                             if name.lower().endswith(NOTE_EXTENSIONS))
+        else:
+            notes.append(path)
+    return notes
+
+
+def line_endings(path):
+    """Counts of \\r\\n, lone \\r and lone \\n in a file, read in chunks."""
+    crlf = cr = lf = 0
+    previous = b""
+    with open(path, "rb") as file:
+        for data in iter(lambda: file.read(SCAN_CHUNK_BYTES), b""):
+            if previous == b"\r" and data.startswith(b"\n"):  # A \r\n split between two chunks
+                crlf += 1
+                cr -= 1
+                lf -= 1
+            pairs = data.count(b"\r\n")
+            crlf += pairs
+            cr += data.count(b"\r") - pairs
+            lf += data.count(b"\n") - pairs
+            previous = data[-1:]
+    return crlf, cr, lf
+
+
+def inspect_note(path, convert=False, dry_run=False):
+    """Reads one note and returns what check, convert and stats report about it. With convert, a note
+    that isn't already UTF-8 with consistent line endings and a trailing newline is rewritten.
+    Runs on the pool's worker processes."""
+    result = {"path": path, "bytes": 0, "encoding": None, "chars": 0, "lines": 0, "problems": [],
+              "converted": False, "error": None}
+    try:
+        result["bytes"] = os.path.getsize(path)
+        document = read_document(path)
+    except (OSError, ValueError) as e:  # ValueError: a damaged compressed note
+        result["error"] = "not UTF-8 or cp1252" if isinstance(e, UnicodeDecodeError) else str(e)
+        return result
+    result["encoding"] = document.encoding
+    result["chars"] = len(document)
+    missing_newline = len(document) and document.get_text(len(document) - 1) != ARC_TRAILING_NEWLINE
+    result["lines"] = document.line_count - (0 if missing_newline else 1)  # Like wc -l, plus an unfinished last line
+    problems = result["problems"]
+    packed = document.encoding in PACKED_ENCODINGS  # Compressed .arc, UTF-8 with \n line endings inside
+    if document.encoding == "utf-8-sig":
+        problems.append("byte order mark")
+    elif document.encoding != "utf-8" and not packed:
+        problems.append(f"encoded as {document.encoding}")
+    if document.encoding in ("utf-8", "utf-8-sig", "cp1252"):  # Single-byte line endings, UTF-16 is rewritten anyway
+        crlf, cr, lf = line_endings(path)
+        if cr or (crlf and lf):
+            problems.append("mixed line endings")
+    if missing_newline:
+        problems.append("no trailing newline")
+    if convert and problems and not dry_run:
+        def chunks():
+            yield from document.iter_chunks()
+            if missing_newline:
+                yield ARC_TRAILING_NEWLINE
+        try:
+            if packed:  # Stays compressed
+                atomic_write(path, pack_chunks(chunks(), document.encoding), None)
+            else:  # Like a save from the editor: \n line endings on every platform
+                atomic_write(path, chunks(), "utf-8")
+        except OSError as e:
+            result["error"] = str(e)
+            return result
+        result["converted"] = True
+    return result
+
+
+def job_count(text):
+    """argparse type of --jobs."""
+    jobs = int(text)
+    if jobs < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {jobs}")
+    return jobs
+
+
+def run_all(notes, jobs, convert=False, dry_run=False):
+    """Yields inspect_note results in the order of notes."""
+    if len(notes) < PARALLEL_MIN_FILES or jobs == 1:
+        for note in notes:
+            yield inspect_note(note, convert, dry_run)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(jobs) as pool:
+        yield from pool.map(inspect_note, notes, [convert] * len(notes), [dry_run] * len(notes),
+                            chunksize=max(1, min(64, len(notes) // (jobs or os.cpu_count() or 1) // 4)))
+
+
+def check(args, notes):
+    failed = 0
+    for result in run_all(notes, args.jobs):
+        if result["error"] or result["problems"]:
+            failed += 1
+            print(f"{result['path']}: {result['error'] or ', '.join(result['problems'])}")
+    print(f"{len(notes) - failed} of {len(notes)} notes are fine", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def convert(args, notes):
+    converted = failed = 0
+    for result in run_all(notes, args.jobs, convert=True, dry_run=args.dry_run):
+        if result["error"]:
+            failed += 1
+            print(f"{result['path']}: {result['error']}, left as it is")
+        elif result["problems"]:
+            converted += 1
+            print(f"{result['path']}: {'would fix' if args.dry_run else 'fixed'} {', '.join(result['problems'])}")
+    print(f"{'Would convert' if args.dry_run else 'Converted'} {converted} of {len(notes)} notes"
+          + (f", {failed} could not be read" if failed else ""), file=sys.stderr)
+    return 1 if failed else 0
+
+
+def stats(args, notes):
+    totals = {"notes": 0, "bytes": 0, "chars": 0, "lines": 0, "encodings": {}, "problems": {}, "unreadable": 0,
+              "largest": None}
+    largest = -1
+    for result in run_all(notes, args.jobs):
+        totals["notes"] += 1
+        if result["error"]:
+            totals["unreadable"] += 1
+            continue
+        for key in ("bytes", "chars", "lines"):
+            totals[key] += result[key]
+        totals["encodings"][result["encoding"]] = totals["encodings"].get(result["encoding"], 0) + 1
+        for problem in result["problems"]:
+            totals["problems"][problem] = totals["problems"].get(problem, 0) + 1
+        if result["bytes"] > largest:
+            largest = result["bytes"]
+            totals["largest"] = result["path"]
+    if args.json:
+        json.dump(totals, sys.stdout, indent=2)
+        print()
+        return 0
+    readable = max(totals["notes"] - totals["unreadable"], 1)
+    print(f"Notes:      {totals['notes']}" + (f" ({totals['unreadable']} unreadable)" if totals["unreadable"] else ""))
+    print(f"Size:       {totals['bytes']} bytes, {totals['bytes'] // readable} on average")
+    print(f"Characters: {totals['chars']}")
+    print(f"Lines:      {totals['lines']}, {totals['lines'] // readable} on average")
+    if totals["largest"]:
+        print(f"Largest:    {totals['largest']} ({largest} bytes)")
+    for encoding, count in sorted(totals["encodings"].items(), key=lambda item: -item[1]):
+        print(f"Encoding:   {encoding} {count}")
+    for problem, count in sorted(totals["problems"].items(), key=lambda item: -item[1]):
+        print(f"Problem:    {problem} {count}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="ArcNote-0.2.py", description="Check, convert and count .arc notes without opening the editor.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("check", "list notes that aren't UTF-8 with consistent line endings and a trailing newline"),
+                            ("convert", "rewrite those notes as UTF-8, atomically"),
+                            ("stats", "encodings, lines and sizes")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("paths", nargs="+", help=".arc files, or folders to search for them")
+        command.add_argument("--jobs", type=job_count, default=None, help="worker processes (default: one per CPU)")
+        if name == "convert":
+            command.add_argument("--dry-run", action="store_true", help="only list what would be converted")
+        if name == "stats":
+            command.add_argument("--json", action="store_true", help="print the totals as JSON")
+    args = parser.parse_args(argv)
+    started = time.perf_counter()
+    notes = find_notes(args.paths)
+    status = {"check": check, "convert": convert, "stats": stats}[args.command](args, notes)
+    print(f"{len(notes)} notes in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,407 @@
+import argparse
+import json
+import os
+import platform
+import random
+import runpy
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Benchmarks for the editor. Each corpus is opened in a fresh copy of the editor script running under
+# a virtual X server (Xvfb), with the file dialogs and message boxes stubbed out and mainloop replaced
+# by the measurements. Results are written as JSON so two runs can be compared:
+#
+#   python arcbench.py run --script ArcNote.py --out old.json
+#   python arcbench.py run --script ArcNote-0.2.py --out new.json
+#   python arcbench.py compare old.json new.json
+#
+# compare exits with status 1 if anything got slower by more than the threshold.
+
+KB = 1024
+MB = 1024 * KB
+GB = 1024 * MB
+# name: (size in bytes, encoding, characters per line)
+CORPORA = {"utf8-1k": (KB, "utf-8", 80),
+           "utf8-1m": (MB, "utf-8", 80),
+           "utf8-10m": (10 * MB, "utf-8", 80),
+           "utf8-100m": (100 * MB, "utf-8", 80),
+           "utf8-1g": (GB, "utf-8", 80),
+           "cp1252-1m": (MB, "cp1252", 80),
+           "cp1252-100m": (100 * MB, "cp1252", 80),
+           "longlines-1m": (MB, "utf-8", 100 * KB),
+           "longlines-10m": (10 * MB, "utf-8", 10 * MB)}
+DEFAULT_CORPORA = ["utf8-1k", "utf8-1m", "utf8-10m", "cp1252-1m", "longlines-1m"]
+CORPUS_SEED = 360  # Same corpora on every machine
+CORPUS_BLOCK_CHARS = MB  # Corpora are written from a pool of random blocks this big
+CORPUS_BLOCK_POOL = 16
+WORDS = "the quick brown fox jumps over a lazy dog arc note editor text line piece table undo save open".split()
+ACCENTED_WORDS = ["café", "naïve", "résumé", "façade", "€100", "señor", "Zürich"]  # All in cp1252 too
+EMOJI_WORDS = ["\U0001F600", "\U0001F44D", "\u2764\ufe0f"]  # utf-8 corpora only
+TYPING_TEXT = "arcbench typing test "
+KEYSYMS = {" ": "space"}
+TYPING_KEYSTROKES = 200
+UNDO_STEPS = 20
+EMOJI_INSERTS = 50
+DEFAULT_TIMEOUT = 1800  # Seconds one corpus may take before it is recorded as timed out
+DEFAULT_THRESHOLD = 0.10  # compare flags metrics that got this much worse...
+NOISE_FLOOR = {"_s": 0.005, "_ms": 0.5, "_bytes": 4 * MB}  # ...and by more than this in absolute terms
+
+
+# Corpora
+def generate_block(rng, encoding, line_length):
+    words = WORDS + ACCENTED_WORDS + (EMOJI_WORDS if encoding == "utf-8" else [])
+    weights = [20] * len(WORDS) + [1] * (len(words) - len(WORDS))
+    parts = []
+    chars = 0
+    line = 0
+    choices = iter(())
+    while chars < CORPUS_BLOCK_CHARS:
+        word = next(choices, None)
+        if word is None:
+            choices = iter(rng.choices(words, weights, k=CORPUS_BLOCK_CHARS // 4))
+            continue
+        parts.append(word)
+        chars += len(word) + 1
+        line += len(word) + 1
+        if line_length < CORPUS_BLOCK_CHARS and line >= line_length:
+            parts.append("\n")
+            line = 0
+        else:
+            parts.append(" ")
+    if line_length < CORPUS_BLOCK_CHARS:
+        parts[-1] = "\n"  # Blocks end a line, so lines don't run across blocks
+    return "".join(parts).encode(encoding)
+
+
+def make_corpus(name, directory):
+    """Path of the corpus called name, generated on first use."""
+    size, encoding, line_length = CORPORA[name]
+    path = os.path.join(directory, name + ".arc")
+    if os.path.exists(path) and os.path.getsize(path) == size:
+        return path
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(f"{CORPUS_SEED}-{name}")
+    pool = [generate_block(rng, encoding, line_length) for _ in range(min(CORPUS_BLOCK_POOL, size // MB + 1))]
+    blocks_per_line = max(line_length // CORPUS_BLOCK_CHARS, 1)
+    written = 0
+    with open(path + ".tmp", "wb") as file:
+        blocks = 0
+        while written < size:
+            block = rng.choice(pool)
+            blocks += 1
+            if line_length >= CORPUS_BLOCK_CHARS and blocks % blocks_per_line == 0:
+                block = block[:-1] + b"\n"  # Replaces the trailing space
+            block = block[:size - written]
+            if written + len(block) == size:
+                # Don't end on a partial character, pad with spaces instead
+                block = block.decode(encoding, errors="ignore").encode(encoding)
+                block += b" " * (size - written - len(block))
+            file.write(block)
+            written += len(block)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+# Measurements, run inside the child process
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return None
+    def pick(fraction):
+        return round(samples[min(int(len(samples) * fraction), len(samples) - 1)] * 1000, 3)
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "max_ms": round(samples[-1] * 1000, 3),
+            "count": len(samples)}
+
+
+def wait_until_idle(root, editor):
+    """Runs the event loop until a streaming load and any background save are done."""
+    while editor.get("load_state") is not None or (editor.get("save_idle") is not None and not editor["save_idle"].is_set()):
+        root.update()
+    root.update()
+
+
+def timed(root, action):
+    started = time.perf_counter()
+    action()
+    root.update_idletasks()
+    return time.perf_counter() - started
+
+
+def separator(text):
+    try:
+        text.edit_separator()
+    except Exception:
+        pass  # Versions with their own undo history run Tk without one
+
+
+def measure(root, editor, corpus, save_path, dialogs):
+    text = editor["text_area"]
+    results = {}
+    root.update()
+
+    started = time.perf_counter()
+    editor["open_file"]()
+    first_paint = None
+    while editor.get("load_state") is not None:
+        root.update()
+        if first_paint is None and text.compare("end-1c", "!=", "1.0"):
+            first_paint = time.perf_counter() - started
+    root.update_idletasks()
+    results["open_s"] = time.perf_counter() - started
+    results["first_paint_s"] = first_paint if first_paint is not None else results["open_s"]
+    if editor.get("large_view") is not None:
+        results["mode"] = "large"  # Read-only, there is nothing to type into
+        return results
+    results["mode"] = "edit"
+
+    # Typing in the middle of the file
+    lines = int(text.index("end-1c").split(".")[0])
+    text.mark_set("insert", f"{max(lines // 2, 1)}.0")
+    text.focus_force()
+    root.update()
+    method = "keypress"
+    latencies = []
+    for keystroke in range(TYPING_KEYSTROKES):
+        char = TYPING_TEXT[keystroke % len(TYPING_TEXT)]
+        if method == "keypress":
+            latencies.append(timed(root, lambda: text.event_generate("<KeyPress>", keysym=KEYSYMS.get(char, char))))
+            if keystroke == 0 and text.get("insert-1c") != char:
+                method = "insert"  # No keyboard focus under this window manager, insert directly
+        if method == "insert":
+            latencies.append(timed(root, lambda: text.insert("insert", char)))
+    results["typing"] = percentiles(latencies[1:] if method == "insert" else latencies)
+    results["typing_method"] = method
+
+    # Undo and redo of separate small edits, then of deleting the whole text
+    separator(text)
+    root.update()
+    for step in range(UNDO_STEPS):
+        text.insert(f"{1 + step * max(lines // UNDO_STEPS, 1)}.0", "undo step\n")
+        separator(text)
+        root.update()
+    results["undo"] = percentiles([timed(root, lambda: text.event_generate("<<Undo>>")) for _ in range(UNDO_STEPS)])
+    results["redo"] = percentiles([timed(root, lambda: text.event_generate("<<Redo>>")) for _ in range(UNDO_STEPS)])
+    text.delete("1.0", "end-1c")
+    separator(text)
+    root.update()
+    results["undo_delete_all_s"] = timed(root, lambda: text.event_generate("<<Undo>>"))
+    results["redo_delete_all_s"] = timed(root, lambda: text.event_generate("<<Redo>>"))
+    text.event_generate("<<Undo>>")
+    root.update()
+
+    results["save_s"] = timed(root, lambda: (editor["save_file_as"](), wait_until_idle(root, editor)))
+    results["saved_bytes"] = os.path.getsize(save_path) if os.path.exists(save_path) else None
+
+    results["font_grow_s"] = timed(root, editor["increase_font_size"])
+    results["font_shrink_s"] = timed(root, editor["decrease_font_size"])
+    results["theme_toggle"] = percentiles([timed(root, editor["toggle_dark_mode"]) for _ in range(2)])
+    results["emoji_insert"] = percentiles([timed(root, lambda: editor["insert_emoji"]("😀")) for _ in range(EMOJI_INSERTS)])
+    wait_until_idle(root, editor)
+    return results
+
+
+def run_child(script, corpus, work_dir, result_path):
+    """Runs script with mainloop replaced by measure, then writes the results to result_path."""
+    import tkinter
+    from tkinter import filedialog, messagebox
+
+    os.chdir(work_dir)  # Versions that keep config.json in the working directory get a clean one
+    save_path = os.path.join(work_dir, "saved.arc")
+    dialogs = []
+    filedialog.askopenfilename = lambda **options: corpus
+    filedialog.asksaveasfilename = lambda **options: save_path
+    for name in ("showinfo", "showwarning", "showerror"):
+        setattr(messagebox, name, lambda title, message, **options: dialogs.append(title))
+    messagebox.askyesno = lambda title, message, **options: False  # No recovery, no save on exit
+
+    output = {}
+
+    def bench_mainloop(root, n=0):
+        output["startup_s"] = time.perf_counter() - started
+        output.update(measure(root, sys._getframe(1).f_globals, corpus, save_path, dialogs))
+        output["dialogs"] = dialogs
+
+    tkinter.Tk.mainloop = bench_mainloop
+    sys.argv = [script, "--new-instance"]  # Not the bench's own arguments, and no handing off to a running editor
+    started = time.perf_counter()
+    runpy.run_path(script, run_name="__main__")
+    try:
+        import resource
+        output["peak_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * KB  # KB on Linux
+    except ImportError:
+        pass
+    with open(result_path, "w", encoding="utf-8") as file:
+        json.dump(output, file)
+    sys.stdout.flush()
+    os._exit(0)  # Skip waiting on the editor's worker threads
+
+
+# Driver
+def start_xvfb():
+    for display in range(99, 200):
+        if os.path.exists(f"/tmp/.X{display}-lock") or os.path.exists(f"/tmp/.X11-unix/X{display}"):
+            continue
+        try:
+            process = subprocess.Popen(["Xvfb", f":{display}", "-screen", "0", "1280x1024x24", "-nolisten", "tcp"],
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except FileNotFoundError:
+            sys.exit("Xvfb was not found. Install it (the xvfb package) or pass --display to use a running X server.")
+        for _ in range(100):
+            if os.path.exists(f"/tmp/.X11-unix/X{display}"):
+                return process, f":{display}"
+            if process.poll() is not None:
+                break
+            time.sleep(0.05)
+        process.kill()
+    sys.exit("Could not start Xvfb.")
+
+
+def run_corpus(script, corpus, display, timeout):
+    with tempfile.TemporaryDirectory(prefix="arcbench-") as work_dir:
+        environment = dict(os.environ, DISPLAY=display, HOME=work_dir,
+                           XDG_CONFIG_HOME=os.path.join(work_dir, "config"))  # Fresh config_dir, no journals
+        result_path = os.path.join(work_dir, "result.json")
+        try:
+            process = subprocess.run([sys.executable, os.path.abspath(__file__), "child", os.path.abspath(script),
+                                      corpus, work_dir, result_path],
+                                     env=environment, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return {"error": f"timed out after {timeout}s"}
+        if not os.path.exists(result_path):
+            return {"error": f"exit status {process.returncode}: {process.stderr.strip()[-2000:]}"}
+        with open(result_path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+
+def median_results(runs):
+    """Combines repeated runs by taking the median of every number."""
+    first = runs[0]
+    if isinstance(first, dict):
+        return {key: median_results([run.get(key) for run in runs]) for key in first}
+    if isinstance(first, (int, float)) and not isinstance(first, bool) and all(isinstance(run, (int, float)) for run in runs):
+        return statistics.median(runs)
+    return first
+
+
+def git_revision(path):
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(path)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    names = list(CORPORA) if args.corpora == ["all"] else args.corpora
+    for name in names:
+        if name not in CORPORA:
+            sys.exit(f"Unknown corpus {name}, choose from: {', '.join(CORPORA)}")
+    xvfb = None
+    display = args.display
+    if display is None:
+        xvfb, display = start_xvfb()
+    import tkinter
+    report = {"script": os.path.basename(args.script), "revision": git_revision(args.script),
+              "python": platform.python_version(), "tk": tkinter.TkVersion, "platform": platform.platform(),
+              "cpus": os.cpu_count(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "repeat": args.repeat,
+              "results": {}}
+    try:
+        for name in names:
+            corpus = make_corpus(name, args.corpus_dir)
+            runs = [run_corpus(args.script, corpus, display, args.timeout) for _ in range(args.repeat)]
+            errors = [run for run in runs if "error" in run]
+            report["results"][name] = errors[0] if errors else median_results(runs)
+            print(f"{name}: {summary(report['results'][name])}", flush=True)
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+    with open(args.out, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.out}")
+
+
+def summary(result):
+    if "error" in result:
+        return result["error"]
+    parts = [f"open {result['open_s']:.3f}s", f"mode {result['mode']}"]
+    if result["mode"] == "edit":
+        parts += [f"typing p95 {result['typing']['p95_ms']:.2f}ms", f"save {result['save_s']:.3f}s",
+                  f"undo all {result['undo_delete_all_s']:.3f}s"]
+    if "peak_rss_bytes" in result:
+        parts.append(f"peak RSS {result['peak_rss_bytes'] / MB:.0f}MB")
+    return ", ".join(parts)
+
+
+def flatten(result, prefix=""):
+    values = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key != "count":
+            values[prefix + key] = value
+    return values
+
+
+def compare(args):
+    with open(args.base, "r", encoding="utf-8") as file:
+        base = json.load(file)
+    with open(args.new, "r", encoding="utf-8") as file:
+        new = json.load(file)
+    print(f"{base['script']} ({base.get('revision') or '?'}) -> {new['script']} ({new.get('revision') or '?'})")
+    regressions = 0
+    for name in base["results"]:
+        if name not in new["results"]:
+            continue
+        old_values = flatten(base["results"][name])
+        new_values = flatten(new["results"][name])
+        if "error" in new["results"][name] and "error" not in base["results"][name]:
+            print(f"  {name}: REGRESSION, {new['results'][name]['error']}")
+            regressions += 1
+            continue
+        for metric in sorted(old_values.keys() & new_values.keys()):
+            old, current = old_values[metric], new_values[metric]
+            floor = next((value for suffix, value in NOISE_FLOOR.items() if metric.endswith(suffix)), 0)
+            worse = current > old * (1 + args.threshold) and current - old > floor
+            better = current < old * (1 - args.threshold) and old - current > floor
+            if worse or better or args.verbose:
+                ratio = f"{current / old:.2f}x" if old else "new"
+                flag = "REGRESSION" if worse else "improved" if better else ""
+                print(f"  {name}.{metric}: {old:.4g} -> {current:.4g} ({ratio}) {flag}")
+            regressions += worse
+    print(f"{regressions} regression(s)")
+    return 1 if regressions else 0
+
+
+def main():
+    if len(sys.argv) == 6 and sys.argv[1] == "child":
+        run_child(*sys.argv[2:])
+        return
+    parser = argparse.ArgumentParser(description="Arc Editor benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="benchmark one version of the editor")
+    run_parser.add_argument("--script", default="ArcNote-0.2.py", help="editor script to run")
+    run_parser.add_argument("--corpora", nargs="+", default=DEFAULT_CORPORA,
+                            help=f"corpora to open, or 'all' (available: {', '.join(CORPORA)})")
+    run_parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "arcbench-corpora"))
+    run_parser.add_argument("--out", default="arcbench.json")
+    run_parser.add_argument("--repeat", type=int, default=1, help="runs per corpus, the median is kept")
+    run_parser.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT, help="seconds per run")
+    run_parser.add_argument("--display", help="use this X display instead of starting Xvfb")
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    compare_parser.add_argument("--verbose", action="store_true", help="list unchanged metrics too")
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
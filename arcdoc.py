@@ -0,0 +1,604 @@
+import codecs
+import io
+import os
+import random
+import re
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+
+from arcpack import is_packed, pack_chunks, unpack_chunks, PACKED_ENCODINGS
+
+# Headless document model for Arc Editor. Nothing in here touches Tk, so it can be used and
+# measured without a display. The editor keeps text_area in sync with a Document and reads
+# the model whenever it needs the text (saving, stats, search).
+
+INDEXED_BUFFER_CHARS = 64 * 1024  # Buffers this long get a newline index instead of being scanned
+_ASTRAL_CHAR = re.compile("[\U00010000-\U0010FFFF]")  # Outside the BMP, two columns in Tk 8.6
+
+# Encoding detection
+DECODE_CHUNK_BYTES = 256 * 1024  # Bytes decoded at a time when reading a file
+SNIFF_PREFIX_BYTES = 64 * 1024  # Bytes checked for a BOM and UTF-8 validity before decoding starts
+FALLBACK_ENCODING = "cp1252"
+APPENDABLE_ENCODINGS = ("utf-8", "utf-8-sig", FALLBACK_ENCODING)  # Bytes added at the end decode on their own
+BOM_ENCODINGS = [(codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16")]
+ARC_TRAILING_NEWLINE = "\n"  # text_area.get(1.0, tk.END) always ended with a newline, saved .arc files keep it
+WRITE_CHUNK_CHARS = 1024 * 1024  # Largest slice written at once, also how often save progress is reported
+
+
+def sniff_encoding(prefix):
+    """Guesses the encoding of a file from its first bytes."""
+    for bom, encoding in BOM_ENCODINGS:
+        if prefix.startswith(bom):
+            return encoding
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(prefix, final=False)  # A split character at the end is fine
+        return "utf-8"
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+
+
+def make_decoder(encoding):
+    # Same newline handling as open(..., "r"): \r\n and \r become \n
+    return io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), translate=True)
+
+
+def decode_chunks(file, chunk_bytes=DECODE_CHUNK_BYTES):
+    """Decodes an open binary file in a single pass. Yields ("encoding", name) once the encoding is
+    sniffed and ("text", chunk) as the file is decoded. If bytes that are not UTF-8 show up part way
+    through, yields ("transcode", name) and carries on with the fallback encoding; the text yielded
+    before that has to be fixed with transcode_text. Raises UnicodeDecodeError if neither works."""
+    data = file.read(SNIFF_PREFIX_BYTES)
+    if is_packed(data):  # Compressed .arc, always UTF-8
+        encoding, packed = unpack_chunks(file)
+        yield "encoding", encoding
+        decoder = make_decoder("utf-8")
+        for data in packed:
+            text = decoder.decode(data)
+            if text:
+                yield "text", text
+        text = decoder.decode(b"", True)
+        if text:
+            yield "text", text
+        return
+    encoding = sniff_encoding(data)
+    yield "encoding", encoding
+    decoder = make_decoder(encoding)
+    while True:
+        final = not data
+        try:
+            text = decoder.decode(data, final)
+        except UnicodeDecodeError:
+            if encoding != "utf-8":
+                raise
+            # Not UTF-8 after all. Switch decoders mid-stream instead of reading the file again.
+            pending, flag = decoder.getstate()
+            encoding = FALLBACK_ENCODING
+            yield "transcode", encoding
+            decoder = make_decoder(encoding)
+            decoder.setstate((b"", flag & 1))  # Keep a pending \r
+            text = decoder.decode(pending + data, final)
+        if text:
+            yield "text", text
+        if final:
+            return
+        data = file.read(chunk_bytes)
+
+
+def decode_appended(data, encoding):
+    """Decodes bytes appended to a file that was read with encoding, or returns None if that can't be
+    done apart from the rest of the file (packed and UTF-16 files, bytes encoding doesn't take)."""
+    if encoding not in APPENDABLE_ENCODINGS:
+        return None
+    try:
+        return make_decoder("utf-8" if encoding == "utf-8-sig" else encoding).decode(data, True)
+    except UnicodeDecodeError:
+        return None
+
+
+class TeeReader:
+    """Wraps a binary file and passes every block read from it to on_read, so a file can be sampled or
+    scanned in the same pass that decodes it."""
+
+    def __init__(self, file, on_read):
+        self._file = file
+        self._on_read = on_read
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self._on_read(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+def transcode_text(text, encoding):
+    """Re-reads text that was decoded as UTF-8 as if it had been decoded with encoding. Same result as
+    decoding those bytes from disk again."""
+    return text.encode("utf-8").decode(encoding)
+
+
+def read_document(path, chunk_bytes=DECODE_CHUNK_BYTES, on_read=None):
+    """Reads a whole file into a new Document using the same decoding rules as the editor. on_read, if
+    given, is passed the bytes as they are read."""
+    document = Document(path=path)
+    with open(path, "rb") as file:
+        for kind, value in decode_chunks(TeeReader(file, on_read) if on_read else file, chunk_bytes):
+            if kind == "text":
+                document.append(value)
+            elif kind == "encoding":
+                document.encoding = value
+            else:
+                document = Document(transcode_text(document.get_text(), value), path, value)
+    document.dirty.clear()
+    return document
+
+
+class _Buffers:
+    """Append-only store of the strings pieces point into. Strings are never changed once added."""
+
+    def __init__(self):
+        self.texts = []
+        self._newlines = {}  # buffer -> array of newline positions, only for long buffers
+        self._astral = {}  # buffer -> positions of characters outside the BMP
+
+    def add(self, text):
+        self.texts.append(text)
+        return len(self.texts) - 1
+
+    def _newline_index(self, buffer):
+        positions = self._newlines.get(buffer)
+        if positions is None:
+            positions = array("q", (match.start() for match in re.finditer("\n", self.texts[buffer])))
+            self._newlines[buffer] = positions
+        return positions
+
+    def count_newlines(self, buffer, start, end):
+        text = self.texts[buffer]
+        if len(text) < INDEXED_BUFFER_CHARS:
+            return text.count("\n", start, end)
+        positions = self._newline_index(buffer)
+        return bisect_left(positions, end) - bisect_left(positions, start)
+
+    def find_newline(self, buffer, start, n):
+        """Position of the n-th newline (1-based) at or after start."""
+        text = self.texts[buffer]
+        if len(text) < INDEXED_BUFFER_CHARS:
+            position = start - 1
+            for _ in range(n):
+                position = text.index("\n", position + 1)
+            return position
+        positions = self._newline_index(buffer)
+        return positions[bisect_left(positions, start) + n - 1]
+
+    def count_astral(self, buffer, start, end):
+        positions = self._astral.get(buffer)
+        if positions is None:
+            text = self.texts[buffer]
+            positions = () if text.isascii() else array("q", (match.start() for match in _ASTRAL_CHAR.finditer(text)))
+            self._astral[buffer] = positions
+        if not positions:
+            return 0
+        return bisect_left(positions, end) - bisect_left(positions, start)
+
+
+class _Node:
+    """One piece of the document in a treap ordered by position. Nodes are never modified after creation,
+    so an old root is a cheap, consistent snapshot of the document."""
+    __slots__ = ("buffer", "start", "length", "newlines", "astral", "priority", "left", "right", "size", "lines",
+                 "astral_total")
+
+    def __init__(self, buffer, start, length, newlines, astral, priority, left=None, right=None):
+        self.buffer = buffer
+        self.start = start
+        self.length = length
+        self.newlines = newlines
+        self.astral = astral  # Characters outside the BMP
+        self.priority = priority
+        self.left = left
+        self.right = right
+        self.size = length + (left.size if left else 0) + (right.size if right else 0)
+        self.lines = newlines + (left.lines if left else 0) + (right.lines if right else 0)
+        self.astral_total = astral + (left.astral_total if left else 0) + (right.astral_total if right else 0)
+
+    def with_children(self, left, right):
+        return _Node(self.buffer, self.start, self.length, self.newlines, self.astral, self.priority, left, right)
+
+
+def _merge(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        return left.with_children(left.left, _merge(left.right, right))
+    return right.with_children(_merge(left, right.left), right.right)
+
+
+def _split(node, offset, buffers):
+    """Splits a tree into the first offset characters and the rest."""
+    if node is None:
+        return None, None
+    left_size = node.left.size if node.left else 0
+    if offset <= left_size:
+        left, right = _split(node.left, offset, buffers)
+        return left, node.with_children(right, node.right)
+    if offset >= left_size + node.length:
+        left, right = _split(node.right, offset - left_size - node.length, buffers)
+        return node.with_children(node.left, left), right
+    # The split point is inside this piece, cut it in two
+    cut = offset - left_size
+    head_newlines = buffers.count_newlines(node.buffer, node.start, node.start + cut)
+    head_astral = buffers.count_astral(node.buffer, node.start, node.start + cut) if node.astral else 0
+    head = _Node(node.buffer, node.start, cut, head_newlines, head_astral, random.random())
+    tail = _Node(node.buffer, node.start + cut, node.length - cut, node.newlines - head_newlines,
+                 node.astral - head_astral, random.random())
+    return _merge(node.left, head), _merge(tail, node.right)
+
+
+class _PieceView:
+    """Read-only queries shared by Document and its snapshots."""
+
+    def __init__(self, tree, buffers):
+        self._tree = tree
+        self._buffers = buffers
+
+    def __len__(self):
+        return self._tree.size if self._tree else 0
+
+    @property
+    def line_count(self):
+        return (self._tree.lines if self._tree else 0) + 1
+
+    def iter_chunks(self, start=0, end=None):
+        """Yields the text between start and end piece by piece, without joining it into one string."""
+        end = len(self) if end is None else min(end, len(self))
+        stack = []
+        node = self._tree
+        base = 0  # Document offset of the leftmost character under node
+        while stack or node is not None:
+            while node is not None:
+                stack.append((node, base))
+                if node.left is not None and start < base + node.left.size:
+                    node = node.left
+                else:
+                    node = None
+            if not stack:
+                break
+            node, base = stack.pop()
+            piece_start = base + (node.left.size if node.left else 0)
+            if piece_start >= end:
+                return
+            piece_end = piece_start + node.length
+            if piece_end > start:
+                text = self._buffers.texts[node.buffer]
+                first = node.start + max(start - piece_start, 0)
+                last = node.start + min(end, piece_end) - piece_start
+                yield text[first:last]
+            node, base = node.right, piece_end
+
+    def get_text(self, start=0, end=None):
+        return "".join(self.iter_chunks(start, end))
+
+    def line_start(self, line):
+        """Offset of the first character of a 0-based line."""
+        if line <= 0:
+            return 0
+        if line >= self.line_count:
+            return len(self)
+        node = self._tree
+        base = 0
+        while node is not None:
+            left_lines = node.left.lines if node.left else 0
+            left_size = node.left.size if node.left else 0
+            if line <= left_lines:
+                node = node.left
+            elif line <= left_lines + node.newlines:
+                position = self._buffers.find_newline(node.buffer, node.start, line - left_lines)
+                return base + left_size + position - node.start + 1
+            else:
+                line -= left_lines + node.newlines
+                base += left_size + node.length
+                node = node.right
+        return len(self)
+
+    def line_of(self, offset):
+        """0-based line containing offset."""
+        line = 0
+        node = self._tree
+        while node is not None:
+            left_size = node.left.size if node.left else 0
+            if offset < left_size:
+                node = node.left
+                continue
+            line += node.left.lines if node.left else 0
+            if offset < left_size + node.length:
+                return line + self._buffers.count_newlines(node.buffer, node.start, node.start + offset - left_size)
+            line += node.newlines
+            offset -= left_size + node.length
+            node = node.right
+        return line
+
+    def line_col(self, offset):
+        line = self.line_of(offset)
+        return line, offset - self.line_start(line)
+
+    def _astral_before(self, offset):
+        count = 0
+        node = self._tree
+        while node is not None:
+            left_size = node.left.size if node.left else 0
+            if offset < left_size:
+                node = node.left
+                continue
+            count += node.left.astral_total if node.left else 0
+            if offset < left_size + node.length:
+                if not node.astral:
+                    return count
+                return count + self._buffers.count_astral(node.buffer, node.start, node.start + offset - left_size)
+            count += node.astral
+            offset -= left_size + node.length
+            node = node.right
+        return count
+
+    def count_astral(self, start, end):
+        """Characters outside the BMP between start and end, each of them is two columns in Tk 8.6."""
+        if self._tree is None or not self._tree.astral_total:
+            return 0
+        return self._astral_before(end) - self._astral_before(start)
+
+
+class Snapshot(_PieceView):
+    """Frozen view of a Document, safe to read from another thread while the document keeps changing."""
+
+    def __init__(self, tree, buffers, encoding):
+        super().__init__(tree, buffers)
+        self.encoding = encoding
+
+
+class DirtyRanges:
+    """Ranges of a document changed since the last clear(), kept sorted and merged.
+    A deletion leaves an empty range where the text used to be."""
+
+    def __init__(self):
+        self.ranges = []
+
+    def _remap(self, mapping, new_range):
+        ranges = sorted([(mapping(start), mapping(end)) for start, end in self.ranges] + [new_range])
+        merged = []
+        for start, end in ranges:
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        self.ranges = merged
+
+    def insert(self, offset, length):
+        self._remap(lambda x: x if x < offset else x + length, (offset, offset + length))
+
+    def delete(self, offset, length):
+        end = offset + length
+        self._remap(lambda x: x if x <= offset else (offset if x <= end else x - length), (offset, offset))
+
+    def clear(self):
+        self.ranges = []
+
+
+def _word_starts(before, text, after):
+    """Words starting inside text or at after, the one character that follows it. before is the
+    character in front of text, a word running on from it doesn't start in text."""
+    starts = len(text.split())  # Runs of non-space characters, like wc -w
+    if starts and before and not before.isspace() and not text[0].isspace():
+        starts -= 1
+    last = text[-1:] or before
+    if after and not after.isspace() and (not last or last.isspace()):
+        starts += 1
+    return starts
+
+
+class WordCount:
+    """Running word count of a document. Counted in full once, then kept up to date from the edits,
+    each in time proportional to its own size: only the characters on either side of an edit can
+    turn a word into two or two into one."""
+
+    def __init__(self, document):
+        self.document = document
+        self.words = 0
+        before = ""
+        for chunk in document.iter_chunks():
+            self.words += _word_starts(before, chunk, "")
+            before = chunk[-1:]
+        document.listeners.append(self.edit)
+
+    def edit(self, offset, deleted_text, inserted_text):
+        """Document listener, called after the edit."""
+        before = self.document.get_text(offset - 1, offset) if offset else ""
+        end = offset + len(inserted_text)
+        after = self.document.get_text(end, end + 1)
+        self.words += _word_starts(before, inserted_text, after) - _word_starts(before, deleted_text, after)
+
+
+class LongLineScanner:
+    """Finds the lines of a text at least threshold characters long while it is read in chunks.
+    feed returns the ranges of the chunk that lie past column threshold, so the editor can hide them
+    from Tk as the text comes in."""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.lines = []  # 0-based, in order
+        self._line = 0  # Line the next chunk starts in
+        self._run = 0  # Characters of that line before the next chunk
+        self._pattern = re.compile("(?m)^[^\n]{%d,}" % threshold)  # Anchored, so each line is tried once
+
+    def feed(self, text):
+        threshold = self.threshold
+        spans = []
+        head = text.find("\n")
+        head_end = len(text) if head == -1 else head
+        if self._run < threshold <= self._run + head_end:
+            self.lines.append(self._line)
+        if self._run + head_end > threshold:
+            spans.append((max(0, threshold - self._run), head_end))
+        if head == -1:
+            self._run += len(text)
+            return spans
+        line = self._line + 1
+        position = head + 1
+        for match in self._pattern.finditer(text, position) if self._may_have_long_line(text, position) else ():
+            line += text.count("\n", position, match.start())
+            position = match.start()
+            self.lines.append(line)
+            if match.end() > match.start() + threshold:
+                spans.append((match.start() + threshold, match.end()))
+        self._line += text.count("\n")
+        self._run = len(text) - text.rfind("\n") - 1
+        return spans
+
+    def _may_have_long_line(self, text, position):
+        """Looks at the line around every threshold-th character after position, a long line can't
+        fit between two of them. Spares the regex a pass over chunks of short lines."""
+        for sample in range(position, len(text), self.threshold):
+            end = text.find("\n", sample)
+            if (len(text) if end == -1 else end) - text.rfind("\n", 0, sample) - 1 >= self.threshold:
+                return True
+        return False
+
+
+class Document(_PieceView):
+    """Editable text stored as a piece table. Inserts and deletes cost O(log n) in the number of pieces,
+    the text itself is never copied."""
+
+    def __init__(self, text="", path=None, encoding="utf-8"):
+        super().__init__(None, _Buffers())
+        self.path = path
+        self.encoding = encoding  # Encoding the file was read with, saving writes it back the same way
+        self.dirty = DirtyRanges()
+        self.listeners = []  # Called as listener(offset, deleted_text, inserted_text) after every edit
+        self.journal = None  # Crash recovery journal, attached by the editor
+        self.history = None  # Undo history, attached by the editor
+        self.word_count = None  # WordCount for the status bar, attached by the editor
+        if text:
+            self.insert(0, text)
+
+    def insert(self, offset, text):
+        if not text:
+            return
+        offset = max(0, min(offset, len(self)))
+        buffer = self._buffers.add(text)
+        piece = _Node(buffer, 0, len(text), self._buffers.count_newlines(buffer, 0, len(text)),
+                      self._buffers.count_astral(buffer, 0, len(text)), random.random())
+        left, right = _split(self._tree, offset, self._buffers)
+        self._tree = _merge(_merge(left, piece), right)
+        self.dirty.insert(offset, len(text))
+        for listener in self.listeners:
+            listener(offset, "", text)
+
+    def append(self, text):
+        self.insert(len(self), text)
+
+    def delete(self, offset, length):
+        offset = max(0, min(offset, len(self)))
+        length = min(length, len(self) - offset)
+        if length <= 0:
+            return
+        deleted = self.get_text(offset, offset + length) if self.listeners else ""
+        left, rest = _split(self._tree, offset, self._buffers)
+        _, right = _split(rest, length, self._buffers)
+        self._tree = _merge(left, right)
+        self.dirty.delete(offset, length)
+        for listener in self.listeners:
+            listener(offset, deleted, "")
+
+    def snapshot(self):
+        return Snapshot(self._tree, self._buffers, self.encoding)
+
+    def unchanged_since(self, snapshot):
+        """True if there was no edit after snapshot was taken."""
+        return self._tree is snapshot._tree
+
+    def memory_estimate(self):
+        """Bytes held by the buffers. Deleted text stays in them, so this can be more than the text."""
+        return sum(sys.getsizeof(text) for text in self._buffers.texts)
+
+    def unload(self):
+        """Drops the text to free memory. Snapshots taken before keep theirs. Put it back with restore."""
+        self._tree = None
+        self._buffers = _Buffers()
+
+    def restore(self, chunks):
+        """Refills an unloaded document with its text. Not an edit: listeners and dirty ranges are left alone."""
+        tree = None
+        for text in chunks:
+            if text:
+                buffer = self._buffers.add(text)
+                tree = _merge(tree, _Node(buffer, 0, len(text), text.count("\n"),
+                                          self._buffers.count_astral(buffer, 0, len(text)), random.random()))
+        self._tree = tree
+
+
+def first_unencodable(view, encoding):
+    """(offset, character) of the first character in view that encoding has no bytes for, or None.
+    UTF encodings take every character and are not checked."""
+    if encoding.startswith("utf"):
+        return None
+    offset = 0
+    for chunk in view.iter_chunks():
+        try:
+            chunk.encode(encoding)
+        except UnicodeEncodeError as e:
+            return offset + e.start, chunk[e.start]
+        offset += len(chunk)
+    return None
+
+
+def atomic_write(path, chunks, encoding, progress=None):
+    """Writes chunks to a temp file next to path, fsyncs it and renames it over path.
+    Either the old file or the complete new one is on disk at any moment, never a truncated one.
+    With encoding None the chunks are bytes. Text is written as given, without turning "\n" into
+    the platform line ending, so byte offsets worked out from the text hold for the file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        try:
+            os.chmod(temp_path, os.stat(path).st_mode & 0o7777)  # mkstemp creates 0600, keep the old mode
+        except FileNotFoundError:
+            pass
+        with os.fdopen(fd, "w" if encoding else "wb", encoding=encoding, newline="" if encoding else None) as file:
+            written = 0
+            for chunk in chunks:
+                for start in range(0, len(chunk), WRITE_CHUNK_CHARS):
+                    piece = chunk[start:start + WRITE_CHUNK_CHARS]
+                    file.write(piece)
+                    written += len(piece)
+                    if progress:
+                        progress(written)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    try:  # Make the rename itself durable, not possible on every platform
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+
+def write_snapshot(path, snapshot, encoding, progress=None):
+    """Saves a document snapshot in the .arc layout, compressed if encoding is one of PACKED_ENCODINGS."""
+    def chunks():
+        yield from snapshot.iter_chunks()
+        yield ARC_TRAILING_NEWLINE
+    if encoding in PACKED_ENCODINGS:
+        atomic_write(path, pack_chunks(chunks(), encoding, progress), None)
+    else:
+        atomic_write(path, chunks(), encoding, progress)
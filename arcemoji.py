@@ -0,0 +1,71 @@
+import unicodedata
+from bisect import bisect_left
+
+# Emoji catalogue for the picker. Built from the Unicode names that ship with Python, so every
+# emoji the interpreter knows about is available without a data file.
+
+EMOJI_RANGES = [(0x1F300, 0x1F5FF), (0x1F600, 0x1F64F), (0x1F680, 0x1F6FF), (0x1F900, 0x1F9FF),
+                (0x1FA70, 0x1FAFF), (0x2600, 0x26FF), (0x2700, 0x27BF)]
+FAVORITES = ["😀", "😂", "😍", "👍", "❤️", "😊", "😎", "🤩", "🤔", "😴", "🥳", "🤯", "😇", "😈", "💩"]  # Listed first
+EMOJI_PRESENTATION = "\ufe0f"  # Older symbols below U+1F000 need this to be drawn as emoji
+
+
+class EmojiCatalogue:
+    """All emoji with their names, plus a sorted keyword list used as a prefix index."""
+
+    def __init__(self):
+        self.emojis = []
+        self.names = []
+        seen = set()
+        for emoji in FAVORITES:
+            self._add(emoji, unicodedata.name(emoji[0], "").lower(), seen)
+        for first, last in EMOJI_RANGES:
+            for code_point in range(first, last + 1):
+                char = chr(code_point)
+                if unicodedata.category(char) != "So":
+                    continue
+                name = unicodedata.name(char, "").lower()
+                if name:
+                    self._add(char + EMOJI_PRESENTATION if code_point < 0x1F000 else char, name, seen)
+        # (keyword, emoji number) for every word of every name, sorted so a prefix is one bisect away
+        self._keywords = sorted((word, number) for number, name in enumerate(self.names) for word in name.split())
+        self._words = [word for word, _ in self._keywords]
+
+    def _add(self, emoji, name, seen):
+        if emoji.rstrip(EMOJI_PRESENTATION) in seen:
+            return
+        seen.add(emoji.rstrip(EMOJI_PRESENTATION))
+        self.emojis.append(emoji)
+        self.names.append(name)
+
+    def __len__(self):
+        return len(self.emojis)
+
+    def _prefix_matches(self, prefix):
+        matches = set()
+        index = bisect_left(self._words, prefix)
+        while index < len(self._words) and self._words[index].startswith(prefix):
+            matches.add(self._keywords[index][1])
+            index += 1
+        return matches
+
+    def search(self, query):
+        """Numbers of the emoji whose name has a word starting with each word of query, in catalogue order."""
+        words = query.lower().split()
+        if not words:
+            return list(range(len(self.emojis)))
+        matches = self._prefix_matches(words[0])
+        for word in words[1:]:
+            matches &= self._prefix_matches(word)
+        return sorted(matches)
+
+
+_catalogue = None
+
+
+def load_catalogue():
+    """The catalogue, built on first use and shared afterwards."""
+    global _catalogue
+    if _catalogue is None:
+        _catalogue = EmojiCatalogue()
+    return _catalogue
@@ -0,0 +1,55 @@
+import json
+import os
+import sys
+
+from arcdoc import atomic_write
+
+# Cached list of installed font families. Asking Tk for every family takes hundreds of milliseconds
+# on machines with big font collections, so the list is kept in a file and only rebuilt when one of
+# the font directories changes.
+
+
+def font_dirs():
+    """Directories fonts get installed into on this platform."""
+    home = os.path.expanduser("~")
+    if sys.platform == "win32":
+        return [os.path.join(os.environ.get("WINDIR", r"C:\Windows"), "Fonts"),
+                os.path.join(os.environ.get("LOCALAPPDATA", home), "Microsoft", "Windows", "Fonts")]
+    if sys.platform == "darwin":
+        return ["/System/Library/Fonts", "/Library/Fonts", os.path.join(home, "Library", "Fonts")]
+    data_home = os.environ.get("XDG_DATA_HOME") or os.path.join(home, ".local", "share")
+    return ["/usr/share/fonts", "/usr/local/share/fonts", os.path.join(data_home, "fonts"), os.path.join(home, ".fonts")]
+
+
+def fonts_fingerprint(directories):
+    """mtime of every font directory and its subdirectories. Adding or removing a font changes the
+    mtime of the directory it is in, so the font files themselves are never looked at."""
+    stamps = {}
+    for top in directories:
+        for directory, _, _ in os.walk(top):
+            try:
+                stamps[directory] = os.stat(directory).st_mtime_ns
+            except OSError:
+                pass
+    return stamps
+
+
+def cached_families(cache_path, list_families):
+    """Sorted font families, from cache_path if the font directories haven't changed since it was
+    written, otherwise from list_families() (font.families) and saved for next time."""
+    stamps = fonts_fingerprint(font_dirs())
+    try:
+        with open(cache_path, "r", encoding="utf-8") as file:
+            cache = json.load(file)
+        if cache["directories"] == stamps:
+            return cache["families"]
+    except (OSError, ValueError, KeyError):
+        pass
+    # "@Name" families are the vertical variants Windows lists next to CJK fonts
+    families = sorted({family for family in list_families() if not family.startswith("@")}, key=str.lower)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        atomic_write(cache_path, [json.dumps({"directories": stamps, "families": families})], "utf-8")
+    except OSError as e:
+        print("Error saving font list:", e)
+    return families
@@ -0,0 +1,412 @@
+import argparse
+import codecs
+import io
+import math
+import os
+import re
+import sqlite3
+import sys
+import time
+from array import array
+from bisect import bisect_right
+from collections import Counter
+
+from arcdoc import read_document, FALLBACK_ENCODING
+from arcpack import PackedFile, PACKED_ENCODINGS
+
+# Full-text search over a folder of notes. Every word of every note goes into an inverted index in
+# SQLite: the notes a word appears in, how often, and on which lines. A query looks its words up,
+# ranks the notes that have all of them with BM25 and reads one line of each for a snippet, so it
+# never scans the notes themselves. To read that line without decoding the whole note, the index keeps
+# the byte offset of a line start about every CHECKPOINT_BYTES of each note.
+#
+# Building the index reads every note, which for thousands of notes is worth spreading over a
+# process pool. The editor runs that as a separate process, python arcindex.py update DB FOLDER,
+# so no worker is ever forked from the Tk process. Saves update single notes in-process.
+
+INDEX_VERSION = "2"  # Indexes written by another version are rebuilt
+NOTE_EXTENSIONS = (".arc",)
+MAX_TERM_CHARS = 64  # Longer words are not indexed
+MAX_LINES_PER_TERM = 32  # Line numbers kept per word and note, enough for jumping and snippets
+MAX_PREFIX_TERMS = 200  # Words the last word of a query can expand to as a prefix
+RESULT_LIMIT = 50
+SNIPPET_CHARS = 120
+CHECKPOINT_BYTES = 256 * 1024  # A snippet decodes about this much of a note to find its line
+MAX_SNIPPET_LINE_CHARS = 64 * 1024  # Longer lines are cut here before the snippet is taken from them
+_BYTE_LINE_ENCODINGS = ("utf-8", "utf-8-sig", FALLBACK_ENCODING)  # Where a line break is a \n or \r byte
+PARALLEL_MIN_FILES = 20  # Fewer changed notes than this are indexed without starting a pool
+WRITE_BATCH_FILES = 200  # Notes written per transaction, so readers and saves are not locked out long
+BM25_K1 = 1.2
+BM25_B = 0.75
+_WORD = re.compile(r"\w+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, size INTEGER,
+                                  mtime_ns INTEGER, words INTEGER, terms BLOB, encoding TEXT, checkpoints BLOB);
+CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, term TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS postings (term INTEGER, file INTEGER, count INTEGER, lines BLOB,
+                                     PRIMARY KEY (term, file)) WITHOUT ROWID;
+"""
+
+
+def words(text):
+    return [word for word in _WORD.findall(text.casefold()) if len(word) <= MAX_TERM_CHARS]
+
+
+def connect(db_path):
+    """Opens the index, creating it or starting it over if it was written by another version."""
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    db = sqlite3.connect(db_path, timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")  # Queries keep working while the index is being written
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("PRAGMA cache_size=-65536")  # 64 MB, most of a batch's B-tree pages stay in memory
+    db.executescript(_SCHEMA)
+    row = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    if row is None or row[0] != INDEX_VERSION:  # The tables may have other columns, make them again
+        db.executescript("DROP TABLE postings; DROP TABLE terms; DROP TABLE files; DELETE FROM meta;")
+        db.executescript(_SCHEMA)
+        db.execute("INSERT INTO meta VALUES ('version', ?)", (INDEX_VERSION,))
+        db.commit()
+    return db
+
+
+def is_note(path, folder):
+    """True if path is a note inside folder, the kind of file the index covers."""
+    if not folder or not path.lower().endswith(NOTE_EXTENSIONS):
+        return False
+    folder = os.path.abspath(folder)
+    return os.path.commonpath([folder, os.path.abspath(path)]) == folder
+
+
+class _LineCheckpoints:
+    """Fed the bytes of a note in order, notes (line, byte offset) of a line start about every
+    CHECKPOINT_BYTES. Lines end in \n, \r\n or \r, the same as when the note is decoded."""
+
+    def __init__(self):
+        self.pairs = array("Q")
+        self._lines = 0
+        self._offset = 0
+        self._next = CHECKPOINT_BYTES
+        self._after_cr = False
+
+    def _breaks(self, data):
+        return (data.count(b"\n") + data.count(b"\r") - data.count(b"\r\n")
+                - (self._after_cr and data[:1] == b"\n"))  # The \n of a \r\n split between two reads
+
+    def feed(self, data):
+        if not data:
+            return
+        if self._offset + len(data) >= self._next:
+            newline = data.rfind(b"\n")
+            if newline != -1:
+                self.pairs.extend((self._lines + self._breaks(data[:newline + 1]), self._offset + newline + 1))
+                self._next = self._offset + newline + 1 + CHECKPOINT_BYTES
+        self._lines += self._breaks(data)
+        self._offset += len(data)
+        self._after_cr = data[-1:] == b"\r"
+
+
+def index_file(path):
+    """Reads one note and returns (path, size, mtime_ns, word count, encoding, line checkpoints,
+    {word: (count, line numbers)}). Runs on the pool's worker processes. A note that can't be read is
+    returned with no words, so it isn't retried until it changes."""
+    stat = os.stat(path)  # Taken before reading, so a note changed meanwhile is indexed again next time
+    postings = {}
+    total = 0
+    checkpoints = _LineCheckpoints()
+    try:
+        document = read_document(path, on_read=checkpoints.feed)
+        lines = document.get_text().casefold().split("\n")
+        encoding = document.encoding
+    except (OSError, ValueError):  # UnicodeDecodeError, or a damaged compressed note
+        lines = []
+        encoding = None
+    for number, line in enumerate(lines):
+        found = _WORD.findall(line)
+        total += len(found)
+        for word in found:
+            posting = postings.get(word)
+            if posting is None:
+                postings[word] = [1, number]
+            else:
+                posting[0] += 1
+                if posting[-1] != number and len(posting) <= MAX_LINES_PER_TERM:
+                    posting.append(number)
+    if encoding not in _BYTE_LINE_ENCODINGS:
+        checkpoints.pairs = array("Q")  # Packed notes have a line index of their own, UTF-16 ones are read whole
+    return (path, stat.st_size, stat.st_mtime_ns, total, encoding, checkpoints.pairs.tobytes(),
+            {word: (posting[0], array("I", posting[1:]).tobytes())
+             for word, posting in postings.items() if len(word) <= MAX_TERM_CHARS})
+
+
+def _term_ids(db, terms, cache):
+    """Ids of terms, adding the ones the index hasn't seen yet."""
+    missing = [term for term in terms if term not in cache]
+    if missing:
+        db.executemany("INSERT OR IGNORE INTO terms (term) VALUES (?)", ((term,) for term in missing))
+        for start in range(0, len(missing), 500):  # Stay under SQLite's limit on query parameters
+            part = missing[start:start + 500]
+            cache.update(db.execute(f"SELECT term, id FROM terms WHERE term IN ({','.join('?' * len(part))})", part))
+    return [cache[term] for term in terms]
+
+
+def _store(db, batch, cache):
+    """Writes a batch of index_file results. Their postings go in sorted by term, which makes SQLite
+    append to its B-tree instead of inserting all over it."""
+    rows = []
+    for path, size, mtime_ns, total, encoding, checkpoints, postings in batch:
+        _remove(db, path)
+        terms = list(postings)
+        term_ids = _term_ids(db, terms, cache)
+        # The note's term ids are kept with it, so removing it needs no second index on postings
+        file_id = db.execute("INSERT INTO files (path, size, mtime_ns, words, terms, encoding, checkpoints) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (path, size, mtime_ns, total, array("I", term_ids).tobytes(), encoding,
+                              checkpoints)).lastrowid
+        rows.extend((term_id, file_id, *postings[term]) for term_id, term in zip(term_ids, terms))
+    rows.sort()
+    db.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)", rows)
+
+
+def _remove(db, path):
+    row = db.execute("SELECT id, terms FROM files WHERE path = ?", (path,)).fetchone()
+    if row is not None:
+        file_id, terms = row
+        db.executemany("DELETE FROM postings WHERE term = ? AND file = ?", ((term, file_id) for term in _numbers(terms)))
+        db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+
+def _use_folder(db, folder):
+    """Points the index at folder. Switching to another folder starts the index over."""
+    row = db.execute("SELECT value FROM meta WHERE key = 'folder'").fetchone()
+    if row is None or row[0] != folder:
+        db.executescript("DELETE FROM postings; DELETE FROM terms; DELETE FROM files;")
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('folder', ?)", (folder,))
+        db.commit()
+
+
+def update(db_path, folder, processes=None, progress=None):
+    """Brings the index up to date with the notes in folder. Notes whose size or mtime changed since
+    they were indexed are read again, on a process pool when there are many of them, and deleted
+    notes are dropped. progress(done, total) is called as notes are written. Returns the number of
+    notes indexed and removed."""
+    folder = os.path.abspath(folder)
+    db = connect(db_path)
+    try:
+        _use_folder(db, folder)
+        stored = {path: (size, mtime_ns) for path, size, mtime_ns in db.execute("SELECT path, size, mtime_ns FROM files")}
+        found = {}
+        for directory, subdirectories, names in os.walk(folder):
+            subdirectories[:] = [name for name in subdirectories if not name.startswith(".")]
+            for name in names:
+                if name.lower().endswith(NOTE_EXTENSIONS):
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found[path] = (stat.st_size, stat.st_mtime_ns)
+        changed = [path for path, stamp in found.items() if stored.get(path) != stamp]
+        removed = [path for path in stored if path not in found]
+        for path in removed:
+            _remove(db, path)
+        db.commit()
+        cache = {}
+        if len(changed) < PARALLEL_MIN_FILES:
+            _write(db, map(_index_or_none, changed), len(changed), cache, progress)
+        else:
+            from concurrent.futures import ProcessPoolExecutor  # Only the indexer process needs it
+            with ProcessPoolExecutor(processes) as pool:
+                _write(db, pool.map(_index_or_none, changed, chunksize=8), len(changed), cache, progress)
+        return len(changed), len(removed)
+    finally:
+        db.close()
+
+
+def _index_or_none(path):
+    try:
+        return index_file(path)
+    except OSError:  # Deleted since the folder was walked
+        return None
+
+
+def _write(db, results, total, cache, progress):
+    batch = []
+    for done, indexed in enumerate(results, 1):
+        if indexed is not None:
+            batch.append(indexed)
+        if len(batch) == WRITE_BATCH_FILES or done == total:
+            _store(db, batch, cache)
+            db.commit()
+            batch = []
+            if progress is not None:
+                progress(done, total)
+
+
+def update_file(db_path, folder, path):
+    """Indexes one note again, after the editor saved it. Does nothing if the index is for another folder."""
+    folder = os.path.abspath(folder)
+    db = connect(db_path)
+    try:
+        row = db.execute("SELECT value FROM meta WHERE key = 'folder'").fetchone()
+        if row is None or row[0] != folder:
+            return
+        _store(db, [index_file(os.path.abspath(path))], {})
+        db.commit()
+    finally:
+        db.close()
+
+
+def _numbers(blob):
+    numbers = array("I")
+    numbers.frombytes(blob)
+    return numbers
+
+
+def search(db, query, limit=RESULT_LIMIT):
+    """Notes containing every word of query, best first, as (score, path, line, snippet) with a 0-based
+    line. The last word also matches as a prefix, so results follow the user's typing."""
+    query_words = list(dict.fromkeys(words(query)))
+    if not query_words:
+        return []
+    file_count, word_total = db.execute("SELECT COUNT(*), TOTAL(words) FROM files").fetchone()
+    if not file_count:
+        return []
+    average_words = max(word_total / file_count, 1)
+    matches = []  # Per query word: file id -> (count, [line numbers])
+    for number, word in enumerate(query_words):
+        if number == len(query_words) - 1:
+            rows = db.execute("SELECT p.file, p.count, p.lines FROM postings p JOIN "
+                              "(SELECT id FROM terms WHERE term >= ? AND term < ? LIMIT ?) t ON p.term = t.id",
+                              (word, word + "\U0010ffff", MAX_PREFIX_TERMS))
+        else:
+            rows = db.execute("SELECT p.file, p.count, p.lines FROM postings p JOIN terms t ON p.term = t.id "
+                              "WHERE t.term = ?", (word,))
+        files = {}
+        for file_id, count, blob in rows:
+            if file_id in files:
+                previous_count, previous_lines = files[file_id]
+                files[file_id] = (previous_count + count, previous_lines + list(_numbers(blob)))
+            else:
+                files[file_id] = (count, list(_numbers(blob)))
+        if not files:
+            return []
+        matches.append(files)
+    candidates = set.intersection(*(set(files) for files in matches))
+    if not candidates:
+        return []
+    candidates = list(candidates)
+    lengths = {}
+    for start in range(0, len(candidates), 500):
+        part = candidates[start:start + 500]
+        lengths.update(db.execute(f"SELECT id, words FROM files WHERE id IN ({','.join('?' * len(part))})", part))
+    scores = {}
+    for files in matches:
+        idf = math.log(1 + (file_count - len(files) + 0.5) / (len(files) + 0.5))
+        for file_id in candidates:
+            count = files[file_id][0]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths.get(file_id, 0) / average_words)
+            scores[file_id] = scores.get(file_id, 0) + idf * count * (BM25_K1 + 1) / (count + norm)
+    best = sorted(candidates, key=lambda file_id: -scores[file_id])[:limit]
+    hits = []
+    for file_id in best:
+        path, encoding, checkpoints = db.execute("SELECT path, encoding, checkpoints FROM files WHERE id = ?",
+                                                 (file_id,)).fetchone()
+        # The line with the most query words on it, the first one on a tie
+        line_votes = Counter()
+        for files in matches:
+            line_votes.update(set(files[file_id][1]))
+        line = min(line_votes, key=lambda number: (-line_votes[number], number))
+        hits.append((scores[file_id], path, line, snippet(path, line, query_words, encoding, checkpoints)))
+    return hits
+
+
+def read_line(path, line, encoding, checkpoints):
+    """The text of a 0-based line of a note, decoded from the nearest checkpoint before it."""
+    if encoding in PACKED_ENCODINGS:
+        packed = PackedFile(path)
+        try:
+            return packed.read_lines(line, 1)[0]
+        finally:
+            packed.close()
+    if encoding not in _BYTE_LINE_ENCODINGS:
+        document = read_document(path)
+        return document.get_text(document.line_start(line), document.line_start(line + 1))
+    pairs = array("Q")
+    pairs.frombytes(checkpoints or b"")
+    number = bisect_right(pairs[0::2], line) - 1
+    first, offset = (pairs[2 * number], pairs[2 * number + 1]) if number >= 0 else (0, 0)
+    decoder = io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder("utf-8" if offset and encoding == "utf-8-sig" else encoding)(errors="replace"),
+        translate=True)
+    skip = line - first
+    text = ""
+    with open(path, "rb") as file:
+        file.seek(offset)
+        while True:
+            data = file.read(CHECKPOINT_BYTES)
+            text += decoder.decode(data, not data)
+            while skip and text:
+                newline = text.find("\n")
+                if newline == -1:
+                    text = ""  # All of it is before the line
+                else:
+                    text = text[newline + 1:]
+                    skip -= 1
+            if not skip:
+                end = text.find("\n")
+                if end != -1:
+                    return text[:end]
+                if not data or len(text) >= MAX_SNIPPET_LINE_CHARS:
+                    return text[:MAX_SNIPPET_LINE_CHARS]
+            elif not data:
+                return ""
+
+
+def snippet(path, line, query_words, encoding, checkpoints):
+    """The text of a line, cut to SNIPPET_CHARS around the first query word on it."""
+    try:
+        text = read_line(path, line, encoding, checkpoints).strip()
+    except (OSError, ValueError):  # UnicodeDecodeError, or a damaged compressed note
+        return ""
+    if len(text) <= SNIPPET_CHARS:
+        return text
+    folded = text.casefold()
+    positions = [folded.find(word) for word in query_words if word in folded]
+    start = max(0, min(positions, default=0) - SNIPPET_CHARS // 3)
+    return ("..." if start else "") + text[start:start + SNIPPET_CHARS] + "..."
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text index of a folder of Arc Editor notes.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    update_parser = commands.add_parser("update", help="index new and changed notes, drop deleted ones")
+    update_parser.add_argument("db")
+    update_parser.add_argument("folder")
+    update_parser.add_argument("--processes", type=int, default=None, help="worker processes (default: one per CPU)")
+    search_parser = commands.add_parser("search", help="print the best matches for a query")
+    search_parser.add_argument("db")
+    search_parser.add_argument("query")
+    args = parser.parse_args()
+
+    if args.command == "update":
+        started = time.perf_counter()
+
+        def progress(done, total):
+            if done == total or done % 100 == 0:
+                print("progress", done, total, flush=True)  # Read by the editor for its status line
+
+        indexed, removed = update(args.db, args.folder, args.processes, progress)
+        print("done", indexed, removed, f"{time.perf_counter() - started:.3f}", flush=True)
+    else:
+        db = connect(args.db)
+        started = time.perf_counter()
+        hits = search(db, args.query)
+        for score, path, line, text in hits:
+            print(f"{score:6.2f}  {path}:{line + 1}  {text}")
+        print(f"{len(hits)} hits in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import json
+import os
+import socket
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Single-instance mode. The first editor listens on a Unix domain socket, later launches send it their
+# file arguments and exit. Nothing in here imports tkinter, so forwarding costs a launch only a few
+# milliseconds.
+
+CONNECT_TIMEOUT = 2.0  # Seconds to wait on a running editor before starting a new one
+
+
+def supported():
+    return fcntl is not None and hasattr(socket, "AF_UNIX")
+
+
+def socket_path(fallback_dir):
+    """The socket lives in XDG_RUNTIME_DIR when there is one, it is private and cleared at logout."""
+    directory = os.environ.get("XDG_RUNTIME_DIR") or fallback_dir
+    return os.path.join(directory, f"arcnote-{os.getuid()}.sock")
+
+
+def _forward(path, files):
+    """Sends files to the editor listening on path. Raises OSError if there is none."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(CONNECT_TIMEOUT)
+        client.connect(path)
+        client.sendall(json.dumps({"files": files}).encode("utf-8") + b"\n")
+        reply = b""
+        while not reply.endswith(b"\n"):
+            chunk = client.recv(16)
+            if not chunk:
+                raise ConnectionError("The running editor closed the connection")
+            reply += chunk
+    return reply == b"ok\n"
+
+
+def claim(path, files, on_files):
+    """Hands files to the editor already running and returns None, or, if there is none, starts
+    listening on path and returns the InstanceServer. on_files is called with the list of files from
+    every later launch, on the server's thread."""
+    try:
+        if _forward(path, files):
+            return None
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "w") as lock:
+        # Launches racing each other take turns here, so only one of them replaces a stale socket
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if _forward(path, files):  # Another launch started listening while we waited
+                return None
+        except OSError:
+            pass
+        try:
+            os.unlink(path)  # Left behind by an editor that crashed
+        except FileNotFoundError:
+            pass
+        return InstanceServer(path, on_files)
+
+
+class InstanceServer:
+    def __init__(self, path, on_files):
+        self.path = path
+        self._on_files = on_files
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.bind(path)
+            os.chmod(path, 0o600)  # Only this user may send files
+            self._inode = os.stat(path).st_ino
+            self._socket.listen(16)
+        except OSError:
+            self._socket.close()
+            raise
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return  # Closed
+            with connection:
+                try:
+                    connection.settimeout(CONNECT_TIMEOUT)
+                    data = b""
+                    while not data.endswith(b"\n"):
+                        chunk = connection.recv(64 * 1024)
+                        if not chunk:
+                            break
+                        data += chunk
+                    files = [str(file) for file in json.loads(data)["files"]]
+                    self._on_files(files)
+                    connection.sendall(b"ok\n")
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    print("Error reading from another launch:", e)
+
+    def close(self):
+        self._socket.close()
+        try:
+            if os.stat(self.path).st_ino == self._inode:  # Don't remove a newer editor's socket
+                os.unlink(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,261 @@
+import glob
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import uuid
+
+from arcdoc import Document, atomic_write, read_document
+
+# Crash recovery journal. Every edit is appended to a log as (offset, deleted length, inserted text)
+# relative to a base: the saved file, a snapshot of an unsaved document, or an empty document.
+# Recovery loads the base and replays the log, so only the edits since the last save or
+# compaction are ever replayed or rewritten.
+
+COMPACT_MIN_BYTES = 4 * 1024 * 1024  # Logs smaller than this are never compacted
+COMPACT_DOCUMENT_RATIO = 2  # ...and larger ones only once they reach 1/2 of the document size
+_RECORD = struct.Struct("<QQI")  # offset, deleted length (characters), inserted length (UTF-8 bytes)
+
+_jobs = queue.Queue()  # (journal, function, args) run in order on the writer thread
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _run_writer():
+    while True:
+        journal, function, args = _jobs.get()
+        try:
+            function(*args)
+        except Exception as e:
+            journal.error = e  # Shown by the editor, the journal keeps going
+        finally:
+            _jobs.task_done()
+
+
+def _submit(journal, function, *args):
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_run_writer, daemon=True)
+            _writer.start()
+    _jobs.put((journal, function, args))
+
+
+def wait_idle():
+    """Blocks until every queued journal write is done."""
+    _jobs.join()
+
+
+def _iter_records(data):
+    position = 0
+    while position + _RECORD.size <= len(data):
+        offset, deleted, inserted = _RECORD.unpack_from(data, position)
+        end = position + _RECORD.size + inserted
+        if end > len(data):
+            return  # Torn last record from a crash, everything before it is good
+        yield position, offset, deleted, data[position + _RECORD.size:end].decode("utf-8")
+        position = end
+
+
+def _fingerprint(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class EditJournal:
+    """Append-only edit log for one document. record() is cheap and only buffers in memory,
+    flush() hands the buffered edits to the writer thread as one batch."""
+
+    def __init__(self, directory, session=None):
+        self.directory = directory
+        self.session = session or uuid.uuid4().hex
+        self.error = None
+        self.log_bytes = 0  # Size of the log on disk, updated by the writer thread
+        self._pending = []
+        self._recorded = 0  # Edits recorded so far, the log holds the ones from _log_first on
+        self._log_first = 0
+        self._manifest = {"session": self.session}
+
+    def _file(self, extension):
+        return os.path.join(self.directory, f"{self.session}.{extension}")
+
+    @classmethod
+    def start(cls, directory, path, encoding, snapshot=None):
+        """Starts a journal for a document that matches path on disk, or an empty one if path is None.
+        A document that no longer matches its file passes a snapshot of itself to start from instead."""
+        journal = cls(directory)
+        if snapshot is not None:
+            base = {"base": "snapshot", "path": path, "encoding": encoding}
+        elif path:
+            base = {"base": "file", "path": path, "encoding": encoding}
+        else:
+            base = {"base": "empty", "path": None, "encoding": encoding}
+        _submit(journal, journal._rebase, 0, base, snapshot)
+        return journal
+
+    def record(self, offset, deleted_text, inserted_text):
+        """Document listener, buffers one edit."""
+        self._pending.append((offset, len(deleted_text), inserted_text))
+        self._recorded += 1
+
+    def mark(self):
+        """Position in the edit stream, pass it to saved() once the text at this point is on disk."""
+        return self._recorded
+
+    def flush(self):
+        if self._pending:
+            batch, self._pending = self._pending, []
+            _submit(self, self._append, batch)
+
+    def wants_compaction(self, document_size):
+        return self.log_bytes > max(COMPACT_MIN_BYTES, document_size // COMPACT_DOCUMENT_RATIO)
+
+    def compact(self, snapshot):
+        """Replaces the log with a snapshot of the document. snapshot must match mark() right now."""
+        self.flush()
+        _submit(self, self._rebase, self._recorded,
+                {"base": "snapshot", "path": self._manifest.get("path"), "encoding": snapshot.encoding}, snapshot)
+
+    def saved(self, mark, path, encoding):
+        """The document as of mark was saved to path, so the file becomes the new base."""
+        self.flush()
+        _submit(self, self._rebase, mark, {"base": "file", "path": path, "encoding": encoding}, None)
+
+    def discard(self):
+        """Forgets the journal, for a clean close."""
+        self._pending = []
+        _submit(self, self._remove)
+
+    def _append(self, batch):
+        data = bytearray()
+        for offset, deleted, inserted in batch:
+            encoded = inserted.encode("utf-8")
+            data += _RECORD.pack(offset, deleted, len(encoded))
+            data += encoded
+        with open(self._file("log"), "ab") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        self.log_bytes += len(data)
+
+    def _rebase(self, mark, base, snapshot):
+        if mark < self._log_first:
+            return  # A newer base is already in place (a compaction overtook a slow save)
+        os.makedirs(self.directory, exist_ok=True)  # Made here rather than at startup
+        if snapshot is not None:
+            atomic_write(self._file("snap"), snapshot.iter_chunks(), "utf-8")
+        if base["base"] == "file":
+            base["size"], base["mtime_ns"] = _fingerprint(base["path"])
+        # Keep only the edits made after mark
+        try:
+            with open(self._file("log"), "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            data = b""
+        skip = mark - self._log_first
+        tail_start = len(data)
+        for index, (position, *_) in enumerate(_iter_records(data)):
+            if index == skip:
+                tail_start = position
+                break
+        tail = data[tail_start:]
+        atomic_write(self._file("log"), [tail], None)
+        self._log_first = mark
+        self.log_bytes = len(tail)
+        self._manifest.update(base)
+        self._write_manifest()
+        if snapshot is None and os.path.exists(self._file("snap")):
+            os.remove(self._file("snap"))
+
+    def _write_manifest(self):
+        self._manifest.update(pid=os.getpid(), updated=time.time())  # The pid marks the journal as in use
+        atomic_write(self._file("json"), [json.dumps(self._manifest)], "utf-8")
+
+    def _remove(self):
+        for extension in ("json", "log", "snap"):
+            try:
+                os.remove(self._file(extension))
+            except FileNotFoundError:
+                pass
+
+
+def process_alive(pid):
+    if not pid:
+        return False
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":  # os.kill would terminate the process on Windows
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if handle:
+            ctypes.windll.kernel32.CloseHandle(handle)
+        return bool(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (OSError, SystemError):
+        return True  # Exists but is not ours, or the platform can't tell
+    return True
+
+
+def find_sessions(directory):
+    """Manifests of journals left behind by editors that did not close cleanly, newest first."""
+    sessions = []
+    for manifest_path in glob.glob(os.path.join(directory, "*.json")):
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            continue
+        if "session" not in manifest or process_alive(manifest.get("pid")):
+            continue  # Written by an editor that is still running
+        log_path = os.path.join(directory, manifest["session"] + ".log")
+        has_edits = os.path.exists(log_path) and os.path.getsize(log_path) > 0
+        if has_edits or manifest.get("base") == "snapshot":
+            sessions.append(manifest)
+    return sorted(sessions, key=lambda manifest: manifest.get("updated", 0), reverse=True)
+
+
+def recover(directory, manifest):
+    """Rebuilds the document of a session from its base plus the log. Returns (document, journal),
+    with the journal ready to keep recording, or None if the base file changed since."""
+    session = manifest["session"]
+    if manifest["base"] == "file":
+        path = manifest["path"]
+        if not os.path.exists(path) or _fingerprint(path) != (manifest["size"], manifest["mtime_ns"]):
+            return None  # The log's offsets no longer fit the file
+        document = read_document(path)
+    elif manifest["base"] == "snapshot":
+        document = Document(path=manifest["path"], encoding=manifest["encoding"])
+        with open(os.path.join(directory, session + ".snap"), "r", encoding="utf-8", newline="") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), ""):
+                document.append(chunk)
+    else:
+        document = Document(encoding=manifest["encoding"])
+    try:
+        with open(os.path.join(directory, session + ".log"), "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        data = b""
+    replayed = 0
+    for _, offset, deleted, inserted in _iter_records(data):
+        document.delete(offset, deleted)
+        document.insert(offset, inserted)
+        replayed += 1
+    document.path = manifest["path"]
+    document.encoding = manifest["encoding"]
+
+    journal = EditJournal(directory, session)
+    journal._manifest = dict(manifest)
+    journal.log_bytes = len(data)
+    journal._recorded = replayed
+    _submit(journal, journal._write_manifest)  # Claim the session for this process
+    return document, journal
+
+
+def discard_session(directory, manifest):
+    journal = EditJournal(directory, manifest["session"])
+    journal._remove()
@@ -0,0 +1,138 @@
+import mmap
+import os
+from array import array
+from bisect import bisect_left
+
+from arcdoc import sniff_encoding, SNIFF_PREFIX_BYTES
+
+# Read-only access to files too big for tk.Text. The file is memory-mapped and indexed sparsely:
+# one newline count per block of bytes, so the index for a 4 GB file is about 0.5 MB and only the
+# lines on screen are ever decoded.
+
+INDEX_BLOCK_BYTES = 64 * 1024  # Granularity of the line index
+INDEX_READ_BYTES = 64 * INDEX_BLOCK_BYTES  # Bytes copied out of the map per indexing step
+MAX_WINDOW_BYTES = 1024 * 1024  # A window of lines is cut off here, so a single huge line can't stall the UI
+
+
+class MappedFile:
+    """A memory-mapped file with a sparse line index. build_index runs on a worker thread while the
+    other methods are used from the UI; lines past the indexed part are simply not known yet."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self.size = os.fstat(self._file.fileno()).st_size
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        self.encoding = sniff_encoding(self._map[:SNIFF_PREFIX_BYTES])
+        self.bom_length = 3 if self.encoding == "utf-8-sig" else 0
+        self._decode_as = "utf-8" if self.encoding == "utf-8-sig" else self.encoding
+        self._block_lines = array("Q", [0])  # Newlines before each indexed block
+        self.newlines = 0  # Newlines in the indexed part
+        self.indexed_bytes = 0
+
+    @property
+    def supported(self):
+        # The index looks for b"\n", which only works for encodings that keep ASCII as single bytes
+        return not self.encoding.startswith("utf-16")
+
+    @property
+    def complete(self):
+        return self.indexed_bytes >= self.size
+
+    @property
+    def line_count(self):
+        """Lines known so far, the final count once the index is complete."""
+        return self.newlines + 1
+
+    def estimated_line_count(self):
+        if self.complete or not self.indexed_bytes:
+            return self.line_count
+        return max(self.line_count, self.newlines * self.size // self.indexed_bytes)
+
+    def build_index(self, cancel_event=None):
+        position = 0
+        newlines = 0
+        while position < self.size:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            try:
+                data = self._map[position:position + INDEX_READ_BYTES]
+            except ValueError:  # Closed underneath us
+                return
+            for start in range(0, len(data), INDEX_BLOCK_BYTES):
+                newlines += data.count(b"\n", start, start + INDEX_BLOCK_BYTES)
+                self._block_lines.append(newlines)
+            position += len(data)
+            self.newlines = newlines
+            self.indexed_bytes = position
+
+    def line_offset(self, line):
+        """Byte offset where a 0-based line starts, or None if the index hasn't got that far."""
+        if line <= 0:
+            return self.bom_length
+        if line > self.newlines:
+            return None
+        block = bisect_left(self._block_lines, line) - 1
+        position = block * INDEX_BLOCK_BYTES - 1
+        for _ in range(line - self._block_lines[block]):
+            position = self._map.find(b"\n", position + 1)
+        return position + 1
+
+    def line_of(self, offset):
+        """0-based line containing a byte offset, or None if it is not indexed yet."""
+        if offset >= self.indexed_bytes and not self.complete:
+            return None
+        block = min(offset // INDEX_BLOCK_BYTES, len(self._block_lines) - 1)
+        return self._block_lines[block] + self._map[block * INDEX_BLOCK_BYTES:offset].count(b"\n")
+
+    def read_lines(self, first, count):
+        """Decoded text of count lines starting at line first, without the final newline.
+        Returns (text, start offset), text is cut short after MAX_WINDOW_BYTES."""
+        start = self.line_offset(first)
+        if start is None:
+            return "", None
+        end = start
+        limit = min(self.size, start + MAX_WINDOW_BYTES)
+        for _ in range(count):
+            newline = self._map.find(b"\n", end, limit)
+            if newline == -1:
+                end = limit
+                break
+            end = newline + 1
+        text = self._map[start:end].decode(self._decode_as, errors="replace")
+        return text.replace("\r\n", "\n").rstrip("\n"), start
+
+    def find(self, text, start=0, cancel_event=None):
+        """Byte offset of the next occurrence of text at or after start, or -1. Searches
+        INDEX_READ_BYTES at a time so a worker thread can give up when cancel_event is set."""
+        try:
+            needle = text.encode(self._decode_as)
+        except UnicodeEncodeError:
+            return -1
+        if not needle:
+            return max(start, self.bom_length)
+        start = max(start, self.bom_length)
+        while start < self.size:
+            if cancel_event is not None and cancel_event.is_set():
+                return -1
+            end = min(self.size, start + INDEX_READ_BYTES + len(needle) - 1)  # Matches across a step boundary
+            try:
+                found = self._map.find(needle, start, end)
+            except ValueError:  # Closed underneath us
+                return -1
+            if found != -1 or end >= self.size:
+                return found
+            start = end - len(needle) + 1
+        return -1
+
+    def decoded_length(self, start, end):
+        """Characters between two byte offsets, used to turn byte positions into Tk columns."""
+        return len(self._map[start:end].decode(self._decode_as, errors="replace"))
+
+    def close(self):
+        self._map.close()
+        self._file.close()
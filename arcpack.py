@@ -0,0 +1,250 @@
+import lzma
+import struct
+import zlib
+from array import array
+from bisect import bisect_right
+import threading
+from collections import OrderedDict
+
+# Compressed .arc files. The text is stored as UTF-8, cut into fixed-size chunks that are compressed
+# one by one, followed by an index of where each chunk starts and how many newlines come before it:
+#
+#   header   MAGIC, version, method, chunk size
+#   chunks   compressed independently, so any one of them can be read without the others
+#   index    per chunk: offset in the file, compressed length, newlines before it
+#   footer   index offset, chunk count, text bytes, newlines, END_MAGIC
+#
+# The editor loads small files by decompressing them front to back; big ones are shown through
+# PackedFile, which only decompresses the chunks on screen or being searched.
+
+MAGIC = b"ARCPACK\x00"
+END_MAGIC = b"ARCPKEND"
+VERSION = 1
+CHUNK_BYTES = 256 * 1024  # Text bytes per chunk, a view or search decompresses this much at a time
+CACHED_CHUNKS = 16  # Decompressed chunks PackedFile keeps around, 4 MB
+MAX_WINDOW_BYTES = 1024 * 1024  # Same cut-off for a window of lines as arcmapped
+_HEADER = struct.Struct("<8sBBI")
+_INDEX_ENTRY = struct.Struct("<QIQ")
+_FOOTER = struct.Struct("<QQQQ8s")
+
+# Encoding names for packed files, so they go wherever an encoding goes (Document.encoding, journal
+# manifests, save jobs) and a save writes them back the same way. The text inside is always UTF-8.
+PACKED_ENCODINGS = {"utf-8+zlib": 1, "utf-8+lzma": 2}
+_METHOD_ENCODINGS = {method: encoding for encoding, method in PACKED_ENCODINGS.items()}
+
+
+def _compress(method, data):
+    if method == 1:
+        return zlib.compress(data, 6)
+    return lzma.compress(data, preset=6)
+
+
+def _decompress(method, data):
+    try:
+        if method == 1:
+            return zlib.decompress(data)
+        return lzma.decompress(data)
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ValueError(f"The packed .arc file is damaged: {e}") from None
+
+
+def is_packed(prefix):
+    return prefix.startswith(MAGIC)
+
+
+def pack_chunks(chunks, encoding, progress=None):
+    """Yields the bytes of a packed file holding the text chunks, for atomic_write. progress is called
+    with the number of characters packed so far."""
+    method = PACKED_ENCODINGS[encoding]
+    yield _HEADER.pack(MAGIC, VERSION, method, CHUNK_BYTES)
+    position = _HEADER.size
+    index = []
+    newlines = total = characters = 0
+    pending = bytearray()
+
+    def flush(data):
+        nonlocal position, newlines
+        compressed = _compress(method, data)
+        index.append(_INDEX_ENTRY.pack(position, len(compressed), newlines))
+        newlines += data.count(b"\n")
+        position += len(compressed)
+        return compressed
+
+    for chunk in chunks:
+        pending += chunk.encode("utf-8")
+        characters += len(chunk)
+        while len(pending) >= CHUNK_BYTES:
+            yield flush(bytes(pending[:CHUNK_BYTES]))
+            total += CHUNK_BYTES
+            del pending[:CHUNK_BYTES]
+        if progress:
+            progress(characters)
+    if pending:
+        yield flush(bytes(pending))
+        total += len(pending)
+    yield b"".join(index)
+    yield _FOOTER.pack(position, len(index), total, newlines, END_MAGIC)
+
+
+def _read_layout(file):
+    """Reads the header, footer and index of an open packed file.
+    Returns (method, chunk size, text bytes, newlines, chunk offsets, lengths, newlines before each)."""
+    file.seek(0)
+    magic, version, method, chunk_bytes = _HEADER.unpack(file.read(_HEADER.size))
+    if magic != MAGIC or version != VERSION or method not in _METHOD_ENCODINGS:
+        raise ValueError("Not a packed .arc file, or one written by a newer editor")
+    size = file.seek(0, 2)
+    if size < _HEADER.size + _FOOTER.size:
+        raise ValueError("The packed .arc file is truncated")
+    file.seek(size - _FOOTER.size)
+    index_offset, count, total, newlines, end_magic = _FOOTER.unpack(file.read(_FOOTER.size))
+    if end_magic != END_MAGIC or index_offset + count * _INDEX_ENTRY.size != size - _FOOTER.size:
+        raise ValueError("The packed .arc file is truncated")
+    file.seek(index_offset)
+    data = file.read(count * _INDEX_ENTRY.size)
+    offsets, lengths, before = array("Q"), array("L"), array("Q")
+    for offset, length, lines in _INDEX_ENTRY.iter_unpack(data):
+        offsets.append(offset)
+        lengths.append(length)
+        before.append(lines)
+    return method, chunk_bytes, total, newlines, offsets, lengths, before
+
+
+def unpack_chunks(file):
+    """Reads the index of an open packed file. Returns its encoding and an iterator over the UTF-8
+    bytes stored in it, one chunk at a time. file.tell() moves through the compressed chunks as they
+    are read, for progress bars."""
+    method, _, _, _, offsets, lengths, _ = _read_layout(file)
+
+    def chunks():
+        for offset, length in zip(offsets, lengths):
+            file.seek(offset)
+            yield _decompress(method, file.read(length))
+    return _METHOD_ENCODINGS[method], chunks()
+
+
+def packed_info(path):
+    """(encoding, text bytes) of a packed file, or None if path isn't one."""
+    with open(path, "rb") as file:
+        if not is_packed(file.read(len(MAGIC))):
+            return None
+        method, _, total, _, _, _, _ = _read_layout(file)
+    return _METHOD_ENCODINGS[method], total
+
+
+class PackedFile:
+    """A packed file read in place, with the same methods as arcmapped.MappedFile so the large file
+    view can show it. Offsets are byte offsets into the text. The line index comes from the file,
+    so it is complete as soon as the file is open."""
+
+    supported = True
+    complete = True
+    bom_length = 0
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            (self._method, self._chunk_bytes, self.size, self.newlines,
+             self._offsets, self._lengths, self._before) = _read_layout(self._file)
+        except Exception:
+            self._file.close()
+            raise
+        self.encoding = _METHOD_ENCODINGS[self._method]
+        self.indexed_bytes = self.size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()  # find runs on a worker thread while the view reads lines
+
+    @property
+    def line_count(self):
+        return self.newlines + 1
+
+    def estimated_line_count(self):
+        return self.line_count
+
+    def build_index(self, cancel_event=None):
+        pass  # Stored in the file
+
+    def _chunk(self, number):
+        with self._lock:
+            data = self._cache.get(number)
+            if data is not None:
+                self._cache.move_to_end(number)
+                return data
+            self._file.seek(self._offsets[number])
+            compressed = self._file.read(self._lengths[number])
+        data = _decompress(self._method, compressed)
+        with self._lock:
+            self._cache[number] = data
+            if len(self._cache) > CACHED_CHUNKS:
+                self._cache.popitem(last=False)
+        return data
+
+    def _read(self, start, end):
+        """Text bytes from start to end, decompressing only the chunks they are in."""
+        end = min(end, self.size)
+        parts = []
+        while start < end:
+            number, skip = divmod(start, self._chunk_bytes)
+            data = self._chunk(number)[skip:skip + end - start]
+            parts.append(data)
+            start += len(data)
+        return b"".join(parts)
+
+    def _find(self, needle, start, limit, cancel_event=None):
+        """Like bytes.find over the text, a chunk at a time. Gives up with -1 once cancel_event is set."""
+        if not needle:
+            return start
+        while start < limit:
+            if cancel_event is not None and cancel_event.is_set():
+                return -1
+            end = min(limit, start + self._chunk_bytes + len(needle) - 1)  # Matches across a chunk boundary
+            found = self._read(start, end).find(needle)
+            if found != -1:
+                return start + found
+            if end >= limit:
+                break
+            start = end - len(needle) + 1
+        return -1
+
+    def line_offset(self, line):
+        if line <= 0:
+            return 0
+        if line > self.newlines:
+            return None
+        number = bisect_right(self._before, line - 1) - 1  # The chunk holding the newline before the line
+        data = self._chunk(number)
+        position = -1
+        for _ in range(line - self._before[number]):
+            position = data.find(b"\n", position + 1)
+        return number * self._chunk_bytes + position + 1
+
+    def line_of(self, offset):
+        number = min(offset // self._chunk_bytes, len(self._before) - 1)
+        if number < 0:
+            return 0
+        return self._before[number] + self._chunk(number).count(b"\n", 0, offset - number * self._chunk_bytes)
+
+    def read_lines(self, first, count):
+        start = self.line_offset(first)
+        if start is None:
+            return "", None
+        data = self._read(start, start + MAX_WINDOW_BYTES)
+        end = 0
+        for _ in range(count):
+            newline = data.find(b"\n", end)
+            if newline == -1:
+                end = len(data)
+                break
+            end = newline + 1
+        return data[:end].decode("utf-8", errors="replace").rstrip("\n"), start
+
+    def find(self, text, start=0, cancel_event=None):
+        return self._find(text.encode("utf-8", errors="surrogatepass"), max(start, 0), self.size, cancel_event)
+
+    def decoded_length(self, start, end):
+        return len(self._read(start, end).decode("utf-8", errors="replace"))
+
+    def close(self):
+        self._file.close()
+        self._cache.clear()
@@ -0,0 +1,137 @@
+import json
+import math
+import os
+import time
+
+# Latency histograms for the editor's hot paths. Samples go into log-spaced buckets, so recording one
+# is a few arithmetic operations and the memory used doesn't grow with the number of samples.
+# Percentiles cover the current window plus the one before it, so they follow recent behaviour.
+
+MIN_SECONDS = 0.00001  # Everything faster lands in the first bucket
+BUCKETS_PER_DOUBLING = 8  # Percentiles are accurate to about 9%
+BUCKET_COUNT = 24 * BUCKETS_PER_DOUBLING + 1  # Up to about 168 seconds
+WINDOW_SECONDS = 60
+LOG_MAX_BYTES = 1024 * 1024  # The JSON log rolls over at this size...
+LOG_BACKUPS = 3  # ...keeping this many old files
+
+
+def _bucket(seconds):
+    if seconds <= MIN_SECONDS:
+        return 0
+    return min(int(math.log2(seconds / MIN_SECONDS) * BUCKETS_PER_DOUBLING) + 1, BUCKET_COUNT - 1)
+
+
+def _bucket_seconds(bucket):
+    """Upper bound of a bucket."""
+    return MIN_SECONDS * 2 ** (bucket / BUCKETS_PER_DOUBLING)
+
+
+class LatencyHistogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[_bucket(seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        merged = LatencyHistogram()
+        merged.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        merged.count = self.count + other.count
+        merged.total = self.total + other.total
+        merged.max = max(self.max, other.max)
+        return merged
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        wanted = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return min(_bucket_seconds(bucket), self.max)
+        return self.max
+
+
+class LatencyRecorder:
+    """Named latency histograms over a rolling window. record() does nothing until enabled is set."""
+
+    def __init__(self):
+        self.enabled = False
+        self.samples = 0  # Recorded since startup
+        self._current = {}
+        self._previous = {}
+        self._window_start = time.monotonic()
+
+    def record(self, name, seconds):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if now - self._window_start >= WINDOW_SECONDS:
+            # A gap of more than a window leaves nothing recent to keep
+            self._previous = self._current if now - self._window_start < 2 * WINDOW_SECONDS else {}
+            self._current = {}
+            self._window_start = now
+        histogram = self._current.get(name)
+        if histogram is None:
+            histogram = self._current[name] = LatencyHistogram()
+        histogram.add(seconds)
+        self.samples += 1
+
+    def histogram(self, name):
+        current = self._current.get(name)
+        previous = self._previous.get(name)
+        if current and previous:
+            return current.merge(previous)
+        return current or previous
+
+    def summary(self):
+        """{name: count, mean, p50, p95, p99 and max in milliseconds} for every path with samples."""
+        summary = {}
+        for name in sorted(self._current.keys() | self._previous.keys()):
+            histogram = self.histogram(name)
+            summary[name] = {"count": histogram.count, "mean_ms": round(histogram.total / histogram.count * 1000, 3),
+                             "p50_ms": round(histogram.percentile(0.50) * 1000, 3),
+                             "p95_ms": round(histogram.percentile(0.95) * 1000, 3),
+                             "p99_ms": round(histogram.percentile(0.99) * 1000, 3),
+                             "max_ms": round(histogram.max * 1000, 3)}
+        return summary
+
+
+recorder = LatencyRecorder()  # Shared by everything in the editor
+_exported_samples = 0
+
+
+def open_log(path):
+    """A logger writing JSON lines to path, rolled over at LOG_MAX_BYTES."""
+    import logging.handlers  # Only needed once recording is turned on, keeps it out of startup
+    logger = logging.getLogger("arcnote.latency")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS,
+                                                       encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+    return logger
+
+
+def export(logger):
+    """Writes the current summary as one line of the log. Returns False if nothing new was recorded."""
+    global _exported_samples
+    if recorder.samples == _exported_samples:
+        return False
+    _exported_samples = recorder.samples
+    summary = recorder.summary()
+    logger.info(json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "latency": summary}))
+    return True
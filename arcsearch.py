@@ -0,0 +1,274 @@
+import re
+from bisect import bisect_left, bisect_right
+
+# Find/replace over a document model. scan() walks a snapshot window by window, so it can run on a
+# worker thread while the user keeps typing, and MatchIndex keeps the offsets of the matches in
+# step with later edits without searching the whole text again.
+
+SCAN_CHUNK_CHARS = 1024 * 1024  # Text searched per step
+MAX_MATCH_CHARS = 64 * 1024  # Matches longer than this may be cut at a window boundary
+CONTEXT_CHARS = 256  # Text kept around a window or an edit so ^, \b and lookarounds see their neighbours
+MAX_MATCHES = 100000  # The index stops growing here, keeps edits cheap on pathological searches
+BLOCK_MATCHES = 512  # Matches per block of MatchIndex, about the square root of MAX_MATCHES
+
+
+def compile_pattern(text, regex=False, match_case=True):
+    """Raises re.error for a bad regular expression."""
+    flags = re.MULTILINE if regex else 0
+    if not match_case:
+        flags |= re.IGNORECASE
+    return re.compile(text if regex else re.escape(text), flags)
+
+
+def scan(view, pattern, start=0, end=None, chunk_chars=SCAN_CHUNK_CHARS):
+    """Yields lists of (start, end) offsets of the non-empty matches of pattern that start between start
+    and end, in order, one list per window. A match may run on past end. view is a Document or a Snapshot."""
+    end = len(view) if end is None else min(end, len(view))
+    search_end = min(len(view), end + MAX_MATCH_CHARS)  # Room for a match that starts before end to finish
+    position = start
+    last_end = start
+    while position < end:
+        window_end = min(search_end, position + chunk_chars + MAX_MATCH_CHARS)
+        limit = min(end, position + chunk_chars) if window_end < search_end else end  # Matches must start before this
+        context = min(position, CONTEXT_CHARS)
+        text = view.get_text(position - context, min(len(view), window_end + CONTEXT_CHARS))
+        batch = []
+        next_position = limit
+        for match in pattern.finditer(text, context, context + window_end - position):
+            match_start = position - context + match.start()
+            match_end = position - context + match.end()
+            if match_start >= limit:
+                break
+            if match_end == window_end and window_end < search_end and match_start > position:
+                next_position = match_start  # Might carry on past the window, search again from its start
+                break
+            if match_start == match_end or match_start < last_end:
+                continue
+            batch.append((match_start, match_end))
+            last_end = match_end
+        yield batch
+        position = next_position
+
+
+def expand_replacement(view, pattern, start, end, replacement, regex):
+    """The text that replaces the match at start..end. For a regex, group references in replacement
+    are filled in from the match."""
+    if not regex:
+        return replacement
+    context = min(start, CONTEXT_CHARS)
+    text = view.get_text(start - context, end + CONTEXT_CHARS)
+    match = pattern.match(text, context)
+    if match is None or match.end() != context + end - start:
+        return None  # The text changed since it was found
+    return match.expand(replacement)
+
+
+class MatchIndex:
+    """Sorted, non-overlapping match offsets kept up to date as the document is edited. The matches
+    are kept in blocks of about BLOCK_MATCHES, each with a shift added to all its offsets, so an edit
+    moves the matches after it by touching one block and the shifts of the rest instead of every
+    offset."""
+
+    def __init__(self):
+        self.clear()
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        self._blocks = []  # [shift, starts, ends] with the offsets stored less the shift, never empty
+        self._count = 0
+        self.full = False  # True once MAX_MATCHES was reached and matches were dropped
+
+    def matches(self):
+        """All the matches as (start, end), in order."""
+        return self._slice((0, 0), (len(self._blocks), 0))
+
+    # Positions of matches are (block number, number in the block), the end is (len(blocks), 0).
+
+    def _locate(self, offset, by_end=False, right=False):
+        """Position of the first match whose start (or end) is at or after offset, after it with right."""
+        blocks = self._blocks
+        column = 2 if by_end else 1
+        low, high = 0, len(blocks)
+        while low < high:  # The first block whose last match qualifies
+            middle = (low + high) // 2
+            shift, last = blocks[middle][0], blocks[middle][column][-1]
+            if last + shift > offset or (last + shift == offset and not right):
+                high = middle
+            else:
+                low = middle + 1
+        if low == len(blocks):
+            return low, 0
+        shift, values = blocks[low][0], blocks[low][column]
+        return low, (bisect_right if right else bisect_left)(values, offset - shift)
+
+    def _get(self, position):
+        shift, starts, ends = self._blocks[position[0]]
+        return starts[position[1]] + shift, ends[position[1]] + shift
+
+    def _previous(self, position):
+        """The position before position, or None at the first match."""
+        number, index = position
+        if index:
+            return number, index - 1
+        if number:
+            return number - 1, len(self._blocks[number - 1][1]) - 1
+        return None
+
+    def _slice(self, first, last):
+        """The matches from first up to last as (start, end)."""
+        found = []
+        for number in range(first[0], min(last[0] + 1, len(self._blocks))):
+            shift, starts, ends = self._blocks[number]
+            low = first[1] if number == first[0] else 0
+            high = last[1] if number == last[0] else len(starts)
+            found.extend((start + shift, end + shift) for start, end in zip(starts[low:high], ends[low:high]))
+        return found
+
+    def _delete(self, first, last):
+        """Removes the matches from first up to last and returns them."""
+        if first >= last:
+            return []
+        removed = self._slice(first, last)
+        blocks = self._blocks
+        if first[0] == last[0]:
+            block = blocks[first[0]]
+            del block[1][first[1]:last[1]]
+            del block[2][first[1]:last[1]]
+        else:
+            if last[0] < len(blocks):
+                block = blocks[last[0]]
+                del block[1][:last[1]]
+                del block[2][:last[1]]
+            block = blocks[first[0]]
+            del block[1][first[1]:]
+            del block[2][first[1]:]
+            del blocks[first[0] + 1:last[0]]
+        self._count -= len(removed)
+        self._tidy(first[0] + 1)
+        self._tidy(first[0])
+        return removed
+
+    def _tidy(self, number):
+        """Drops block number if it is empty or merges it into the next one if it got small, so the
+        blocks stay between BLOCK_MATCHES / 2 and BLOCK_MATCHES * 2 matches (bar the last)."""
+        blocks = self._blocks
+        if number >= len(blocks):
+            return
+        if number + 1 < len(blocks) and len(blocks[number][1]) < BLOCK_MATCHES // 2:
+            shift, starts, ends = blocks.pop(number + 1)
+            block = blocks[number]
+            difference = shift - block[0]
+            block[1].extend(start + difference for start in starts)
+            block[2].extend(end + difference for end in ends)
+            self._split(number)
+        elif not blocks[number][1]:
+            del blocks[number]
+
+    def _split(self, number):
+        block = self._blocks[number]
+        if len(block[1]) > 2 * BLOCK_MATCHES:
+            self._blocks.insert(number + 1, [block[0], block[1][BLOCK_MATCHES:], block[2][BLOCK_MATCHES:]])
+            del block[1][BLOCK_MATCHES:]
+            del block[2][BLOCK_MATCHES:]
+
+    def _shift(self, position, delta):
+        """Moves the matches from position on by delta."""
+        number, index = position
+        if number < len(self._blocks) and index:
+            shift, starts, ends = self._blocks[number]
+            starts[index:] = [start + delta for start in starts[index:]]
+            ends[index:] = [end + delta for end in ends[index:]]
+            number += 1
+        for block in self._blocks[number:]:
+            block[0] += delta
+
+    def add(self, matches):
+        """Adds matches, skipping any that overlap one already known (found twice by a scan and an edit)."""
+        for start, end in matches:
+            position = self._locate(start)
+            previous = self._previous(position)
+            if (position[0] < len(self._blocks) and self._get(position)[0] < end) or \
+                    (previous is not None and self._get(previous)[1] > start):
+                continue
+            if self._count >= MAX_MATCHES:
+                self.full = True
+                return
+            if not self._blocks:
+                self._blocks.append([0, [], []])
+            number, index = position
+            if number == len(self._blocks):
+                number, index = number - 1, len(self._blocks[-1][1])
+            shift, starts, ends = self._blocks[number]
+            starts.insert(index, start - shift)
+            ends.insert(index, end - shift)
+            self._count += 1
+            self._split(number)
+
+    def edit(self, offset, deleted, inserted):
+        """Forgets matches touched by an edit and shifts the ones after it. Returns the range that
+        should be searched again, which covers everything the edit could have changed."""
+        edit_end = offset + deleted
+        removed = self._delete(self._locate(offset, by_end=True), self._locate(edit_end, right=True))
+        rescan_start = min(offset, removed[0][0]) if removed else offset
+        rescan_end = max(edit_end, removed[-1][1]) if removed else edit_end
+        delta = inserted - deleted
+        if delta:
+            self._shift(self._locate(edit_end, right=True), delta)
+        return max(rescan_start - CONTEXT_CHARS, 0), rescan_end + delta + CONTEXT_CHARS
+
+    def remove_range(self, start, end):
+        """Drops matches that start inside start..end. Returns the furthest end among them, or end."""
+        removed = self._delete(self._locate(start), self._locate(end))
+        return max([end] + [match_end for _, match_end in removed])
+
+    def rescan(self, view, pattern, start, end):
+        """Searches start..end of view again after an edit (the range edit() returned) and puts what it
+        finds in place of the matches there. The search starts where a search of the whole text would
+        be at that point, after the match before start, and goes on past end while the new matches run
+        over old ones, so the index ends up as a full search would leave it."""
+        previous = self._previous(self._locate(start))
+        start = max(self._get(previous)[1] if previous is not None else 0, start - MAX_MATCH_CHARS)
+        end = self.remove_range(start, end)
+        while True:
+            found = [match for batch in scan(view, pattern, start, end) for match in batch]
+            resume = max(found[-1][1], end) if found else end
+            furthest = self.remove_range(end, resume)  # Old matches the last new one runs over
+            self.add(found)
+            if furthest <= resume:
+                return
+            start, end = resume, furthest  # The old match removed last ended there, nothing is known up to it
+
+    def in_range(self, start, end):
+        """Matches overlapping start..end."""
+        return self._slice(self._locate(start, by_end=True, right=True), self._locate(end))
+
+    def next_after(self, offset, backwards=False):
+        """The first match starting at or after offset (or the last one before it), wrapping around."""
+        if not self._count:
+            return None
+        position = self._locate(offset)
+        if backwards:
+            position = self._previous(position) or (len(self._blocks) - 1, len(self._blocks[-1][1]) - 1)
+        elif position[0] == len(self._blocks):
+            position = (0, 0)
+        return self._get(position)
+
+
+def map_through_edits(matches, edits):
+    """Moves matches found in a snapshot to where they are after edits made since, given as
+    (offset, deleted, inserted) in order. Matches the edits touched are dropped."""
+    mapped = []
+    for start, end in matches:
+        for offset, deleted, inserted in edits:
+            if end <= offset:
+                continue
+            if start >= offset + deleted:
+                start += inserted - deleted
+                end += inserted - deleted
+            else:
+                break
+        else:
+            mapped.append((start, end))
+    return mapped
@@ -0,0 +1,89 @@
+import codecs
+import os
+import shutil
+import threading
+import zlib
+
+from arcjournal import process_alive
+
+# Spill cache for the text of inactive tabs. A tab pushed out of memory has its text written here,
+# compressed, and read back when it is shown again. Only the text goes to disk: the document keeps
+# its path, encoding, undo history and journal, so nothing about the tab changes except where the
+# characters live. Files are private to one editor process and never outlive it.
+
+SPILL_LEVEL = 1  # zlib level, text compresses 3-4x even at the fastest setting
+SPILL_CHUNK_BYTES = 256 * 1024  # Compressed bytes read at a time when restoring
+
+
+class SpillCache:
+    """spill runs on a worker thread, the other methods on the UI. A key is only ever used by one of
+    them at a time, the lock covers the totals they share."""
+
+    def __init__(self, directory):
+        self.parent = directory
+        self.directory = os.path.join(directory, str(os.getpid()))
+        self.spilled_bytes = 0  # Compressed bytes on disk right now
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def _file(self, key):
+        return os.path.join(self.directory, f"{key}.spill")
+
+    def spill(self, key, snapshot):
+        """Writes the text of snapshot under key. Returns the compressed size."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.discard(key)
+        compressor = zlib.compressobj(SPILL_LEVEL)
+        size = 0
+        with open(self._file(key), "wb") as file:
+            for chunk in snapshot.iter_chunks():
+                data = compressor.compress(chunk.encode("utf-8", "surrogatepass"))
+                file.write(data)
+                size += len(data)
+            data = compressor.flush()
+            file.write(data)
+            size += len(data)
+        with self._lock:
+            self._sizes[key] = size
+            self.spilled_bytes += size
+        return size
+
+    def load(self, key):
+        """Yields the text spilled under key in chunks, for Document.restore. The file is removed once
+        it has been read to the end."""
+        decompressor = zlib.decompressobj()
+        decoder = codecs.getincrementaldecoder("utf-8")("surrogatepass")
+        with open(self._file(key), "rb") as file:
+            for data in iter(lambda: file.read(SPILL_CHUNK_BYTES), b""):
+                text = decoder.decode(decompressor.decompress(data))
+                if text:
+                    yield text
+        text = decoder.decode(decompressor.flush(), final=True)
+        if text:
+            yield text
+        self.discard(key)
+
+    def discard(self, key):
+        with self._lock:
+            self.spilled_bytes -= self._sizes.pop(key, 0)
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        """Removes every spilled file, for a clean exit."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        with self._lock:
+            self._sizes = {}
+            self.spilled_bytes = 0
+
+    def remove_stale(self):
+        """Removes the spill files of editors that are no longer running."""
+        try:
+            names = os.listdir(self.parent)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.isdigit() and not process_alive(int(name)):
+                shutil.rmtree(os.path.join(self.parent, name), ignore_errors=True)
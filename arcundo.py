@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+
+from arcdoc import atomic_write
+
+# Undo/redo history kept as deltas. Every edit is (offset, deleted text, inserted text), a step is the
+# list of edits one undo takes back, and runs of typing are merged into a single edit. The history
+# counts the memory it holds and drops its oldest steps once it goes over a cap.
+
+MERGE_PAUSE_SECONDS = 1.0  # Typing after a pause this long starts a new undo step
+MERGE_MAX_CHARS = 256  # ...as does typing past this many characters in one step
+UNDO_FILES_KEPT = 100  # Saved histories beyond this many, oldest first, are deleted
+_MAGIC = b"ARCUNDO1"
+_HEADER = struct.Struct("<I")  # Length of the JSON header
+_STEP = struct.Struct("<dI")  # time, number of edits
+_EDIT = struct.Struct("<QII")  # offset, deleted length, inserted length (both UTF-8 bytes)
+
+
+def _edit_size(edit):
+    return sys.getsizeof(edit) + sys.getsizeof(edit[1]) + sys.getsizeof(edit[2])
+
+
+class _Step:
+    __slots__ = ("edits", "size", "time", "sealed")
+
+    def __init__(self, edits, when):
+        self.edits = edits
+        self.size = sys.getsizeof(edits) + sum(_edit_size(edit) for edit in edits)
+        self.time = when
+        self.sealed = False  # No more typing is merged into a sealed step
+
+
+class UndoHistory:
+    """Undo and redo stacks for one document. record() is a document listener, edits recorded
+    between two close_step() calls form one step."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.paused = False  # Set while the editor applies an undo or redo, so it isn't recorded
+        self.memory = 0  # Bytes held by both stacks, roughly what the Python objects take
+        self.evicted = 0  # Steps dropped to stay under max_bytes
+        self._undo = []
+        self._redo = []
+        self._open = None  # Step still taking edits
+        self._saved = None  # Top of the undo stack when the text matched the file on disk
+
+    def record(self, offset, deleted_text, inserted_text):
+        if self.paused:
+            return
+        now = time.monotonic()
+        if self._redo:
+            self.memory -= sum(step.size for step in self._redo)
+            self._redo = []
+        if self._open is None and self._merge(offset, deleted_text, inserted_text, now):
+            self._open = self._undo[-1]  # Anything else done by the same command joins the run's step
+            return
+        if self._open is None:
+            self._open = _Step([], now)
+            self._open.size = sys.getsizeof(self._open.edits)
+            self.memory += self._open.size
+            self._undo.append(self._open)
+        edit = (offset, deleted_text, inserted_text)
+        self._open.edits.append(edit)
+        self._open.size += _edit_size(edit)
+        self.memory += _edit_size(edit)
+
+    def _merge(self, offset, deleted_text, inserted_text, now):
+        """Folds a one-character edit into the previous step if it continues a run of typing,
+        backspacing or deleting."""
+        if len(deleted_text) + len(inserted_text) != 1 or "\n" in inserted_text or not self._undo:
+            return False
+        step = self._undo[-1]
+        if step.sealed or len(step.edits) != 1 or now - step.time > MERGE_PAUSE_SECONDS:
+            return False
+        last_offset, last_deleted, last_inserted = step.edits[0]
+        if len(last_deleted) + len(last_inserted) >= MERGE_MAX_CHARS:
+            return False
+        if inserted_text and not last_deleted and offset == last_offset + len(last_inserted):
+            edit = (last_offset, "", last_inserted + inserted_text)
+        elif deleted_text and not last_inserted and offset + 1 == last_offset:  # Backspace
+            edit = (offset, deleted_text + last_deleted, "")
+        elif deleted_text and not last_inserted and offset == last_offset:  # Delete
+            edit = (offset, last_deleted + deleted_text, "")
+        else:
+            return False
+        self.memory += _edit_size(edit) - _edit_size(step.edits[0])
+        step.size += _edit_size(edit) - _edit_size(step.edits[0])
+        step.edits[0] = edit
+        step.time = now
+        return True
+
+    def close_step(self):
+        """Ends the current step and drops old steps if the history is over its cap."""
+        self._open = None
+        while self.memory > self.max_bytes and (self._undo or self._redo):
+            if self._undo:
+                step = self._undo.pop(0)
+                if self._saved is None:
+                    self._saved = False  # The saved state can no longer be reached by undoing
+            else:
+                step = self._redo.pop(0)
+            self.memory -= step.size
+            self.evicted += 1
+
+    def separator(self):
+        """Ends the current step and keeps the next edit from being merged into it."""
+        self.close_step()
+        if self._undo:
+            self._undo[-1].sealed = True
+
+    def can_undo(self):
+        return bool(self._undo)
+
+    def can_redo(self):
+        return bool(self._redo)
+
+    def undo(self):
+        """Moves the newest step to the redo stack. Returns the edits that take it back, to be applied
+        in order as (offset, characters to delete, text to insert), or None if there is nothing to undo."""
+        self.close_step()
+        if not self._undo:
+            return None
+        step = self._undo.pop()
+        step.sealed = True
+        self._redo.append(step)
+        return [(offset, len(inserted), deleted) for offset, deleted, inserted in reversed(step.edits)]
+
+    def redo(self):
+        """Like undo, for the newest undone step."""
+        self.close_step()
+        if not self._redo:
+            return None
+        step = self._redo.pop()
+        self._undo.append(step)
+        return [(offset, len(deleted), inserted) for offset, deleted, inserted in step.edits]
+
+    def mark_saved(self):
+        """Remembers that the text now matches the file on disk."""
+        self.separator()
+        self._saved = self._undo[-1] if self._undo else None
+
+    def mark_unsaved(self):
+        """The save failed, no point in the history matches the file any more."""
+        self._saved = False
+
+    def at_saved(self):
+        return (self._undo[-1] if self._undo else None) is self._saved
+
+    def export(self):
+        """The stacks as they are now, for save_history. Call it after mark_saved: sealed steps never
+        change, so the copy can be written out on another thread while editing goes on."""
+        self.close_step()
+        return list(self._undo), list(self._redo)
+
+
+def history_file(directory, path):
+    return os.path.join(directory, hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest() + ".undo")
+
+
+def save_history(directory, path, exported):
+    """Writes exported stacks next to the saved file's fingerprint. Must run after the file is written
+    and while it still holds the text the stacks end at."""
+    undo, redo = exported
+    stat = os.stat(path)
+    header = json.dumps({"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                         "undo": len(undo), "redo": len(redo)}).encode("utf-8")
+    data = bytearray(_MAGIC)
+    data += _HEADER.pack(len(header))
+    data += header
+    for step in undo + redo:
+        data += _STEP.pack(step.time, len(step.edits))
+        for offset, deleted, inserted in step.edits:
+            deleted = deleted.encode("utf-8")
+            inserted = inserted.encode("utf-8")
+            data += _EDIT.pack(offset, len(deleted), len(inserted))
+            data += deleted
+            data += inserted
+    os.makedirs(directory, exist_ok=True)
+    atomic_write(history_file(directory, path), [bytes(data)], None)
+    _prune(directory)
+
+
+def _prune(directory):
+    files = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".undo")]
+    if len(files) > UNDO_FILES_KEPT:
+        files.sort(key=os.path.getmtime)
+        for file_path in files[:-UNDO_FILES_KEPT]:
+            os.remove(file_path)
+
+
+def load_history(directory, path, max_bytes):
+    """The history saved for path, or None if there is none or the file changed since it was saved."""
+    try:
+        with open(history_file(directory, path), "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        return None
+    if not data.startswith(_MAGIC):
+        return None
+    position = len(_MAGIC)
+    (header_length,) = _HEADER.unpack_from(data, position)
+    position += _HEADER.size
+    header = json.loads(data[position:position + header_length])
+    position += header_length
+    stat = os.stat(path)
+    if header["path"] != os.path.abspath(path) or (stat.st_size, stat.st_mtime_ns) != (header["size"], header["mtime_ns"]):
+        return None
+    steps = []
+    for _ in range(header["undo"] + header["redo"]):
+        when, count = _STEP.unpack_from(data, position)
+        position += _STEP.size
+        edits = []
+        for _ in range(count):
+            offset, deleted_length, inserted_length = _EDIT.unpack_from(data, position)
+            position += _EDIT.size
+            deleted = data[position:position + deleted_length].decode("utf-8")
+            position += deleted_length
+            inserted = data[position:position + inserted_length].decode("utf-8")
+            position += inserted_length
+            edits.append((offset, deleted, inserted))
+        step = _Step(edits, when)
+        step.sealed = True
+        steps.append(step)
+    history = UndoHistory(max_bytes)
+    history._undo = steps[:header["undo"]]
+    history._redo = steps[header["undo"]:]
+    history.memory = sum(step.size for step in steps)
+    history._saved = history._undo[-1] if history._undo else None
+    history.close_step()
+    return history
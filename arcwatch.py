@@ -0,0 +1,285 @@
+import ctypes
+import difflib
+import os
+import select
+import sys
+import threading
+
+# Notices when files open in the editor are changed by another program, and works out what changed.
+# FileWatcher compares (mtime, size, inode) stamps on a background thread. On Linux it sleeps on
+# inotify between checks, watching the directories of the files so atomic saves (a rename over the
+# file) are seen too; elsewhere it polls. diff_texts and merge turn the new file into a few edits,
+# so the editor can patch its buffer instead of reloading it. A file that only grew, like a log, is
+# recognised by its FileSample and only the new bytes are read, on the watcher thread.
+
+POLL_SECONDS = 1.0  # Stat every file this often when there is no inotify...
+INOTIFY_POLL_SECONDS = 10.0  # ...and this often with it, for file systems that don't report changes
+MAX_DIFF_LINES = 20000  # Bigger changed regions are replaced in one edit instead of diffed line by line
+SAMPLE_BYTES = 16 * 1024  # Kept from the start and the end of a file, see FileSample
+_IN_MASK = (0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200)  # MODIFY ATTRIB CLOSE_WRITE MOVED_FROM MOVED_TO CREATE DELETE
+
+
+def file_stamp(path):
+    """What a change to the file would change, or None if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino, stat.st_dev
+
+
+def _inotify_init():
+    if not sys.platform.startswith("linux"):
+        return None, None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None, None
+    if fd < 0:
+        return None, None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc, fd
+
+
+class FileWatcher:
+    """Calls on_change(key, path, stamp, appended) on its own thread when a watched file's stamp
+    changes. stamp is None once the file is gone. For a file watched with a FileSample that was only
+    added to, appended is (the old sample, the new bytes, the new sample), otherwise None."""
+
+    def __init__(self, on_change):
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._files = {}  # key -> [path, last stamp, FileSample of what the caller has or None]
+        self._directories = {}  # directory -> [inotify watch descriptor, number of files in it]
+        self._libc, self._fd = _inotify_init()
+        self.using_inotify = self._fd is not None
+        self._wake = threading.Event()  # Polling sleeps on this...
+        if self.using_inotify:
+            self._wake_read, self._wake_write = os.pipe()  # ...inotify on this, next to the inotify fd
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def watch(self, key, path, stamp, sample=None):
+        """Starts watching path under key. stamp is the state the caller knows the file in, a
+        change from it is reported even if it happened before this call. sample is the FileSample
+        of the bytes the caller has, if appends should be read for it."""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._forget(key)
+            self._files[key] = [path, stamp, sample]
+            directory = os.path.dirname(path)
+            entry = self._directories.get(directory)
+            if entry is None:
+                wd = -1
+                if self._fd is not None:
+                    wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _IN_MASK)  # -1: polled
+                entry = self._directories[directory] = [wd, 0]
+            entry[1] += 1
+        self._wake_up()  # Check it now
+
+    def unwatch(self, key):
+        with self._lock:
+            self._forget(key)
+
+    def acknowledge(self, key, stamp, sample=None):
+        """The caller changed the file itself or read it again, don't report it. sample is the
+        FileSample of what the caller has now."""
+        with self._lock:
+            if key in self._files:
+                self._files[key][1:] = [stamp, sample]
+
+    def _forget(self, key):
+        watched = self._files.pop(key, None)
+        if watched is None:
+            return
+        directory = os.path.dirname(watched[0])
+        entry = self._directories[directory]
+        entry[1] -= 1
+        if not entry[1]:
+            del self._directories[directory]
+            if entry[0] >= 0:
+                self._libc.inotify_rm_watch(self._fd, entry[0])
+
+    def close(self):
+        self._closed = True
+        self._wake_up()
+
+    def _wake_up(self):
+        if self.using_inotify:
+            os.write(self._wake_write, b"x")
+        else:
+            self._wake.set()
+
+    def _run(self):
+        while not self._closed:
+            if self.using_inotify:
+                ready, _, _ = select.select([self._wake_read, self._fd], [], [], INOTIFY_POLL_SECONDS)
+                if self._wake_read in ready:
+                    os.read(self._wake_read, 4096)
+                if self._fd in ready:
+                    # Which file an event is about isn't worth sorting out for a few open files, they all get a stat
+                    try:
+                        while os.read(self._fd, 64 * 1024):
+                            pass
+                    except BlockingIOError:
+                        pass
+            else:
+                self._wake.wait(POLL_SECONDS)
+                self._wake.clear()
+            self._check()
+        if self.using_inotify:
+            os.close(self._wake_read)
+            os.close(self._wake_write)
+            os.close(self._fd)
+
+    def _check(self):
+        with self._lock:
+            watched = [(key, path, stamp, sample) for key, (path, stamp, sample) in self._files.items()]
+        for key, path, stamp, sample in watched:
+            new_stamp = file_stamp(path)
+            if new_stamp == stamp:
+                continue
+            appended = None
+            if sample is not None and stamp is not None and new_stamp is not None and new_stamp[2:] == stamp[2:]:
+                appended = read_appended(path, sample)  # Same inode, so perhaps written to in place
+            with self._lock:
+                if self._files.get(key) != [path, stamp, sample]:  # Unwatched or acknowledged meanwhile
+                    continue
+                self._files[key][1:] = [new_stamp, None if appended is None else appended[1]]
+            try:
+                self._on_change(key, path, new_stamp, None if appended is None else (sample, *appended))
+            except Exception as e:
+                print("Error handling file change:", e)
+
+
+class FileSample:
+    """Size plus the first and last SAMPLE_BYTES of a file's bytes, fed with update() as they are
+    read. Enough to tell a file that was only added to from one that was rewritten, without keeping
+    or re-reading the rest."""
+
+    def __init__(self):
+        self.size = 0
+        self.head = b""
+        self.tail = b""
+
+    def update(self, data):
+        if data:
+            self.size += len(data)
+            if len(self.head) < SAMPLE_BYTES:
+                self.head += data[:SAMPLE_BYTES - len(self.head)]
+            self.tail = (self.tail + data[-SAMPLE_BYTES:])[-SAMPLE_BYTES:]
+
+    def copy(self):
+        other = FileSample()
+        other.size, other.head, other.tail = self.size, self.head, self.tail
+        return other
+
+
+def sample_file(path):
+    """FileSample of the file at path, or None if it can't be read. Reads only the samples."""
+    sample = FileSample()
+    try:
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            sample.head = file.read(SAMPLE_BYTES)
+            file.seek(max(size - SAMPLE_BYTES, 0))
+            sample.tail = file.read(SAMPLE_BYTES)
+            sample.size = size
+    except OSError:
+        return None
+    return sample
+
+
+def read_appended(path, known):
+    """If the file at path looks like the bytes known was fed plus some more, its head and the end of
+    those bytes unchanged, returns (the new bytes, FileSample of the whole file). Returns None if the
+    file was changed any other way. Reads the samples and the new bytes, not the rest."""
+    if not known.size or known.tail[-1:] == b"\r":
+        return None  # An empty file's encoding isn't known yet, and a \n after a \r is no new line
+    try:
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size <= known.size or file.read(len(known.head)) != known.head:
+                return None
+            file.seek(known.size - len(known.tail))
+            if file.read(len(known.tail)) != known.tail:
+                return None
+            appended = file.read()
+    except OSError:
+        return None
+    sample = known.copy()
+    sample.update(appended)
+    return appended, sample
+
+
+def _common_prefix(a, b):
+    """Length of the common prefix, found by comparing halves so the work is done by memcmp."""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _common_suffix(a, b, limit):
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:len(a) - low] == b[len(b) - middle:len(b) - low]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def diff_texts(old, new):
+    """Edits that turn old into new, as (offset in old, deleted length, inserted text), in order.
+    Text appended to a log comes out as a single insert at the end."""
+    prefix = _common_prefix(old, new)
+    suffix = _common_suffix(old, new, min(len(old), len(new)) - prefix)
+    old_middle = old[prefix:len(old) - suffix]
+    new_middle = new[prefix:len(new) - suffix]
+    if not old_middle and not new_middle:
+        return []
+    old_lines = old_middle.splitlines(keepends=True)
+    new_lines = new_middle.splitlines(keepends=True)
+    if not old_lines or not new_lines or len(old_lines) + len(new_lines) > MAX_DIFF_LINES:
+        return [(prefix, len(old_middle), new_middle)]
+    edits = []
+    old_starts = [prefix]
+    for line in old_lines:
+        old_starts.append(old_starts[-1] + len(line))
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, old_first, old_last, new_first, new_last in matcher.get_opcodes():
+        if tag != "equal":
+            edits.append((old_starts[old_first], old_starts[old_last] - old_starts[old_first],
+                          "".join(new_lines[new_first:new_last])))
+    return edits
+
+
+def merge(base, mine, theirs):
+    """Three-way merge of the file's new text (theirs) into the buffer (mine), both descended from
+    base. Returns the edits to apply to mine, last first so each offset is still valid when it is
+    applied, or None if both sides changed the same or neighbouring text differently."""
+    my_edits = diff_texts(base, mine)
+    result = []
+    shift = 0  # How far my edits so far moved the text
+    index = 0
+    for offset, length, text in diff_texts(base, theirs):
+        while index < len(my_edits) and my_edits[index][0] + my_edits[index][1] < offset:
+            shift += len(my_edits[index][2]) - my_edits[index][1]
+            index += 1
+        if index < len(my_edits) and my_edits[index][0] <= offset + length:  # The two edits touch
+            if my_edits[index] != (offset, length, text):
+                return None
+            shift += len(text) - length  # The same change on both sides, mine has it already
+            index += 1
+            continue
+        result.append((offset + shift, length, text))
+    result.reverse()
+    return result
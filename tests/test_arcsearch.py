@@ -0,0 +1,73 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import arcsearch
+from arcdoc import Document
+
+
+def full_search(document, pattern):
+    return [match for batch in arcsearch.scan(document, pattern) for match in batch]
+
+
+def indexed(document, pattern):
+    index = arcsearch.MatchIndex()
+    index.add(full_search(document, pattern))
+    return index
+
+
+def edit(document, index, pattern, offset, deleted, inserted):
+    """What find_on_edit does."""
+    if deleted:
+        document.delete(offset, deleted)
+    if inserted:
+        document.insert(offset, inserted)
+    start, end = index.edit(offset, deleted, len(inserted))
+    index.rescan(document, pattern, start, end)
+
+
+def test_match_running_past_the_rescanned_range_is_kept():
+    document = Document("x" * 755 + "abc" + "x" * 500)
+    pattern = arcsearch.compile_pattern("abc")
+    index = indexed(document, pattern)
+    edit(document, index, pattern, 500, 0, "y")
+    assert index.matches() == [(756, 759)]
+
+
+def test_edits_leave_the_index_as_a_full_search_would():
+    rng = random.Random(1)
+    for _ in range(300):
+        pattern = arcsearch.compile_pattern(rng.choice(["abc", "a+b", "ab|bc", "x{3}", "x+", r"\bx", "^x", ".$"]), True)
+        document = Document("".join(rng.choice("abcx\n" * 3 + "x" * 50) for _ in range(rng.randrange(3000))))
+        index = indexed(document, pattern)
+        for _ in range(5):
+            offset = rng.randrange(len(document) + 1)
+            deleted = min(rng.randrange(6), len(document) - offset)
+            inserted = "".join(rng.choice("abcx\n") for _ in range(rng.randrange(6)))
+            edit(document, index, pattern, offset, deleted, inserted)
+            assert index.matches() == full_search(document, pattern)
+
+
+def test_small_blocks_split_merge_and_shift_like_one_list(monkeypatch):
+    monkeypatch.setattr(arcsearch, "BLOCK_MATCHES", 4)
+    rng = random.Random(2)
+    for _ in range(100):
+        pattern = arcsearch.compile_pattern(rng.choice(["a", "ab", "x+"]), True)
+        document = Document("".join(rng.choice("abx") for _ in range(rng.randrange(400))))
+        index = indexed(document, pattern)
+        for _ in range(20):
+            offset = rng.randrange(len(document) + 1)
+            deleted = min(rng.randrange(40), len(document) - offset)
+            inserted = "".join(rng.choice("abx") for _ in range(rng.randrange(40)))
+            edit(document, index, pattern, offset, deleted, inserted)
+            matches = full_search(document, pattern)
+            assert index.matches() == matches
+            start = rng.randrange(len(document) + 1)
+            end = start + rng.randrange(50)
+            assert index.in_range(start, end) == [(s, e) for s, e in matches if e > start and s < end]
+            after = [match for match in matches if match[0] >= start]
+            before = [match for match in matches if match[0] < start]
+            assert index.next_after(start) == (after or matches or [None])[0]
+            assert index.next_after(start, True) == (before or matches or [None])[-1]